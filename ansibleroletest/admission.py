@@ -0,0 +1,119 @@
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+# estimated demand of a container that has no cpu or memory limit, used to
+# decide whether a test (or an image build) can be started
+DEFAULT_DEMAND = {
+    'cpus': 1.0,
+    'memory': 512 * 1024 ** 2
+}
+
+
+class AdmissionController(object):
+    """
+    Keeps track of the cpu and memory reserved by the tests running on a
+    docker host and only lets a test start its containers when its demand
+    fits within the remaining capacity
+    """
+    _controllers = {}
+    _lock = threading.Lock()
+
+    def __init__(self, client, cpus=None, memory=None):
+        self._client = client
+        self._capacity = {'cpus': cpus, 'memory': memory}
+        self._cond = threading.Condition()
+        self.used = {'cpus': 0.0, 'memory': 0}
+        self.running = 0
+
+    @classmethod
+    def get(cls, client):
+        """
+        Returns the controller shared by everything running on the given
+        docker host
+        """
+        with cls._lock:
+            if client.base_url not in cls._controllers:
+                cls._controllers[client.base_url] = cls(client)
+            controller = cls._controllers[client.base_url]
+        controller._load_capacity()
+        return controller
+
+    @property
+    def capacity(self):
+        """
+        The capacity of the docker host, defaults to the number of cpus and
+        the total memory reported by the daemon
+        """
+        return self._capacity
+
+    def _load_capacity(self):
+        """
+        Query the daemon for the parts of the capacity that were not
+        configured. Done before any test waits on the host and outside of the
+        condition, so that a slow daemon never blocks the waiting tests.
+        """
+        if self._capacity['cpus'] is not None and \
+                self._capacity['memory'] is not None:
+            return
+        info = self._client.info()
+        with self._cond:
+            if self._capacity['cpus'] is None:
+                self._capacity['cpus'] = float(info.get('NCPU') or 1)
+            if self._capacity['memory'] is None:
+                self._capacity['memory'] = int(info.get('MemTotal') or 0)
+            self._cond.notify_all()
+
+    def configure(self, cpus=None, memory=None):
+        """
+        Override the capacity reported by the daemon, eg. to keep some room
+        for other jobs on a shared host. By default the whole host (every
+        cpu and all of its memory) is handed out to the tests and to the
+        containers preparing their images.
+        """
+        with self._cond:
+            if cpus is not None:
+                self._capacity['cpus'] = float(cpus)
+            if memory is not None:
+                self._capacity['memory'] = int(memory)
+            self._cond.notify_all()
+        self._load_capacity()
+
+    def fits(self, cpus, memory):
+        # a test that is bigger than the host is still admitted once the
+        # host is idle, otherwise it would wait forever
+        if not self.running:
+            return True
+        capacity = self.capacity
+        return self.used['cpus'] + cpus <= capacity['cpus'] and \
+            (not capacity['memory'] or
+             self.used['memory'] + memory <= capacity['memory'])
+
+    def acquire(self, cpus, memory, waiting=None):
+        """
+        Reserve resources, blocking until they are available
+        :param cpus: number of cpus needed
+        :param memory: memory needed in bytes
+        :param waiting: called once if the reservation has to wait
+        :return: the reservation, to be passed to release
+        """
+        with self._cond:
+            if not self.fits(cpus, memory) and waiting:
+                waiting()
+            while not self.fits(cpus, memory):
+                self._cond.wait()
+            self.used['cpus'] += cpus
+            self.used['memory'] += memory
+            self.running += 1
+        return cpus, memory
+
+    def release(self, reservation):
+        """
+        Release resources reserved with acquire
+        """
+        cpus, memory = reservation
+        with self._cond:
+            self.used['cpus'] -= cpus
+            self.used['memory'] -= memory
+            self.running -= 1
+            self._cond.notify_all()
@@ -0,0 +1,568 @@
+"""
+asyncio based docker backend, an alternative to the docker-py based classes
+of the container module for orchestrating many containers from a single event
+loop instead of one thread (and one connection) per blocking call.
+
+The Container, Network and ContainerManager classes below have the same
+methods as their synchronous counterparts, as coroutines. The engine API is
+spoken directly over the unix socket or tcp (with TLS), one connection per
+request. Requires python 3.6+.
+"""
+import asyncio
+import json
+import ssl
+import struct
+
+from urllib.parse import quote, urlencode, urlparse
+
+from docker.utils import kwargs_from_env
+
+from .container import ExecuteReturnCodeError, OOMKilled, Dead, Paused, \
+    Running, Restarting, Stopped
+from .docker import environment as docker_environment
+from .runs import cleared_labels, labels
+
+API_VERSION = '1.22'
+DEFAULT_UNIX_SOCKET = 'unix:///var/run/docker.sock'
+
+
+class APIError(Exception):
+    def __init__(self, method, path, status, explanation):
+        super(APIError, self).__init__(
+            '%s %s returned %d: %s' % (method, path, status, explanation))
+        self.status = status
+        self.explanation = explanation
+
+
+class Response(object):
+    """
+    A response from the docker engine, the body is read on demand as the
+    connection is closed once it has been consumed
+    """
+
+    def __init__(self, reader, writer, status, headers):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+
+    @property
+    def chunked(self):
+        return self.headers.get('transfer-encoding', '').lower() == 'chunked'
+
+    async def chunks(self):
+        """
+        Yields the body as it is received
+        """
+        try:
+            if self.chunked:
+                while True:
+                    size = int((await self.reader.readline()).split(b';')[0],
+                               16)
+                    if not size:
+                        break
+                    yield await self.reader.readexactly(size)
+                    await self.reader.readline()
+            elif 'content-length' in self.headers:
+                length = int(self.headers['content-length'])
+                if length:
+                    yield await self.reader.readexactly(length)
+            else:
+                # hijacked connections (exec start) stream until closed
+                while True:
+                    data = await self.reader.read(65536)
+                    if not data:
+                        break
+                    yield data
+        finally:
+            self.close()
+
+    async def read(self):
+        return b''.join([chunk async for chunk in self.chunks()])
+
+    async def json(self):
+        body = await self.read()
+        return body and json.loads(body.decode('utf-8')) or None
+
+    def close(self):
+        self.writer.close()
+
+
+class Client(object):
+    """
+    Minimal asynchronous docker engine client, only implements the calls
+    needed by the test framework
+    """
+
+    def __init__(self, base_url=None, tls=None, version=API_VERSION):
+        self.base_url = base_url or DEFAULT_UNIX_SOCKET
+        self.version = version
+        self._ssl = None
+
+        if tls:
+            self._ssl = ssl.create_default_context(cafile=tls.ca_cert)
+            self._ssl.check_hostname = False
+            if not tls.verify:
+                self._ssl.verify_mode = ssl.CERT_NONE
+            if getattr(tls, 'cert', None):
+                self._ssl.load_cert_chain(*tls.cert)
+
+    async def _connect(self):
+        url = urlparse(self.base_url)
+        if url.scheme in ('unix', 'http+unix'):
+            return await asyncio.open_unix_connection(url.path)
+        return await asyncio.open_connection(
+            url.hostname, url.port or (self._ssl and 2376 or 2375),
+            ssl=self._ssl)
+
+    async def request(self, method, path, params=None, body=None,
+                      headers=None):
+        """
+        Send a request to the engine
+        :param method: http method
+        :param path: api path, without the version prefix
+        :param params: dict of query string parameters, None values are
+                       skipped
+        :param body: object sent as json
+        :return: Response, raises APIError on a 4xx/5xx status
+        """
+        path = '/v%s%s' % (self.version, path)
+        if params:
+            params = dict((k, v) for k, v in params.items() if v is not None)
+            if params:
+                path += '?' + urlencode(params)
+
+        data = b''
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: docker',
+                 'Connection: close',
+                 'Content-Length: %d' % len(data)]
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        for key, value in (headers or {}).items():
+            lines.append('%s: %s' % (key, value))
+
+        reader, writer = await self._connect()
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + data)
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        response_headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+
+        response = Response(reader, writer, status, response_headers)
+        if status >= 400:
+            body = (await response.read()).decode('utf-8', 'replace')
+            try:
+                body = json.loads(body).get('message', body)
+            except (ValueError, AttributeError):
+                pass
+            raise APIError(method, path, status, body.strip())
+        return response
+
+    async def call(self, method, path, params=None, body=None):
+        """
+        Send a request and return its decoded json body
+        """
+        response = await self.request(method, path, params, body)
+        return await response.json()
+
+    async def image_exists(self, image):
+        try:
+            await self.call('GET', '/images/%s/json' % quote(image, safe=''))
+            return True
+        except APIError as e:
+            if e.status == 404:
+                return False
+            raise
+
+    async def pull(self, image, progress=None):
+        """
+        Pull an image, progress receives each status line as bytes like
+        docker-py's streaming pull
+        """
+        repository, _, tag = image.rpartition(':')
+        if not repository or '/' in tag:
+            repository, tag = image, 'latest'
+        response = await self.request('POST', '/images/create', {
+            'fromImage': repository, 'tag': tag})
+        buf = b''
+        async for chunk in response.chunks():
+            buf += chunk
+            while b'\n' in buf:
+                line, buf = buf.split(b'\n', 1)
+                if not line.strip():
+                    continue
+                status = json.loads(line.decode('utf-8'))
+                if 'error' in status:
+                    raise APIError('POST', '/images/create', 500,
+                                   status['error'])
+                if progress:
+                    progress(line)
+        if progress:
+            progress('finished')
+
+    async def exec_output(self, container_id, cmd, tty=False, **options):
+        """
+        Start a command in a container, the exit code is left for the caller
+        to check once the output has been consumed
+        :return: the exec id and an async iterator over the output (bytes)
+        """
+        res = await self.call('POST', '/containers/%s/exec' % container_id,
+                              body=_exec_config(cmd, tty, options))
+        response = await self.request(
+            'POST', '/exec/%s/start' % res['Id'],
+            body={'Detach': False, 'Tty': tty})
+        return res['Id'], (tty and response.chunks() or
+                           _demultiplex(response.chunks()))
+
+
+class ImagePuller(object):
+    """
+    Same as container.ImagePuller: an image is pulled once per docker host
+    even when several containers using it are created concurrently
+    """
+
+    def __init__(self):
+        self._pulls = {}
+
+    async def pull(self, client, image, progress=None):
+        """
+        :return: True if the image was pulled by this call
+        """
+        key = (client.base_url, image)
+        owner = key not in self._pulls
+        if owner:
+            self._pulls[key] = asyncio.ensure_future(
+                self._pull(client, image, progress))
+        try:
+            pulled = await asyncio.shield(self._pulls[key])
+        except Exception:
+            self._pulls.pop(key, None)
+            raise
+        return owner and pulled
+
+    async def _pull(self, client, image, progress):
+        if await client.image_exists(image):
+            return False
+        await client.pull(image, progress)
+        return True
+
+
+class Container(object):
+    puller = ImagePuller()
+
+    def __init__(self, client, image, detach=True, **options):
+        self._client = client
+        self._props = {
+            'image': image,
+            'detach': detach,
+            'host_config': {
+                'NetworkMode': 'default'
+            }
+        }
+        self._props.update(options)
+        self._inspected = False
+        self._pulled = False
+
+    @property
+    def id(self):
+        return self._props.get('id')
+
+    @property
+    def image(self):
+        return self._props['image']
+
+    @property
+    def pulled(self):
+        return self._pulled
+
+    async def internal_ip(self):
+        return (await self.inspect())['NetworkSettings']['IPAddress']
+
+    async def state(self):
+        state_info = (await self.inspect(update=True))['State']
+        state = {
+            'status': Stopped,
+            'pid': state_info['Pid'],
+            'started_at': state_info['StartedAt'],
+            'finished_at': state_info['FinishedAt'],
+            'exit_code': state_info['ExitCode'],
+            'error': state_info['Error']
+        }
+        if state_info['OOMKilled']:
+            state['status'] = OOMKilled
+        elif state_info.get('Dead'):
+            state['status'] = Dead
+        elif state_info['Paused']:
+            state['status'] = Paused
+        elif state_info['Running']:
+            state['status'] = Running
+        elif state_info['Restarting']:
+            state['status'] = Restarting
+        return state
+
+    async def commit(self, repository, tag, message, conf=None):
+        conf = dict(conf or {})
+        conf['Labels'] = dict(cleared_labels(), **(conf.get('Labels') or {}))
+        return await self._client.call('POST', '/commit', {
+            'container': self.id, 'repo': repository, 'tag': tag,
+            'comment': message}, body=conf)
+
+    async def content(self, filename):
+        try:
+            return await self.execute(['cat', filename])
+        except ExecuteReturnCodeError:
+            return ''
+
+    async def create(self, start=False, progress=None, **options):
+        self._pulled = await Container.puller.pull(self._client, self.image,
+                                                   progress)
+        self._props.update(options)
+        res = await self._client.call('POST', '/containers/create',
+                                      body=_container_config(self._props))
+        self._props['id'] = res['Id']
+        if start:
+            await self.start()
+        return res['Id']
+
+    async def destroy(self, **options):
+        if not self.id:
+            return
+        if (await self.state())['status'] is Running:
+            await self.stop()
+        await self.remove(**options)
+
+    async def execute(self, cmd, **options):
+        exec_id, output = await self._client.exec_output(self.id, cmd,
+                                                         **options)
+        out = b''.join([chunk async for chunk in output])
+        await self._check_exit_code(exec_id, cmd, out)
+        return out.decode('utf-8')
+
+    async def inspect(self, update=False):
+        if update:
+            self._inspected = False
+        if not self._inspected:
+            self._inspected = await self._client.call(
+                'GET', '/containers/%s/json' % self.id)
+        return self._inspected
+
+    async def remove(self, v=False, force=False):
+        await self._client.call('DELETE', '/containers/%s' % self.id, {
+            'v': v and 1 or 0, 'force': force and 1 or 0})
+
+    async def start(self, progress=None):
+        if not self.id:
+            await self.create(progress=progress)
+        await self._client.call('POST', '/containers/%s/start' % self.id)
+        self._inspected = False
+
+    async def stream(self, cmd, **options):
+        exec_id, output = await self._client.exec_output(self.id, cmd,
+                                                         **options)
+        async for chunk in output:
+            yield chunk.decode('utf-8', 'replace')
+        await self._check_exit_code(exec_id, cmd)
+
+    async def stop(self, timeout=10):
+        await self._client.call('POST', '/containers/%s/stop' % self.id,
+                                {'t': timeout})
+        self._inspected = False
+
+    async def wait(self):
+        return await self._client.call('POST',
+                                       '/containers/%s/wait' % self.id)
+
+    async def _check_exit_code(self, exec_id, cmd, output=None):
+        res = await self._client.call('GET', '/exec/%s/json' % exec_id)
+        if res.get('ExitCode') != 0:
+            raise ExecuteReturnCodeError(cmd[0], res.get('ExitCode'), output)
+
+
+class Network(object):
+    """
+    Same as container.Network
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self.id = None
+        self._connected = []
+
+    async def create(self):
+        res = await self._client.call('POST', '/networks/create', body={
+            'Name': self.name, 'Driver': 'bridge', 'CheckDuplicate': True,
+            'Labels': labels()})
+        self.id = res['Id']
+        return self.id
+
+    async def connect(self, container, aliases=None):
+        await self._client.call(
+            'POST', '/networks/%s/connect' % self.id, body={
+                'Container': container.id,
+                'EndpointConfig': {'Aliases': aliases or []}})
+        self._connected.append(container.id)
+
+    async def disconnect(self, container, force=False):
+        await self._client.call(
+            'POST', '/networks/%s/disconnect' % self.id, body={
+                'Container': container.id, 'Force': force})
+        if container.id in self._connected:
+            self._connected.remove(container.id)
+
+    def networking_config(self, aliases=None):
+        return {'EndpointsConfig': {self.name: {'Aliases': aliases or []}}}
+
+    async def remove(self):
+        if not self.id:
+            return
+        for container_id in self._connected:
+            try:
+                await self._client.call(
+                    'POST', '/networks/%s/disconnect' % self.id, body={
+                        'Container': container_id, 'Force': True})
+            except APIError:
+                pass
+        self._connected = []
+        await self._client.call('DELETE', '/networks/%s' % self.id)
+        self.id = None
+
+
+class ContainerManager(object):
+    """
+    Same as container.ContainerManager, containers are destroyed
+    concurrently
+    """
+
+    def __init__(self, docker):
+        self._docker = docker
+        self._containers = {}
+        self._networks = []
+
+    @property
+    def client(self):
+        return self._docker
+
+    @property
+    def containers(self):
+        return self._containers.copy()
+
+    def new(self):
+        return ContainerManager(self._docker)
+
+    async def create(self, name, progress=None, start=False, **options):
+        self._containers[name] = Container(self._docker, **options)
+        await self._containers[name].create(progress=progress)
+        if start:
+            await self._containers[name].start()
+        return self._containers[name]
+
+    async def create_network(self, name):
+        network = Network(self._docker, name)
+        await network.create()
+        self._networks.append(network)
+        return network
+
+    def detach(self, name):
+        return self._containers.pop(name)
+
+    async def destroy(self, names=None):
+        if not names:
+            names = []
+        if not isinstance(names, list):
+            names = [names]
+        selected = [name for name in self._containers
+                    if not names or name in names]
+        await asyncio.gather(*[self._containers.pop(name).destroy()
+                               for name in selected])
+        if not names:
+            await self.destroy_networks()
+
+    async def destroy_networks(self):
+        while self._networks:
+            await self._networks.pop().remove()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _, __, ___):
+        await self.destroy()
+
+
+def client(base_url=None, cert_path=None, tls_verify=None):
+    """
+    Same as docker.client, for the asynchronous backend
+    """
+    kwargs = kwargs_from_env(environment=docker_environment(
+        base_url, cert_path, tls_verify))
+    base_url = kwargs.get('base_url') or DEFAULT_UNIX_SOCKET
+    return Client(base_url.replace('https://', 'tcp://'), kwargs.get('tls'))
+
+
+def _container_config(props):
+    """
+    Translate the docker-py create_container arguments used by the framework
+    to the engine API
+    """
+    environment = props.get('environment') or {}
+    if isinstance(environment, dict):
+        environment = ['%s=%s' % item for item in environment.items()]
+
+    config = {
+        'Image': props['image'],
+        'Cmd': props.get('command'),
+        'Env': environment,
+        'Tty': props.get('tty', False),
+        'OpenStdin': props.get('stdin_open', False),
+        'AttachStdin': False,
+        'AttachStdout': not props.get('detach', True),
+        'AttachStderr': not props.get('detach', True),
+        'Labels': dict(props.get('labels') or {}, **labels()),
+        'HostConfig': props.get('host_config') or {},
+    }
+    if props.get('networking_config'):
+        config['NetworkingConfig'] = props['networking_config']
+    if props.get('hostname'):
+        config['Hostname'] = props['hostname']
+    return config
+
+
+def _exec_config(cmd, tty, options):
+    if isinstance(cmd, str):
+        cmd = ['sh', '-c', cmd]
+    config = {
+        'Cmd': cmd,
+        'Tty': tty,
+        'AttachStdin': False,
+        'AttachStdout': options.get('stdout', True),
+        'AttachStderr': options.get('stderr', True),
+    }
+    if options.get('user'):
+        config['User'] = options['user']
+    return config
+
+
+async def _demultiplex(chunks):
+    """
+    Strip the headers of a non-tty exec stream, each frame being prefixed by
+    the stream type and its length
+    """
+    buf = b''
+    async for chunk in chunks:
+        buf += chunk
+        while len(buf) >= 8:
+            _, length = struct.unpack('>BxxxL', buf[:8])
+            if len(buf) < 8 + length:
+                break
+            yield buf[8:8 + length]
+            buf = buf[8 + length:]
@@ -0,0 +1,371 @@
+"""
+Programmatic entry point, runs the tests of one or several roles with the
+same options as the test command and returns structured results instead of
+exiting the process. Meant to be used from a long-lived process: docker
+clients, the image and package caches and the history are shared between
+calls.
+
+    from ansibleroletest.api import run
+
+    result = run(['path/to/role'], ansible_versions=['2.1'], jobs=2,
+                 events=lambda event: print(event))
+    for test in result.tests:
+        print(test['role'], test['test'], test['success'], test['duration'])
+"""
+from __future__ import unicode_literals, absolute_import
+
+import io
+import os
+import six
+import threading
+import time
+import uuid
+import yaml
+
+from .admission import AdmissionController
+from .committer import SnapshotCommitter
+from .container import ContainerManager
+from .dependencies import DependencyCache
+from .docker import client as docker_client, configure as docker_configure
+from .framework import TestFramework, mktmpdir
+from .history import RunHistory
+from .output import Console, EventConsole, Output
+from .packages import PackageCache
+from .planner import load_durations
+from .reports import host_results, open_report
+from .runs import interrupted
+from .scheduler import DistributedTestFramework, Endpoint, FrameworkGroup
+from .utils import parse_duration, parse_resources, parse_shard, parse_size, \
+    cache_dir
+from .watchdog import Watchdog
+
+
+class ConfigurationError(ValueError):
+    """
+    Raised when the options of a run are invalid, before anything is started
+    """
+    pass
+
+
+class RunResult(object):
+    """
+    The outcome of a run
+    """
+
+    def __init__(self, code, tests, res, run_dir):
+        """
+        :param code: 0 on success, 1 on error, 2 if no tests were found, same
+                     as the exit code of the test command
+        :param tests: list of test results, see ResultCollector
+        :param res: dict of the success, skip and failed counters
+        :param run_dir: folder containing the logs of the run
+        """
+        self.code = code
+        self.tests = tests
+        self.res = res
+        self.run_dir = run_dir
+
+    @property
+    def success(self):
+        return self.code == 0 and not self.res['failed']
+
+    def to_dict(self):
+        return {
+            'code': self.code,
+            'success': self.success,
+            'tests': self.tests,
+            'res': self.res,
+            'run_dir': self.run_dir
+        }
+
+
+class ResultCollector(object):
+    """
+    A reporter keeping the results of the tests in memory, each finished
+    test is also sent to the event sink
+    """
+
+    def __init__(self, events=None):
+        self.events = events
+        self.tests = []
+        self._lock = threading.Lock()
+
+    def add(self, framework, test, success):
+        shard = getattr(framework, 'shard', None)
+        result = {
+            'role': framework.role_name,
+            'ansible_version': framework.ansible_version,
+            'test': test.name,
+            'test_file': test.test_file,
+            'success': success,
+            'duration': test.duration,
+            'timed_out': test.timed_out,
+            'shard': shard and '%d/%d' % tuple(shard) or None,
+            'log': test.output.path,
+            'hosts': host_results(test)
+        }
+        with self._lock:
+            self.tests.append(result)
+        if self.events:
+            self.events({'event': 'test', 'result': result})
+
+    def close(self):
+        pass
+
+
+def run(roles, config=None, roles_path=None, library_path=None,
+        plugins_action_path=None, plugins_filter_path=None,
+        plugins_lookup_path=None, extra_vars=None, limit=None,
+        skip_tags=None, tags=None, verbosity=None, ansible_versions=None,
+        privileged=False, cache=False, cache_size='2G', save=None,
+        docker_hosts=None, jobs=1, concurrency=4, output_mode=None,
+        reports=None, timeout=None, run_timeout=None, shard=None,
+        history=True, watch=False, reset=False, events=None, run_dir=None,
+        durations=None):
+    """
+    Run the tests of roles, see the test command for the meaning of the
+    options
+    :param roles: list of local paths, git repositories or galaxy roles, a
+                  local folder that is not a role stands for the roles it
+                  contains
+    :param config: path of the config file, or an open file
+    :param ansible_versions: list of ansible versions (default: latest)
+    :param docker_hosts: list of docker urls (default: $DOCKER_HOST)
+    :param reports: list of FORMAT:PATH report specifications
+    :param timeout: timeout of each test, eg. 30m
+    :param run_timeout: timeout of the whole run, eg. 2h
+    :param shard: INDEX/TOTAL string or tuple
+    :param durations: list of NDJSON reports of a previous run, shared by
+                      every worker, to balance the shards by duration
+    :param events: callable receiving a dict for every message (event
+                   "output", with the source, message, nl, err and styles keys)
+                   and finished test (event "test", with the result). When
+                   set, nothing is printed on the terminal.
+    :param run_dir: folder to write the logs in (default: a new folder in
+                    the runs folder of the user's cache folder)
+    :return: RunResult
+    """
+    ansible_paths = {
+        'roles': roles_path,
+        'library': library_path,
+        'plugins': {
+            'action': plugins_action_path,
+            'filter': plugins_filter_path,
+            'lookup': plugins_lookup_path,
+        }
+    }
+
+    options = dict(
+        extra_vars=extra_vars,
+        limit=limit,
+        skip_tags=skip_tags,
+        tags=tags,
+        verbosity=verbosity,
+        privileged=privileged,
+        save=save
+    )
+
+    versions = []
+    for version in ansible_versions or ['latest']:
+        if version not in versions:
+            versions.append(version)
+
+    roles = _expand_roles(roles)
+    if not roles:
+        raise ConfigurationError('no role found')
+
+    content = _load_config(ansible_paths, config)
+    endpoints = _load_endpoints(docker_hosts, jobs, content.get('docker'))
+
+    if watch and (len(roles) > 1 or len(versions) > 1 or
+                  not os.path.isdir(roles[0])):
+        raise ConfigurationError('--watch requires a single local role and '
+                                 'ansible version')
+    if watch and (len(endpoints) > 1 or endpoints[0].capacity > 1):
+        raise ConfigurationError('--watch runs on a single docker host, with '
+                                 '--jobs=1')
+    if reset and not watch:
+        raise ConfigurationError('--reset can only be used with --watch')
+    if durations and not shard:
+        raise ConfigurationError('--durations can only be used with --shard')
+
+    try:
+        if isinstance(shard, six.string_types):
+            shard = parse_shard(shard)
+        watchdog = Watchdog(timeout and parse_duration(timeout),
+                            run_timeout and parse_duration(run_timeout))
+        package_cache = cache and PackageCache(
+            max_size=parse_size(cache_size)) or None
+    except ValueError as e:
+        raise ConfigurationError(str(e))
+
+    try:
+        shard_durations = load_durations(durations or [])
+    except (ValueError, IOError) as e:
+        raise ConfigurationError('invalid durations: %s' % e)
+
+    try:
+        reporters = [open_report(report) for report in reports or []]
+    except (ValueError, IOError) as e:
+        raise ConfigurationError(str(e))
+
+    collector = ResultCollector(events)
+    reporters.append(collector)
+    # the history is always used to order the tests, even when not recorded
+    run_history = RunHistory()
+    if history:
+        reporters.append(run_history)
+
+    # each running test holds a connection while streaming its playbook and
+    # the committers work in the background, size the pools for all of them
+    running = min(concurrency, len(roles) * len(versions))
+    docker_configure(pool_size=running * (
+        2 * max(endpoint.capacity for endpoint in endpoints) +
+        SnapshotCommitter.DEFAULT_WORKERS))
+
+    # limit the resources used by the tests on each docker host
+    resources = content.get('resources')
+    capacity = parse_resources(content.get('capacity'))
+    for endpoint in endpoints:
+        AdmissionController.get(endpoint.client).configure(**capacity)
+
+    # galaxy dependencies are downloaded once for all the frameworks
+    dependency_cache = None
+    if len(roles) * len(versions) > 1:
+        dependency_cache = DependencyCache(mktmpdir())
+
+    if events:
+        console = EventConsole(events)
+    else:
+        concurrent = len(endpoints) > 1 or endpoints[0].capacity > 1 or \
+            len(roles) * len(versions) > 1
+        if not output_mode:
+            output_mode = concurrent and 'status' or 'stream'
+        console = Console(status=output_mode == 'status')
+
+    if not run_dir:
+        run_dir = os.path.join(cache_dir, 'runs', '%s-%s' % (
+            time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:6]))
+    output = Output(console, run_dir)
+    console.echo('logs: %s' % run_dir)
+
+    def _framework(role, version):
+        if len(endpoints) > 1 or endpoints[0].capacity > 1:
+            # each framework schedules its own tests on the docker hosts
+            return DistributedTestFramework(
+                [Endpoint(e.client, e.capacity, e.name) for e in endpoints],
+                role, ansible_paths, version, dependency_cache, resources,
+                output, reporters, package_cache, run_history, shard,
+                watchdog, shard_durations)
+        return TestFramework(ContainerManager(endpoints[0].client), role,
+                             ansible_paths, version, dependency_cache,
+                             resources, output, reporters, package_cache,
+                             run_history, shard, watchdog, shard_durations)
+
+    frameworks = [_framework(role, version)
+                  for role in roles
+                  for version in versions]
+
+    # a previous run of the same process may have been interrupted
+    interrupted.clear()
+
+    try:
+        if watch:
+            del options['save']
+            framework = frameworks[0]
+            code = framework.watch(reset=reset, **options)
+        else:
+            if len(frameworks) > 1:
+                framework = FrameworkGroup(frameworks, concurrency)
+            else:
+                framework = frameworks[0]
+            code = framework.run(**options)
+    finally:
+        if dependency_cache:
+            dependency_cache.cleanup()
+        for reporter in reporters:
+            reporter.close()
+
+    return RunResult(code, collector.tests, framework.res, run_dir)
+
+
+def _expand_roles(roles):
+    """
+    Replace local folders that are not roles (no tasks or meta folder) by
+    the roles they contain
+    :param roles: list of roles as given on the command line
+    :return: list of roles
+    """
+    expanded = []
+    for role in roles:
+        if not os.path.isdir(role) or _is_role(role):
+            expanded.append(role)
+            continue
+        expanded += sorted(
+            os.path.join(role, name)
+            for name in os.listdir(role)
+            if _is_role(os.path.join(role, name))
+        )
+    return expanded
+
+
+def _is_role(path):
+    return os.path.isdir(os.path.join(path, 'tasks')) or \
+        os.path.isdir(os.path.join(path, 'meta'))
+
+
+def _load_endpoints(docker_hosts, jobs, hosts_config=None):
+    """
+    Build the list of docker hosts to run the tests on, hosts given on the
+    command line take precedence over the ones in the config file
+    :param docker_hosts: list of docker urls
+    :param jobs: default number of concurrent tests per host
+    :param hosts_config: list of hosts from the config file, either urls or
+                         dicts with the url, cert_path, tls_verify and
+                         capacity keys
+    :return: list of Endpoint
+    """
+    if docker_hosts:
+        hosts_config = list(docker_hosts)
+
+    if not hosts_config:
+        return [Endpoint(docker_client(), capacity=jobs)]
+
+    endpoints = []
+    for host in hosts_config:
+        if isinstance(host, six.string_types):
+            host = {'url': host}
+        endpoints.append(Endpoint(
+            docker_client(host['url'], host.get('cert_path'),
+                          host.get('tls_verify')),
+            capacity=host.get('capacity', jobs),
+            name=host.get('name')
+        ))
+    return endpoints
+
+
+def _load_config(conf, config_file=None):
+    if not config_file:
+        return {}
+
+    if isinstance(config_file, six.string_types):
+        with io.open(config_file, 'rb') as fd:
+            return _load_config(conf, fd)
+
+    base = os.path.dirname(os.path.realpath(config_file.name))
+    content = yaml.load(config_file)
+
+    # merge both objects if the original value is none
+    def _update(obj_from, obj_to):
+        for k, v in six.iteritems(obj_to):
+            if isinstance(v, dict):
+                _update(obj_from[k], v)
+            elif v is None and k in obj_from and obj_from[k]:
+                if obj_from[k].startswith('/'):
+                    obj_to[k] = os.path.join(obj_from[k])
+                else:
+                    obj_to[k] = os.path.join(base, obj_from[k])
+
+    _update(content, conf)
+
+    return content
@@ -0,0 +1,292 @@
+from __future__ import unicode_literals, absolute_import
+
+import json
+import os
+import sqlite3
+import time
+
+from .utils import cache_dir
+
+SNAPSHOT_PREFIX = 'art/'
+
+
+def parse_snapshot_name(name):
+    """
+    Split a snapshot name as created by Test.cleanup into its components,
+    eg. art/role.name.centos-7:failed-1433908727-5f0c2e1a (snapshots saved by
+    older versions have no unique suffix)
+    :param name: the snapshot name, with or without the art/ prefix
+    :return: a dict with the role, host, status and date or None if the name
+             is not a snapshot name
+    """
+    if name.startswith(SNAPSHOT_PREFIX):
+        name = name[len(SNAPSHOT_PREFIX):]
+
+    if ':' not in name:
+        return None
+
+    repo, tag = name.rsplit(':', 1)
+    if '.' not in repo or '-' not in tag:
+        return None
+
+    role, host = repo.rsplit('.', 1)
+    status, date = tag.split('-', 2)[:2]
+    try:
+        date = int(date)
+    except ValueError:
+        return None
+
+    return {
+        'image_name': SNAPSHOT_PREFIX + name,
+        'role': role,
+        'host': host,
+        'status': status,
+        'date': date
+    }
+
+
+class SnapshotCatalog(object):
+    """
+    Local index of the snapshots saved by the test command, avoids having to
+    list and inspect every image on the docker host to find them
+    """
+    COLUMNS = ('image_name', 'image_id', 'role', 'host', 'status', 'date',
+               'task')
+
+    def __init__(self, path=None):
+        if not path:
+            path = os.path.join(cache_dir, 'snapshots.db')
+        self.path = path
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        """
+        Open a new connection to the catalog, creating the schema if needed.
+        Connections are not shared so that the catalog can be used from
+        several threads.
+        """
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                image_name TEXT PRIMARY KEY,
+                image_id TEXT,
+                role TEXT NOT NULL,
+                host TEXT NOT NULL,
+                status TEXT NOT NULL,
+                date INTEGER NOT NULL,
+                task TEXT
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_role
+                ON snapshots (role, date);
+            CREATE INDEX IF NOT EXISTS snapshots_status
+                ON snapshots (status, date);
+            CREATE INDEX IF NOT EXISTS snapshots_date
+                ON snapshots (date);
+        """)
+        return conn
+
+    def add(self, image_name, image_id, role, host, status, date, task=None):
+        """
+        Add or replace a snapshot in the catalog
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO snapshots (%s) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)' % ', '.join(self.COLUMNS),
+                    (image_name, image_id, role, host, status, int(date),
+                     task)
+                )
+        finally:
+            conn.close()
+
+    def get(self, image_name):
+        """
+        Retrieve a single snapshot by name
+        :return: a dict or None if the snapshot is not in the catalog
+        """
+        if not image_name.startswith(SNAPSHOT_PREFIX):
+            image_name = SNAPSHOT_PREFIX + image_name
+
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM snapshots WHERE image_name = ?',
+                               (image_name,)).fetchone()
+            return row and dict(row) or None
+        finally:
+            conn.close()
+
+    def query(self, role=None, host=None, status=None, since=None,
+              until=None, task=None):
+        """
+        Search the catalog, role and host accept shell-like wildcards while
+        task matches any failed task (or timeout reason) containing the
+        given string
+        :param role: role name or pattern
+        :param host: container name or pattern
+        :param status: failed, successful or timeout
+        :param since: only return snapshots created after this timestamp
+        :param until: only return snapshots created before this timestamp
+        :param task: part of the name of the failed task
+        :return: a list of dicts, ordered by date
+        """
+        clauses = []
+        params = []
+        if role:
+            clauses.append('role GLOB ?')
+            params.append(role)
+        if host:
+            clauses.append('host GLOB ?')
+            params.append(host)
+        if status:
+            clauses.append('status = ?')
+            params.append(status)
+        if since is not None:
+            clauses.append('date >= ?')
+            params.append(int(since))
+        if until is not None:
+            clauses.append('date <= ?')
+            params.append(int(until))
+        if task:
+            clauses.append('task LIKE ?')
+            params.append('%' + task + '%')
+
+        sql = 'SELECT * FROM snapshots'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY date, image_name'
+
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+
+    def remove(self, image_name):
+        """
+        Remove a snapshot from the catalog
+        """
+        if not image_name.startswith(SNAPSHOT_PREFIX):
+            image_name = SNAPSHOT_PREFIX + image_name
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM snapshots WHERE image_name = ?',
+                             (image_name,))
+        finally:
+            conn.close()
+
+    def reindex(self, docker):
+        """
+        Rebuild the catalog from the images available on the docker host
+        :param docker: a docker client
+        :return: the number of snapshots indexed
+        """
+        rows = []
+        for image in docker.images():
+            for repotag in image.get('RepoTags') or []:
+                if not repotag.startswith(SNAPSHOT_PREFIX):
+                    continue
+
+                snapshot = parse_snapshot_name(repotag)
+                if not snapshot:
+                    continue
+
+                # snapshots committed in the background are labelled, older
+                # ones need to be inspected to find the failed task
+                labels = image.get('Labels') or {}
+                snapshot['image_id'] = image['Id']
+                snapshot['task'] = None
+                if 'art.task' in labels:
+                    if snapshot['status'] in ('failed', 'timeout'):
+                        snapshot['task'] = labels['art.task'] or None
+                elif snapshot['status'] == 'failed':
+                    snapshot['task'] = _failed_task(docker, repotag)
+
+                rows.append(tuple(snapshot[col] for col in self.COLUMNS))
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM snapshots')
+                conn.executemany(
+                    'INSERT OR REPLACE INTO snapshots (%s) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)' % ', '.join(self.COLUMNS),
+                    rows
+                )
+        finally:
+            conn.close()
+
+        return len(rows)
+
+
+def _failed_task(docker, image_name):
+    """
+    Extract the name of the last task from the receipts stored in the image
+    """
+    try:
+        play = json.loads(docker.inspect_image(image=image_name)
+                          .get('Comment') or '{}')
+    except ValueError:
+        return None
+
+    if not play.get('tasks'):
+        return None
+    return play['tasks'][-1].get('name')
+
+
+def select_expired(snapshots, keep=None, older_than=None, max_size=None,
+                   now=None):
+    """
+    Apply the retention policies to a list of snapshots, if no policy is
+    given every snapshot is considered expired
+    :param snapshots: list of snapshots as returned by SnapshotCatalog.query,
+                      each snapshot needs a size key when max_size is set
+    :param keep: number of snapshots to keep for each role and host
+    :param older_than: expire snapshots older than this number of seconds
+    :param max_size: maximum total size in bytes of the kept snapshots
+    :param now: reference timestamp, defaults to the current time
+    :return: the list of expired snapshots, oldest first
+    """
+    if keep is None and older_than is None and max_size is None:
+        return sorted(snapshots, key=lambda s: s['date'])
+
+    if now is None:
+        now = time.time()
+
+    newest_first = sorted(snapshots, key=lambda s: s['date'], reverse=True)
+    expired = set()
+
+    if keep is not None:
+        seen = {}
+        for snapshot in newest_first:
+            key = (snapshot['role'], snapshot['host'])
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > keep:
+                expired.add(snapshot['image_name'])
+
+    if older_than is not None:
+        for snapshot in newest_first:
+            if snapshot['date'] < now - older_than:
+                expired.add(snapshot['image_name'])
+
+    if max_size is not None:
+        total = 0
+        for snapshot in newest_first:
+            if snapshot['image_name'] in expired:
+                continue
+            total += snapshot.get('size') or 0
+            if total > max_size:
+                expired.add(snapshot['image_name'])
+
+    return [snapshot for snapshot in reversed(newest_first)
+            if snapshot['image_name'] in expired]
@@ -0,0 +1,80 @@
+import click
+import datetime
+import shutil
+import sys
+
+from ansibleroletest.docker import client as docker_client, \
+    configure as docker_configure
+from ansibleroletest.runs import orphaned_containers, orphaned_networks, \
+    remove_containers, remove_networks, stale_dirs
+from ansibleroletest.utils import parse_duration
+
+
+@click.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--older-than', default='1d', metavar='DURATION',
+              help='Runs of other machines, whose process cannot be checked, '
+                   'are considered dead once started more than DURATION ago '
+                   '(default: 1d)')
+@click.option('--docker-host', 'docker_hosts', multiple=True,
+              metavar='DOCKER_HOST',
+              help='Docker host to clean up, can be repeated (defaults to '
+                   '$DOCKER_HOST)')
+@click.option('-j', '--jobs', default=8, type=int,
+              help='Number of containers to remove concurrently')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Only show what would be removed')
+def gc(older_than, docker_hosts, jobs, dry_run):
+    """
+    Remove the containers, networks and temporary folders left behind by runs
+    that were killed before cleaning up
+    """
+    try:
+        max_age = parse_duration(older_than)
+    except ValueError as e:
+        click.secho('error: %s' % str(e), err=True, fg='red')
+        sys.exit(1)
+
+    clients = [docker_client(url) for url in docker_hosts] or \
+        [docker_client()]
+    docker_configure(pool_size=jobs)
+    failed = 0
+
+    for client in clients:
+        prefix = len(clients) > 1 and '%s: ' % client.base_url or ''
+        containers = orphaned_containers(client, max_age)
+        networks = orphaned_networks(client, max_age)
+
+        for container in containers:
+            run = container['run']
+            click.echo('%s%s container %s (%s) of run %s, pid %d on %s '
+                       'started %s' % (
+                           prefix, dry_run and 'Would remove' or 'Removing',
+                           container['name'], container['image'], run['id'],
+                           run['pid'], run['host'],
+                           datetime.datetime.fromtimestamp(
+                               run['started']).isoformat()))
+        for network in networks:
+            click.echo('%s%s network %s of run %s' % (
+                prefix, dry_run and 'Would remove' or 'Removing',
+                network['name'], network['run']['id']))
+
+        if dry_run:
+            continue
+
+        results = remove_containers(client, [c['id'] for c in containers],
+                                    jobs)
+        results += remove_networks(client, [n['id'] for n in networks])
+        for object_id, error in results:
+            if error:
+                failed += 1
+                click.secho('%sfailed: [%s] %s' % (prefix, object_id[:12],
+                                                   error), fg='red')
+
+    for path in stale_dirs(max_age):
+        click.echo('%s folder %s' % (dry_run and 'Would remove' or 'Removing',
+                                     path))
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+
+    if failed:
+        sys.exit(1)
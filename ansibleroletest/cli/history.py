@@ -0,0 +1,121 @@
+import click
+import datetime
+import sys
+import time
+
+from ansibleroletest.history import RunHistory
+from ansibleroletest.utils import format_duration, parse_date
+
+BAR_WIDTH = 30
+# the slowest tasks are averaged over the runs of the last 30 days by
+# default, the query time grows with the number of runs considered
+SLOWEST_SINCE = 30 * 86400
+
+
+@click.command(context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--test', default=None,
+              help='Only show the runs of that test (name of its file)')
+@click.option('--ansible-version', default=None, metavar='ANSIBLE_VERSION',
+              help='Only show the runs using that ansible version')
+@click.option('-n', '--runs', default=10, type=int,
+              help='Number of runs to show for each test (default: 10)')
+@click.option('--slowest', default=10, type=int, metavar='N',
+              help='Number of slowest tasks to show (default: 10)')
+@click.option('--since', default=None, metavar='DATE',
+              help='Only consider runs after DATE for the slowest tasks '
+                   '(YYYY-MM-DD[THH:MM], default: the last 30 days)')
+@click.option('--window', default=10, type=int,
+              help='Number of previous runs the baseline is the median of '
+                   '(default: 10)')
+@click.option('--threshold', default=1.5, type=float,
+              help='Ratio to the baseline above which a duration is a '
+                   'regression (default: 1.5)')
+@click.argument('role', required=False)
+def history(test, ansible_version, runs, slowest, since, window, threshold,
+            role):
+    """
+    Show the duration trend of the tests of ROLE, its slowest tasks and the
+    tests and tasks that got slower in the last run. Without ROLE, list the
+    roles found in the history.
+    """
+    db = RunHistory()
+    if not db.exists:
+        click.echo('No runs recorded yet')
+        return
+
+    try:
+        since = since and parse_date(since) or time.time() - SLOWEST_SINCE
+    except ValueError as e:
+        click.secho('error: %s' % str(e), err=True, fg='red')
+        sys.exit(1)
+
+    if not role:
+        output_fmt = '{role:<40s}{runs:<10s}{date}'
+        click.echo(output_fmt.format(role='ROLE', runs='RUNS',
+                                     date='LAST RUN'))
+        for row in db.roles():
+            click.echo(output_fmt.format(role=row['role'],
+                                         runs=str(row['runs']),
+                                         date=_date(row['date'])))
+        return
+
+    trends = db.trend(role, test=test, ansible_version=ansible_version,
+                      limit=runs)
+    if not trends:
+        click.secho('error: no runs recorded for %s' % role, err=True,
+                    fg='red')
+        sys.exit(1)
+
+    longest = max(run['duration'] or 0
+                  for test_runs in trends.values() for run in test_runs)
+    for name in sorted(trends):
+        _header('TREND [%s]' % name)
+        for run in trends[name]:
+            duration = run['duration'] or 0
+            bar = '#' * int(round(BAR_WIDTH * duration / (longest or 1)))
+            click.echo('{date:<21s}{version:<8s}{status} {duration:>9s} '
+                       '{bar}'.format(
+                           date=_date(run['date']),
+                           version=run['ansible_version'] or '-',
+                           status=click.style(
+                               '%-7s' % (run['success'] and 'ok' or 'failed'),
+                               fg=run['success'] and 'green' or 'red'),
+                           duration=format_duration(run['duration']),
+                           bar=bar))
+
+    _header('SLOWEST TASKS [%s]' % role)
+    output_fmt = '{average:>9s} {max:>9s} {runs:>6s}  {test:<20s}{name}'
+    click.echo(output_fmt.format(average='AVERAGE', max='MAX', runs='RUNS',
+                                 test='TEST', name='TASK'))
+    for task in db.slowest_tasks(role, since=since, limit=slowest):
+        click.echo(output_fmt.format(average=format_duration(task['average']),
+                                     max=format_duration(task['max']),
+                                     runs=str(task['runs']),
+                                     test=task['test'],
+                                     name=task['name'] or '-'))
+
+    _header('REGRESSIONS [%s]' % role)
+    regressions = db.regressions(role, window=window, threshold=threshold)
+    if not regressions:
+        click.secho('none, the last runs are within %.1fx of their baseline'
+                    % threshold, fg='green')
+    for regression in regressions:
+        what = regression['task'] and '%s: %s [%s]' % (
+            regression['test'], regression['task'], regression['host']) \
+            or regression['test']
+        click.secho('{baseline:>9s} -> {duration:>9s} (x{ratio:.1f})  '
+                    '{what}'.format(
+                        baseline=format_duration(regression['baseline']),
+                        duration=format_duration(regression['duration']),
+                        ratio=regression['duration'] /
+                        (regression['baseline'] or 1),
+                        what=what), fg='red')
+
+
+def _header(text):
+    click.echo('\n' + text + ' ' + ((78 - len(text)) * '*'))
+
+
+def _date(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime(
+        '%Y-%m-%d %H:%M:%S')
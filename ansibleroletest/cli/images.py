@@ -0,0 +1,222 @@
+import click
+import datetime
+import humanize
+import json
+import sys
+
+from multiprocessing.pool import ThreadPool
+
+from docker.errors import APIError
+
+from ansibleroletest.container import Container
+from ansibleroletest.docker import client as docker_client, \
+    configure as docker_configure
+from ansibleroletest.images import ANSIBLE_VERSIONS, image_status, \
+    referenced_images, superseded_images
+
+
+@click.group(context_settings={'help_option_names': ['-h', '--help']})
+def images():
+    """
+    Manage the box and ansible images used by the tests
+    """
+    pass
+
+
+@images.command(name='warm', context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--ansible-version', default=ANSIBLE_VERSIONS, multiple=True,
+              metavar='ANSIBLE_VERSION',
+              help='Only pull the ansible image of the given version, can be '
+                   'repeated (default: every version)',
+              type=click.Choice(ANSIBLE_VERSIONS))
+@click.option('--docker-host', 'docker_hosts', multiple=True,
+              metavar='DOCKER_HOST',
+              help='Docker host to pull the images on, can be repeated '
+                   '(defaults to $DOCKER_HOST)')
+@click.option('-j', '--jobs', default=4, type=int,
+              help='Number of images to pull concurrently')
+@click.option('--update', is_flag=True, default=False,
+              help='Pull images even if they are available, to get the most '
+                   'recent version of their tag')
+@click.argument('roles', nargs=-1, metavar='[ROLE...]',
+                type=click.Path(exists=True, file_okay=False))
+def images_warm(ansible_version, docker_hosts, jobs, update, roles):
+    """
+    Pull the default boxes, the ansible images and the images used by the
+    test files of the given local roles
+    """
+    names = referenced_images(roles, ansible_version)
+    clients = _clients(docker_hosts)
+    jobs_list = [(client, name) for client in clients for name in names]
+
+    def _pull(job):
+        client, name = job
+        try:
+            pulled = Container.puller.pull(client, name, _check_progress,
+                                           force=update)
+            return client, name, pulled, None
+        except (APIError, PullError) as e:
+            return client, name, False, e
+
+    failed = 0
+    docker_configure(pool_size=jobs)
+    pool = ThreadPool(max(1, jobs))
+    try:
+        for client, name, pulled, error in pool.imap_unordered(_pull,
+                                                               jobs_list):
+            prefix = len(clients) > 1 and '%s: ' % client.base_url or ''
+            if error:
+                failed += 1
+                click.secho('%sfailed: [%s] %s' % (prefix, name,
+                                                   _explain(error)),
+                            fg='red')
+            elif pulled:
+                click.secho('%spulled: [%s]' % (prefix, name), fg='yellow')
+            else:
+                click.secho('%sok: [%s]' % (prefix, name), fg='green')
+    finally:
+        pool.close()
+        pool.join()
+
+    if failed:
+        sys.exit(1)
+
+
+@images.command(name='status', context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--docker-host', 'docker_hosts', multiple=True,
+              metavar='DOCKER_HOST',
+              help='Docker host to check, can be repeated (defaults to '
+                   '$DOCKER_HOST)')
+@click.argument('roles', nargs=-1, metavar='[ROLE...]',
+                type=click.Path(exists=True, file_okay=False))
+def images_status(docker_hosts, roles):
+    """
+    Show which of the images used by the tests are available and their digest
+    """
+    names = referenced_images(roles)
+    missing = 0
+
+    output_fmt = '{name:<40s}{status:<10s}{size:<12s}{created:<22s}{digest}'
+    for client in _clients(docker_hosts):
+        if docker_hosts and len(docker_hosts) > 1:
+            click.echo('\n[%s]' % client.base_url)
+        click.echo(output_fmt.format(name='IMAGE', status='STATUS',
+                                     size='SIZE', created='CREATED',
+                                     digest='DIGEST'))
+        for image in image_status(client, names):
+            if not image['id']:
+                missing += 1
+                click.echo(output_fmt.format(
+                    name=image['name'],
+                    status=click.style('%-10s' % 'missing', fg='red'),
+                    size='-', created='-', digest='-'
+                ))
+                continue
+            click.echo(output_fmt.format(
+                name=image['name'],
+                status=click.style('%-10s' % 'ok', fg='green'),
+                size=humanize.naturalsize(image['size'] or 0),
+                created=datetime.datetime.fromtimestamp(
+                    image['created'] or 0).isoformat(),
+                digest=image['digest'] or image['id'][:19]
+            ))
+
+    if missing:
+        click.secho('\n%d images are missing, run "ansible-role-test images '
+                    'warm" to pull them' % missing, fg='blue')
+
+
+@images.command(name='prune', context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--all', 'all_versions', is_flag=True, default=False,
+              help='Also remove box and ansible images that are not used by '
+                   'the default containers or the given roles')
+@click.option('--docker-host', 'docker_hosts', multiple=True,
+              metavar='DOCKER_HOST',
+              help='Docker host to prune, can be repeated (defaults to '
+                   '$DOCKER_HOST)')
+@click.option('-j', '--jobs', default=4, type=int,
+              help='Number of images to delete concurrently')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Only show which images would be deleted')
+@click.argument('roles', nargs=-1, metavar='[ROLE...]',
+                type=click.Path(exists=True, file_okay=False))
+def images_prune(all_versions, docker_hosts, jobs, dry_run, roles):
+    """
+    Delete box and ansible images superseded by a more recent pull
+    """
+    keep = referenced_images(roles)
+    expired = [(client, image)
+               for client in _clients(docker_hosts)
+               for image in superseded_images(client, all_versions, keep)]
+    reclaimed = sum(image['size'] for _, image in expired)
+
+    if not expired:
+        click.echo('No images to delete')
+        return
+
+    if dry_run:
+        for client, image in expired:
+            click.echo('Would delete %s (%s)' % (
+                image['name'], humanize.naturalsize(image['size'])))
+        click.echo('\n%d images, %s would be reclaimed' % (
+            len(expired), humanize.naturalsize(reclaimed)))
+        return
+
+    click.confirm('This will delete %d images (%s)' % (
+        len(expired), humanize.naturalsize(reclaimed)), abort=True)
+
+    def _remove(job):
+        client, image = job
+        try:
+            client.remove_image(image['id'])
+            return image, None
+        except APIError as e:
+            return image, e
+
+    docker_configure(pool_size=jobs)
+    pool = ThreadPool(max(1, jobs))
+    try:
+        for image, error in pool.imap_unordered(_remove, expired):
+            if error:
+                click.secho('Deleting %s ... FAILED [%s]' % (
+                    image['name'], _explain(error)), fg='red')
+            else:
+                click.echo('Deleting %s ... %s' % (
+                    image['name'], click.style('DONE', fg='green')))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class PullError(Exception):
+    pass
+
+
+def _check_progress(line):
+    """
+    Progress callback raising the errors reported while pulling, the docker
+    API returns them in the stream instead of an error status
+    """
+    if line == 'finished':
+        return
+    try:
+        progress = json.loads(line.decode('utf-8'))
+    except ValueError:
+        return
+    if 'error' in progress:
+        raise PullError(progress['error'])
+
+
+def _clients(docker_hosts):
+    if not docker_hosts:
+        return [docker_client()]
+    return [docker_client(url) for url in docker_hosts]
+
+
+def _explain(error):
+    if isinstance(error, APIError) and error.explanation:
+        explanation = error.explanation
+        if isinstance(explanation, bytes):
+            explanation = explanation.decode('utf-8')
+        return explanation
+    return str(error)
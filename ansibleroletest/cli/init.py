@@ -55,6 +55,17 @@ name: "{role_name}"
 #  - slave1
 #  - slave2
 #  - slave3
+# Slow setup shared by every run (eg. installing EPEL or build tools) can be
+# moved to a prepare playbook, it is run once per box image and the result is
+# saved as a derived image that the tests start from. It is only run again when
+# this section or the box image changes.
+#prepare:
+#- hosts: all
+#  tasks:
+#  - yum: name=epel-release state=present
+# The playbook is killed and the test fails if it runs for longer than this,
+# overrides the --timeout option
+#timeout: 30m
 # This is your test playbook
 playbook:
 - hosts: all
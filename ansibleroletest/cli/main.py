@@ -1,25 +1,67 @@
 from __future__ import print_function
 
 import click
+import importlib
 import logging
 
-from .init import init
-from .snapshots import snapshots
-from .test import test
-
 logging.captureWarnings(True)
 
+# subcommands, imported only when invoked as they pull docker, yaml and the
+# rest of the framework, the help is duplicated here so that listing the
+# commands does not import them either
+COMMANDS = {
+    'gc': ('ansibleroletest.cli.gc:gc',
+           'Remove the containers and files left behind by dead runs'),
+    'history': ('ansibleroletest.cli.history:history',
+                'Show the duration trends and regressions of a role'),
+    'images': ('ansibleroletest.cli.images:images',
+               'Manage the box and ansible images used by the tests'),
+    'init': ('ansibleroletest.cli.init:init',
+             'Create the test folder with a default test file'),
+    'snapshots': ('ansibleroletest.cli.snapshots:snapshots',
+                  'Manipulate saved containers'),
+    'test': ('ansibleroletest.cli.test:test',
+             'Run tests'),
+}
+
+
+class LazyGroup(click.Group):
+    """
+    A click group loading its subcommands from COMMANDS on first use
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(self.commands) | set(COMMANDS))
 
-@click.group()
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in COMMANDS:
+            module, attr = COMMANDS[name][0].split(':')
+            self.add_command(getattr(importlib.import_module(module), attr),
+                             name)
+        return self.commands.get(name)
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in self.commands:
+                command = self.commands[name]
+                rows.append((name, command.short_help or
+                             click.utils.make_default_short_help(
+                                 command.help or '')))
+            else:
+                rows.append((name, COMMANDS[name][1]))
+
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup)
 def cli():
     """
     ansible-role-test is a docker based testing utility for ansible roles.
     """
     pass
 
-cli.add_command(init)
-cli.add_command(snapshots)
-cli.add_command(test)
-
 if __name__ == '__main__':
     cli()
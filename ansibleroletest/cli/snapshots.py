@@ -1,12 +1,21 @@
 import click
 import datetime
+import humanize
 import json
 import sys
 
+from multiprocessing.pool import ThreadPool
+
 from docker.errors import APIError
 
-from ansibleroletest.docker import client as docker_client
+from ansibleroletest.catalog import SnapshotCatalog, SNAPSHOT_PREFIX, \
+    parse_snapshot_name, select_expired
+from ansibleroletest.docker import client as docker_client, \
+    configure as docker_configure
 from ansibleroletest.framework import TestFramework
+from ansibleroletest.receipts import Receipts, filter_tasks, \
+    receipts_file, remove_receipts
+from ansibleroletest.utils import parse_date, parse_duration, parse_size
 
 
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
@@ -18,12 +27,33 @@ def snapshots():
 
 
 @snapshots.command(name='list', context_settings={'help_option_names': ['-h', '--help']})
-@click.option('-f', '--filter', help='Filter by role name')
-def snapshots_list(filter):
+@click.option('-f', '--filter', help='Filter by role name, accepts wildcards')
+@click.option('--host', default=None, help='Filter by container name, accepts wildcards')
+@click.option('--status', default=None,
+              type=click.Choice(['failed', 'successful', 'timeout']),
+              help='Filter by status')
+@click.option('--since', default=None, metavar='DATE',
+              help='Only show snapshots saved after DATE (YYYY-MM-DD[THH:MM])')
+@click.option('--until', default=None, metavar='DATE',
+              help='Only show snapshots saved before DATE (YYYY-MM-DD[THH:MM]), '
+                   'a date without a time includes the whole day')
+@click.option('--task', default=None,
+              help='Only show snapshots that failed or timed out on a task '
+                   'matching TASK')
+@click.option('--reindex', is_flag=True, default=False,
+              help='Rebuild the snapshot index from the docker host')
+def snapshots_list(filter, host, status, since, until, task, reindex):
     """
     List all snapshots and whether they failed or succeeded
     """
-    docker = docker_client()
+    catalog = _catalog(reindex=reindex)
+
+    try:
+        since = since and parse_date(since)
+        until = until and parse_date(until, end_of_day=True)
+    except ValueError as e:
+        click.secho('error: %s' % str(e), err=True, fg='red')
+        sys.exit(1)
 
     output_fmt = '{role_name:<24s}{container:<20s}{status:<16s}{date:<24s}{image_name}'
     click.echo(output_fmt.format(
@@ -33,61 +63,121 @@ def snapshots_list(filter):
         date='DATE',
         image_name='IMAGE NAME'
     ))
-    for image in docker.images():
-        snapshots = [
-            repotag[4:]
-            for repotag in image.get('RepoTags', [])
-            if repotag.startswith('art/')
-        ]
-
-        if not snapshots:
-            continue
-
-        for snapshot in snapshots:
-            repo, tag = snapshot.split(':')
-            role_name = repo.split('.')
-            container = role_name.pop()
-            role_name = '.'.join(role_name)
-            state, date = tag.split('-')
-
-            if filter and role_name != filter:
-                continue
-
-            click.echo(output_fmt.format(
-                role_name=role_name,
-                container=container,
-                status=state,
-                date=datetime.datetime.fromtimestamp(int(date)).isoformat(),
-                image_name=snapshot
-            ))
+    for snapshot in catalog.query(role=filter, host=host, status=status,
+                                  since=since, until=until, task=task):
+        click.echo(output_fmt.format(
+            role_name=snapshot['role'],
+            container=snapshot['host'],
+            status=snapshot['status'],
+            date=datetime.datetime.fromtimestamp(snapshot['date']).isoformat(),
+            image_name=snapshot['image_name'][len(SNAPSHOT_PREFIX):]
+        ))
 
 
 @snapshots.command(name='purge', context_settings={'help_option_names': ['-h', '--help']})
-def snapshots_purge():
+@click.option('--keep', default=None, type=int, metavar='N',
+              help='Keep the N most recent snapshots of each role and host')
+@click.option('--older-than', default=None, metavar='DURATION',
+              help='Delete the snapshots older than DURATION (eg. 12h, 7d, '
+                   '2w), a snapshot is deleted as soon as one of the policies '
+                   'selects it')
+@click.option('--max-size', default=None, metavar='SIZE',
+              help='Delete the oldest snapshots until the remaining ones use '
+                   'less than SIZE (eg. 500M, 20G)')
+@click.option('-j', '--jobs', default=4, type=int,
+              help='Number of snapshots to delete concurrently')
+@click.option('--dry-run', is_flag=True, default=False,
+              help='Only show which snapshots would be deleted')
+def snapshots_purge(keep, older_than, max_size, jobs, dry_run):
     """
-    Delete all snapshots
+    Delete all snapshots, or the ones matching the retention policies
     """
-    click.confirm('This will delete all snapshots from the local registry', abort=True)
+    try:
+        older_than = older_than and parse_duration(older_than)
+        max_size = max_size and parse_size(max_size)
+    except ValueError as e:
+        click.secho('error: %s' % str(e), err=True, fg='red')
+        sys.exit(1)
 
     docker = docker_client()
+    catalog = _catalog(docker, reindex=True)
+
+    # image sizes are not part of the catalog as they change when layers get
+    # shared or removed, list them once instead of inspecting every image
+    snapshots = catalog.query()
+    sizes = _layer_sizes(docker, [s['image_id'] for s in snapshots])
+    for snapshot in snapshots:
+        snapshot['size'] = sizes.get(snapshot['image_id'], 0)
+
+    expired = select_expired(snapshots, keep=keep, older_than=older_than,
+                             max_size=max_size)
+    reclaimed = sum(dict((s['image_id'], s['size']) for s in expired).values())
+
+    if not expired:
+        click.echo('No snapshots to delete')
+        return
+
+    if dry_run:
+        for snapshot in expired:
+            click.echo('Would delete %s (%s)' % (
+                snapshot['image_name'],
+                humanize.naturalsize(snapshot['size'])
+            ))
+        click.echo('\n%d snapshots, %s would be reclaimed' % (
+            len(expired), humanize.naturalsize(reclaimed)))
+        return
+
+    click.confirm('This will delete %d snapshots (%s) from the local registry' % (
+        len(expired), humanize.naturalsize(reclaimed)), abort=True)
+
+    def _remove(snapshot):
+        try:
+            docker.remove_image(snapshot['image_name'])
+            catalog.remove(snapshot['image_name'])
+            remove_receipts(snapshot['image_name'])
+            return snapshot, None
+        except APIError as e:
+            return snapshot, e
+
+    docker_configure(pool_size=jobs)
+    pool = ThreadPool(max(1, jobs))
+    try:
+        for snapshot, error in pool.imap_unordered(_remove, expired):
+            if error:
+                click.secho('Deleting %s ... FAILED [%s]' % (
+                    snapshot['image_name'],
+                    error.explanation.decode('utf-8')
+                ), fg='red')
+            else:
+                click.echo('Deleting %s ... %s' % (
+                    snapshot['image_name'],
+                    click.style('DONE', fg='green')
+                ))
+    finally:
+        pool.close()
+        pool.join()
 
-    for image in docker.images():
-        snapshots = [
-            repotag
-            for repotag in image.get('RepoTags', [])
-            if repotag.startswith('art/')
-        ]
 
-        if not snapshots:
+def _layer_sizes(docker, image_ids):
+    """
+    Size of the layers added by each snapshot on top of the image its
+    container was started from, the space actually freed by deleting it
+    :param docker: docker client
+    :param image_ids: ids of the snapshot images
+    :return: dict of image id to bytes
+    """
+    images = dict((image['Id'], image) for image in docker.images(all=True))
+    sizes = {}
+    for image_id in image_ids:
+        image = images.get(image_id)
+        if not image:
             continue
-
-        for snapshot in snapshots:
-            click.echo('Deleting %s ... ' % snapshot, nl=False)
-            try:
-                docker.remove_image(snapshot)
-                click.secho('DONE', fg='green')
-            except APIError as e:
-                click.secho('FAILED [%s]' % e.explanation.decode('utf-8'), fg='red')
+        size = image.get('Size') or 0
+        parent = images.get(image.get('ParentId'))
+        if parent:
+            size -= parent.get('Size') or 0
+        sizes[image_id] = max(0, size)
+    return sizes
 
 
 @snapshots.command(name='rm', context_settings={'help_option_names': ['-h', '--help']})
@@ -98,7 +188,7 @@ def snapshots_rm(image):
     """
     docker = docker_client()
 
-    image, image_name = _resolve_image(docker, image)
+    image, image_name = _resolve_image(_catalog(docker), image)
 
     if not image and not image_name:
         click.secho('error: no image to delete', err=True, fg='red')
@@ -107,40 +197,66 @@ def snapshots_rm(image):
     click.echo('Deleting %s ... ' % image_name, nl=False)
     try:
         docker.remove_image(image_name)
+        SnapshotCatalog().remove(image_name)
+        remove_receipts(image_name)
         click.secho('DONE', fg='green')
     except APIError as e:
         click.secho('FAILED [%s]' % e.explanation.decode('utf-8'), fg='red')
 
 
 @snapshots.command(name='view', context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--failed', is_flag=True, default=False,
+              help='Only show failed tasks')
+@click.option('--page', default=None, type=int,
+              help='Only show the given page of tasks')
+@click.option('--page-size', default=50, type=int,
+              help='Number of tasks per page (default: 50)')
 @click.argument('image', default=None, required=False)
-def snapshots_view(image):
+def snapshots_view(failed, page, page_size, image):
     """
     Display the output of the ansible play that was run on this snapshot
     """
     docker = docker_client()
 
-    image, image_name = _resolve_image(docker, image)
-
-    try:
-        res = docker.inspect_image(image=image_name)
-    except APIError as e:
-        click.secho('error: %s' % e.explanation.decode('utf-8'), fg='red', err=True)
-        sys.exit(1)
+    image, image_name = _resolve_image(_catalog(docker), image)
 
-    try:
-        play = json.loads(res.get('Comment'))
-    except ValueError as e:
-        click.secho('error: %s' % str(e), fg='red')
+    if not image and not image_name:
+        click.secho('error: no image to view', err=True, fg='red')
         sys.exit(1)
 
-    repo, tag = image_name.split(':')
-    repo = repo.split('.')
-    host = repo.pop()
+    offset, limit = 0, None
+    if page:
+        offset, limit = (page - 1) * page_size, page_size
+
+    receipts = Receipts(receipts_file(image_name))
+    if receipts.exists:
+        stats = receipts.stats
+        tasks = receipts.tasks(failed=failed, offset=offset, limit=limit)
+    else:
+        # snapshots created by older versions embed the receipts in the
+        # image comment
+        try:
+            res = docker.inspect_image(image=image_name)
+        except APIError as e:
+            click.secho('error: %s' % e.explanation.decode('utf-8'), fg='red', err=True)
+            sys.exit(1)
+
+        try:
+            play = json.loads(res.get('Comment'))
+        except ValueError as e:
+            click.secho('error: %s' % str(e), fg='red')
+            sys.exit(1)
+
+        stats = play['stats']
+        tasks = filter_tasks(play['tasks'], failed=failed, offset=offset,
+                             limit=limit)
+
+    snapshot = parse_snapshot_name(image_name)
+    host = snapshot and snapshot['host'] or image_name
 
     TestFramework.print_header('PLAY [%s]' % host)
 
-    for task in play['tasks']:
+    for task in tasks:
         TestFramework.print_header('TASK: [%s]' % task['name'])
         if task['state'] == 'ok':
             if 'changed' in task['res'] and task['res']['changed'] is True:
@@ -156,29 +272,40 @@ def snapshots_view(image):
 
     click.secho('{host:<27s}: {ok} {changed} {unreachable} {failed}\n'.format(
         host=click.style(host, fg='yellow'),
-        ok=click.style('ok=%-4d' % play['stats']['ok'], fg='green'),
-        changed=click.style('changed=%-4d' % play['stats']['changed'], fg='yellow'),
-        unreachable='unreachable=%-4d' % play['stats']['unreachable'],
-        failed=click.style('failed=%-4d' % play['stats']['failed'], fg='red'),
+        ok=click.style('ok=%-4d' % stats.get('ok', 0), fg='green'),
+        changed=click.style('changed=%-4d' % stats.get('changed', 0), fg='yellow'),
+        unreachable='unreachable=%-4d' % stats.get('unreachable', 0),
+        failed=click.style('failed=%-4d' % stats.get('failed', 0), fg='red'),
     ))
 
 
-def _resolve_image(docker, image):
+def _catalog(docker=None, reindex=False):
+    """
+    Returns the snapshot catalog, building it from the docker host if
+    requested or if it was never built before
+    :param docker: docker client to use when reindexing
+    :param reindex: force a rebuild of the catalog
+    :return: SnapshotCatalog
+    """
+    catalog = SnapshotCatalog()
+    if reindex or not catalog.exists:
+        catalog.reindex(docker or docker_client())
+    return catalog
+
+
+def _resolve_image(catalog, image):
     """
     If no image is provided, list them and ask the user to choose,
     otherwise check that the repo name is in it
-    :param docker:
+    :param catalog:
     :param image:
     :return:
     """
     if not image:
-        snapshots = []
-        for image in docker.images():
-            snapshots += [
-                repotag[4:]
-                for repotag in image.get('RepoTags', [])
-                if repotag.startswith('art/')
-            ]
+        snapshots = [
+            snapshot['image_name'][len(SNAPSHOT_PREFIX):]
+            for snapshot in catalog.query()
+        ]
 
         if not snapshots:
             return None, None
@@ -197,7 +324,7 @@ def _resolve_image(docker, image):
             image = snapshots[0]
 
     image_name = image
-    if not image.startswith('art/'):
-        image_name = 'art/' + image
+    if not image.startswith(SNAPSHOT_PREFIX):
+        image_name = SNAPSHOT_PREFIX + image
 
     return image, image_name
@@ -1,12 +1,9 @@
 import click
-import os
-import six
 import sys
-import yaml
 
-from ansibleroletest.container import ContainerManager
-from ansibleroletest.docker import client as docker_client
-from ansibleroletest.framework import TestFramework
+from ansibleroletest.api import ConfigurationError, run
+from ansibleroletest.docker import clients as docker_clients
+from ansibleroletest.runs import install_signal_handlers
 
 
 @click.command(context_settings={'help_option_names': ['-h', '--help']})
@@ -52,17 +49,67 @@ from ansibleroletest.framework import TestFramework
               help='Verbose mode (-vvv for more, -vvvv to enable connection '
                    'debugging)')
 # extra
-@click.option('--ansible-version', default='latest',
+@click.option('--ansible-version', default=['latest'], multiple=True,
               metavar='ANSIBLE_VERSION',
-              help='The ansible version to use (either 1.8, 1.9 or latest)',
-              type=click.Choice(['1.8', '1.9', 'latest']))
+              help='The ansible version to use (either 1.8, 1.9, 2.1 or '
+                   'latest), can be repeated to run the tests against several '
+                   'versions concurrently',
+              type=click.Choice(['1.8', '1.9', '2.1', 'latest']))
 @click.option('--privileged', is_flag=True, default=False,
               help='Run test containers in privileged mode (dangerous)')
+@click.option('--cache', is_flag=True, default=False,
+              help='Cache yum/apt folders on the host')
+@click.option('--cache-size', default='2G', metavar='SIZE',
+              help='Maximum size of the package cache, the least recently '
+                   'used packages are removed first (default: 2G)')
 @click.option('--save', default=None, type=click.Choice(['failed', 'successful', 'unreachable', 'all']),
               help='Save containers, can be either one of "failed", '
                    '"successful", "unreachable" and "all"')
-@click.argument('role')
-def test(role,
+# docker hosts
+@click.option('--docker-host', 'docker_hosts', multiple=True,
+              metavar='DOCKER_HOST',
+              help='Docker host to run the tests on, can be repeated to '
+                   'spread the tests over several hosts (defaults to '
+                   '$DOCKER_HOST)')
+@click.option('-j', '--jobs', default=1, type=int,
+              help='Number of tests to run concurrently on each docker host')
+@click.option('--concurrency', default=4, type=int,
+              help='Maximum number of roles tested concurrently when '
+                   'several roles are given')
+@click.option('--output', 'output_mode', default=None,
+              type=click.Choice(['stream', 'status']),
+              help='Either stream the output of every test or only display '
+                   'a status line per running test (default when tests run '
+                   'concurrently), logs are always written in the run folder')
+@click.option('--report', 'reports', multiple=True,
+              metavar='FORMAT:PATH',
+              help='Write the results of each test as they finish, FORMAT '
+                   'is either junit or ndjson, can be repeated')
+@click.option('--timeout', default=None, metavar='DURATION',
+              help='Kill and fail the tests whose playbook runs for longer '
+                   'than DURATION (eg. 30m), the timeout key of a test file '
+                   'takes precedence')
+@click.option('--run-timeout', default=None, metavar='DURATION',
+              help='Kill the running tests and skip the remaining ones once '
+                   'the whole run has lasted DURATION (eg. 2h)')
+@click.option('--shard', default=None, metavar='INDEX/TOTAL',
+              help='Only run the tests of a shard, eg. 2/4, to split the '
+                   'tests of each role over several CI workers')
+@click.option('--durations', multiple=True, metavar='REPORT',
+              help='NDJSON report of a previous run shared by every worker, '
+                   'used to balance the shards by duration, can be repeated '
+                   '(eg. the reports of every shard)')
+@click.option('--no-history', 'history', flag_value=False, default=True,
+              help='Do not record the duration and outcome of the tests in '
+                   'the local history')
+@click.option('--watch', is_flag=True, default=False,
+              help='Keep the containers running and run the tests again '
+                   'each time the role changes, local roles only')
+@click.option('--reset', is_flag=True, default=False,
+              help='With --watch, recreate the test containers from their '
+                   'image before running a test again')
+@click.argument('roles', nargs=-1, required=True, metavar='ROLE...')
+def test(roles,
          config,
          # path args
          roles_path, library_path, plugins_action_path,
@@ -70,62 +117,62 @@ def test(role,
          # ansible-playbook args
          extra_vars, limit, skip_tags, tags, verbosity,
          # misc
-         ansible_version, privileged, save):
+         ansible_version, privileged, cache, cache_size, save,
+         # docker hosts
+         docker_hosts, jobs, concurrency, output_mode, reports, timeout,
+         run_timeout, shard, durations, history,
+         # watch mode
+         watch, reset):
     """
     Run tests
 
     ROLE can be either be a local path, a git repository or an ansible-galaxy
-    role name.
+    role name. Several roles can be given, a local folder that is not a role
+    is considered to be a folder of roles.
     """
-    with ContainerManager(docker_client()) as docker:
-        ansible_paths = {
-            'roles': roles_path,
-            'library': library_path,
-            'plugins': {
-                'action': plugins_action_path,
-                'filter': plugins_filter_path,
-                'lookup': plugins_lookup_path,
-            }
-        }
+    # ctrl+c stops the tests and cleans up, a second one or SIGTERM removes
+    # the containers straight away, "gc" collects the ones of runs that
+    # could not clean up (eg. killed by the CI)
+    install_signal_handlers(docker_clients)
 
-        _load_config(ansible_paths, config)
-
-        framework = TestFramework(docker, role, ansible_paths,
-                                  ansible_version)
-        res = framework.run(
+    try:
+        result = run(
+            roles, config,
+            roles_path=roles_path,
+            library_path=library_path,
+            plugins_action_path=plugins_action_path,
+            plugins_filter_path=plugins_filter_path,
+            plugins_lookup_path=plugins_lookup_path,
             extra_vars=extra_vars,
             limit=limit,
             skip_tags=skip_tags,
             tags=tags,
             verbosity=verbosity,
+            ansible_versions=ansible_version,
             privileged=privileged,
-            save=save
+            cache=cache,
+            cache_size=cache_size,
+            save=save,
+            docker_hosts=docker_hosts,
+            jobs=jobs,
+            concurrency=concurrency,
+            output_mode=output_mode,
+            reports=reports,
+            timeout=timeout,
+            run_timeout=run_timeout,
+            shard=shard,
+            durations=durations,
+            history=history,
+            watch=watch,
+            reset=reset
         )
+    except ConfigurationError as e:
+        click.secho('error: %s' % e, err=True, fg='red')
+        sys.exit(2)
 
-        if res != 0 and save != 'failed':
-            click.secho('''
+    if result.code != 0 and save != 'failed' and not watch:
+        click.secho('''
 info: some of the tests have failed. If you wish to inspect the failed
       containers, rerun the command while adding the --save=failed flag
       to your command line.''', fg='blue')
-    sys.exit(res)
-
-
-def _load_config(conf, config_file=None):
-    if not config_file:
-        return
-
-    base = os.path.dirname(os.path.realpath(config_file.name))
-    content = yaml.load(config_file)
-
-    # merge both objects if the original value is none
-    def _update(obj_from, obj_to):
-        for k, v in six.iteritems(obj_to):
-            if isinstance(v, dict):
-                _update(obj_from[k], v)
-            elif v is None and k in obj_from and obj_from[k]:
-                if obj_from[k].startswith('/'):
-                    obj_to[k] = os.path.join(obj_from[k])
-                else:
-                    obj_to[k] = os.path.join(base, obj_from[k])
-
-    _update(content, conf)
+    sys.exit(result.code)
@@ -0,0 +1,126 @@
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+
+from six.moves import queue
+
+from .catalog import SnapshotCatalog
+from .receipts import remove_receipts, write_receipts
+
+
+class SnapshotCommitter(object):
+    """
+    Commits containers to the local registry in background threads so that
+    the next test can start while the snapshots are being saved. Containers
+    handed to the committer are owned by it: they are stopped, committed,
+    labelled and removed.
+    """
+
+    DEFAULT_WORKERS = 2
+
+    def __init__(self, workers=DEFAULT_WORKERS, catalog=None):
+        self.workers = workers
+        self.catalog = catalog or SnapshotCatalog()
+        self._queue = queue.Queue()
+        self._threads = []
+        self._results = []
+        self._lock = threading.Lock()
+
+    @property
+    def active(self):
+        return bool(self._threads)
+
+    @property
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def submit(self, container, snapshot, receipts):
+        """
+        Queue a container to be committed
+        :param container: the Container object to commit
+        :param snapshot: dict containing the repository, tag, role, host,
+                         status, date and task of the snapshot
+        :param receipts: the ansible receipts for that host, stored next to
+                         the catalog and referenced by the art.receipts label
+        """
+        with self._lock:
+            if not self._threads:
+                for _ in range(self.workers):
+                    thread = threading.Thread(target=self._worker)
+                    thread.daemon = True
+                    thread.start()
+                    self._threads.append(thread)
+
+        self._queue.put((container, snapshot, receipts))
+
+    def wait(self):
+        """
+        Wait for all the queued commits to finish and stop the workers
+        :return: list of results, each result being the snapshot dict with
+                 the image id, duration and error (if any) added
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+        with self._lock:
+            results, self._results = self._results, []
+        return results
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                result = self._commit(*job)
+                with self._lock:
+                    self._results.append(result)
+            finally:
+                self._queue.task_done()
+
+    def _commit(self, container, snapshot, receipts):
+        image_name = '%s:%s' % (snapshot['repository'], snapshot['tag'])
+        result = snapshot.copy()
+        result.update({'id': None, 'error': None})
+        start = time.time()
+        try:
+            filename = write_receipts(image_name, receipts)
+            container.stop()
+            res = container.commit(
+                snapshot['repository'], snapshot['tag'],
+                'ansible-role-test snapshot of %s' % snapshot['host'],
+                conf={'Labels': {
+                    'art.role': snapshot['role'],
+                    'art.host': snapshot['host'],
+                    'art.status': snapshot['status'],
+                    'art.date': str(snapshot['date']),
+                    'art.task': snapshot.get('task') or '',
+                    'art.receipts': filename
+                }}
+            )
+            result['id'] = res.get('Id')
+            self.catalog.add(
+                image_name=image_name,
+                image_id=result['id'],
+                role=snapshot['role'],
+                host=snapshot['host'],
+                status=snapshot['status'],
+                date=snapshot['date'],
+                task=snapshot['status'] in ('failed', 'timeout') and
+                snapshot.get('task') or None
+            )
+        except Exception as e:
+            result['error'] = e
+            remove_receipts(image_name)
+        finally:
+            try:
+                container.remove(v=True)
+            except Exception:
+                pass
+            result['duration'] = time.time() - start
+        return result
@@ -1,8 +1,12 @@
 from __future__ import unicode_literals, absolute_import
 
 import six
+import threading
+
 from six.moves.urllib.parse import urlparse
 
+from .runs import cleared_labels, labels
+
 OOMKilled, Dead, Paused, Running, Restarting, Stopped = range(1, 7)
 
 
@@ -14,8 +18,75 @@ class ExecuteReturnCodeError(BaseException):
         self.output = output
 
 
+class ImagePuller(object):
+    """
+    Keeps track of the images available on each docker host and makes sure
+    an image is only pulled once, even when several containers using it are
+    created concurrently
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._images = {}
+
+    def _image_lock(self, client, image):
+        with self._lock:
+            key = (client.base_url, image)
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    def images(self, client):
+        """
+        Returns the images available on the docker host, indexed by tag
+        """
+        with self._lock:
+            key = client.base_url
+            if key not in self._images:
+                self._images[key] = {
+                    tag: image
+                    for image in client.images()
+                    for tag in image['RepoTags'] or []
+                }
+            return self._images[key]
+
+    def pull(self, client, image, progress=None, force=False):
+        """
+        Pull an image if it is not available on the docker host, waiting
+        for any other thread already pulling it
+        :param client: docker client
+        :param image: image name
+        :param progress: callable receiving the progress of the pull
+        :param force: pull the image even if it is available, to update it
+        :return: True if the image was pulled by this call
+        """
+        with self._image_lock(client, image):
+            if not force and image in self.images(client):
+                return False
+
+            if hasattr(progress, '__call__'):
+                for line in client.pull(image, insecure_registry=True,
+                                        stream=True):
+                    progress(line)
+                progress('finished')
+            else:
+                client.pull(image)
+
+            # reset image list on success
+            self.refresh(client)
+            return True
+
+    def refresh(self, client):
+        """
+        Forget the images known for a docker host, eg. after a commit
+        """
+        with self._lock:
+            self._images.pop(client.base_url, None)
+
+
 class Container(object):
-    _images = None
+    puller = ImagePuller()
 
     def __init__(self, client, image, detach=True, **options):
         self._client = client
@@ -54,13 +125,7 @@ class Container(object):
 
     @property
     def images(self):
-        if not Container._images:
-            Container._images = {
-                tag: image
-                for image in self._client.images()
-                for tag in image['RepoTags']
-            }
-        return Container._images
+        return Container.puller.images(self._client)
 
     @property
     def internal_ip(self):
@@ -96,6 +161,11 @@ class Container(object):
         return state
 
     def commit(self, repository, tag, message, **options):
+        # the image must not carry our run labels, or the containers started
+        # from it would be garbage collected
+        conf = dict(options.pop('conf', None) or {})
+        conf['Labels'] = dict(cleared_labels(), **(conf.get('Labels') or {}))
+        options['conf'] = conf
         return self._client.commit(container=self.id, repository=repository,
                                    tag=tag, message=message, **options)
 
@@ -112,21 +182,12 @@ class Container(object):
 
     def create(self, start=False, progress=None, **options):
         if self.image not in self.images:
-            # pull image from repo
-            if hasattr(progress, '__call__'):
-                for line in self._client.pull(self.image,
-                                              insecure_registry=True,
-                                              stream=True):
-                    progress(line)
-                progress('finished')
-            else:
-                self._client.pull(self.image)
-
-            # reset image list on success
-            Container._images = None
-            self._pulled = True
+            self._pulled = Container.puller.pull(self._client, self.image,
+                                                 progress)
 
         self._props.update(options)
+        self._props['labels'] = dict(self._props.get('labels') or {},
+                                     **labels())
         res = self._client.create_container(**self._props)
         self._props['id'] = res['Id']
         if start:
@@ -193,10 +254,69 @@ class Container(object):
         return self._client.wait(container=self.id)
 
 
+class Network(object):
+    """
+    A user-defined bridge network, containers attached to it can reach each
+    other using their aliases
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self.name = name
+        self.id = None
+        self._connected = []
+
+    def create(self):
+        res = self._client.create_network(self.name, driver='bridge',
+                                          labels=labels())
+        self.id = res['Id']
+        return self.id
+
+    def connect(self, container, aliases=None):
+        """
+        Attach a running container to the network
+        """
+        self._client.connect_container_to_network(container.id, self.id,
+                                                  aliases=aliases)
+        self._connected.append(container.id)
+
+    def disconnect(self, container):
+        """
+        Detach a container from the network
+        """
+        self._client.disconnect_container_from_network(container.id, self.id)
+        if container.id in self._connected:
+            self._connected.remove(container.id)
+
+    def networking_config(self, aliases=None):
+        """
+        Returns the networking config to use when creating a container that
+        should be started on this network
+        """
+        return {'EndpointsConfig': {self.name: {'Aliases': aliases or []}}}
+
+    def remove(self):
+        """
+        Detach any container we attached and remove the network
+        """
+        if not self.id:
+            return
+        for container_id in self._connected:
+            try:
+                self._client.disconnect_container_from_network(
+                    container_id, self.id, force=True)
+            except Exception:
+                pass
+        self._connected = []
+        self._client.remove_network(self.id)
+        self.id = None
+
+
 class ContainerManager(object):
     def __init__(self, docker):
         self._docker = docker
         self._containers = {}
+        self._networks = []
 
     @property
     def client(self):
@@ -216,6 +336,19 @@ class ContainerManager(object):
             self._containers[name].start(**options)
         return self._containers[name]
 
+    def create_network(self, name):
+        network = Network(self._docker, name)
+        network.create()
+        self._networks.append(network)
+        return network
+
+    def detach(self, name):
+        """
+        Stop managing a container without destroying it, the caller becomes
+        responsible for its removal
+        """
+        return self._containers.pop(name)
+
     def destroy(self, names=None):
         if not hasattr(self, '_containers'):
             return
@@ -227,6 +360,18 @@ class ContainerManager(object):
             if not names or name in names:
                 container.destroy()
                 del self._containers[name]
+        if not names:
+            self.destroy_networks()
+
+    def destroy_networks(self):
+        """
+        Remove the networks created with this manager, networks can only be
+        removed once the containers on them have been destroyed
+        """
+        if not hasattr(self, '_networks'):
+            return
+        while self._networks:
+            self._networks.pop().remove()
 
     def __del__(self):
         self.destroy()
@@ -0,0 +1,51 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import shutil
+import threading
+
+
+class DependencyCache(object):
+    """
+    Galaxy roles shared between the ansible containers of a run: each
+    dependency is downloaded once into a folder mounted in every container
+    and added to their roles path
+    """
+    CONTAINER_PATH = '/galaxy_roles'
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    @property
+    def binding(self):
+        return ':'.join([self.path, DependencyCache.CONTAINER_PATH])
+
+    def _role_lock(self, role_name):
+        with self._lock:
+            if role_name not in self._locks:
+                self._locks[role_name] = threading.Lock()
+            return self._locks[role_name]
+
+    def install(self, framework, role_name):
+        """
+        Make a galaxy role available to the framework's ansible container,
+        downloading it unless another framework already did
+        :param framework: TestFramework whose ansible container needs the role
+        :param role_name: galaxy role name
+        :return: True if the role was downloaded by this call
+        """
+        with self._role_lock(role_name):
+            if os.path.isdir(os.path.join(self.path, role_name)):
+                return False
+            framework.stream('ansible-galaxy', 'install',
+                             '-p', DependencyCache.CONTAINER_PATH, role_name)
+            return True
+
+    def cleanup(self):
+        """
+        Remove the downloaded roles
+        """
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -1,16 +1,167 @@
 from __future__ import absolute_import
 
+import os
+import threading
+
 from docker.client import Client
+from docker.ssladapter.ssladapter import SSLAdapter
+from docker.transport.unixconn import UnixAdapter, UnixHTTPConnectionPool
 from docker.utils import kwargs_from_env
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 3
+
+_lock = threading.Lock()
+_clients = {}
+_versions = {}
+_settings = {
+    'pool_size': DEFAULT_POOL_SIZE,
+    'retries': DEFAULT_RETRIES
+}
+
+
+def configure(pool_size=None, retries=None):
+    """
+    Set the connection pool size and the number of retries of the clients,
+    clients already created are resized
+    :param pool_size: number of connections kept open to each docker host,
+                      should match the number of threads using the client
+    :param retries: number of retries of idempotent calls on connection
+                    errors and 502/503/504 responses
+    """
+    with _lock:
+        if pool_size is not None:
+            _settings['pool_size'] = max(DEFAULT_POOL_SIZE, pool_size)
+        if retries is not None:
+            _settings['retries'] = retries
+        for docker in _clients.values():
+            _mount_adapters(docker)
 
 
 # Taken from the docker-compose source
-def client():
+def client(base_url=None, cert_path=None, tls_verify=None):
     """
     Returns a docker-py client configured using environment variables
-    according to the same logic as the official Docker client.
+    according to the same logic as the official Docker client. When a base
+    url is given, the client connects to that host instead and the TLS
+    settings given as arguments override the environment ones.
+
+    Clients are shared by the whole process (and thread-safe), the api
+    version of each docker host is only negotiated once.
+    :param base_url: eg. tcp://build1:2376 or unix:///var/run/docker.sock
+    :param cert_path: folder containing ca.pem, cert.pem and key.pem
+    :param tls_verify: verify the server certificate against ca.pem
     """
-    kwargs = kwargs_from_env()
+    env = environment(base_url, cert_path, tls_verify)
+    key = tuple(env.get(name) for name in ('DOCKER_HOST', 'DOCKER_CERT_PATH',
+                                           'DOCKER_TLS_VERIFY'))
+
+    with _lock:
+        if key in _clients:
+            return _clients[key]
+
+    kwargs = kwargs_from_env(environment=env)
     if 'tls' in kwargs:
         kwargs['tls'].assert_hostname = False
-    return Client(version='auto', **kwargs)
+    url = kwargs.get('base_url')
+    with _lock:
+        version = _versions.get(url, 'auto')
+
+    # negotiating the api version is a request to the docker host, done
+    # outside of the lock so that a slow host does not hold back the others
+    docker = Client(version=version, **kwargs)
+
+    with _lock:
+        if key in _clients:
+            # created concurrently by another thread
+            docker.close()
+            return _clients[key]
+        _versions[url] = docker.api_version
+        _mount_adapters(docker)
+        _clients[key] = docker
+        return docker
+
+
+def clients():
+    """
+    Returns the clients created so far
+    """
+    with _lock:
+        return list(_clients.values())
+
+
+def environment(base_url=None, cert_path=None, tls_verify=None):
+    """
+    Returns the docker environment variables, overridden by the given
+    settings when a base url is given
+    """
+    env = os.environ
+    if base_url:
+        env = dict(os.environ, DOCKER_HOST=base_url)
+        if cert_path:
+            env['DOCKER_CERT_PATH'] = cert_path
+        if tls_verify is not None:
+            env['DOCKER_TLS_VERIFY'] = tls_verify and '1' or ''
+    return env
+
+
+class PooledUnixAdapter(UnixAdapter):
+    """
+    docker-py's unix socket adapter keeps a single connection per pool,
+    this one keeps pool_size of them
+    """
+
+    def __init__(self, socket_path, timeout, pool_size, max_retries):
+        super(PooledUnixAdapter, self).__init__(socket_path, timeout)
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(url)
+            if pool:
+                return pool
+
+            pool = UnixHTTPConnectionPool(url, self.socket_path, self.timeout,
+                                          maxsize=self.pool_size)
+            self.pools[url] = pool
+
+        return pool
+
+
+def _mount_adapters(docker):
+    """
+    Replace the adapters of a client by ones with a connection pool of the
+    configured size and retries, the connections of the replaced ones are
+    closed
+    """
+    docker.close()
+    retries = Retry(total=_settings['retries'],
+                    backoff_factor=0.2,
+                    status_forcelist=(502, 503, 504),
+                    raise_on_status=False)
+    pool_size = _settings['pool_size']
+
+    if isinstance(getattr(docker, '_custom_adapter', None), UnixAdapter):
+        docker._custom_adapter = PooledUnixAdapter(
+            docker._custom_adapter.socket_path, docker.timeout,
+            pool_size, retries)
+        docker.mount('http+docker://', docker._custom_adapter)
+        return
+
+    https = docker.adapters.get('https://')
+    if isinstance(https, SSLAdapter):
+        docker.mount('https://', SSLAdapter(
+            ssl_version=https.ssl_version,
+            assert_hostname=https.assert_hostname,
+            assert_fingerprint=https.assert_fingerprint,
+            pool_maxsize=pool_size,
+            max_retries=retries
+        ))
+    else:
+        docker.mount('https://', HTTPAdapter(pool_maxsize=pool_size,
+                                             max_retries=retries))
+    docker.mount('http://', HTTPAdapter(pool_maxsize=pool_size,
+                                        max_retries=retries))
@@ -1,16 +1,28 @@
 import click
 import giturlparse
 import os
+import pkgutil
 import shutil
 import six
 import sys
+import threading
+import time
 import traceback
 import uuid
 import yaml
 
+from .admission import AdmissionController
+from .committer import SnapshotCommitter
 from .container import ExecuteReturnCodeError
+from .images import controller_image
+from .output import Output
+from .planner import expected_durations, longest_first, makespan, \
+    shard_tests
+from .runs import interrupted, mark_owner
 from .test import Test
-from .utils import pull_image_progress, cache_dir
+from .utils import pull_image_progress, parse_resources, cache_dir, \
+    format_duration
+from .watch import FileWatcher
 
 
 def mktmpdir():
@@ -20,6 +32,7 @@ def mktmpdir():
     """
     tmp_dir = os.path.join(cache_dir, 'tmp', uuid.uuid4().hex)
     os.makedirs(tmp_dir)
+    mark_owner(tmp_dir)
     return tmp_dir
 
 
@@ -33,14 +46,42 @@ class TestFramework(object):
     TYPE_LOCAL = 'local'
 
     def __init__(self, docker, role,
-                 ansible_paths=None, ansible_version='latest'):
+                 ansible_paths=None, ansible_version='latest',
+                 dependency_cache=None, resources=None, output=None,
+                 reporters=None, package_cache=None, history=None,
+                 shard=None, watchdog=None, shard_durations=None):
         self.ansible = None
         self.docker = docker
         self.role = role
         self.work_dir = mktmpdir()
         self.res = {'success': 0, 'skip': 0, 'failed': 0}
+        self.errored = False
+        self.committer = SnapshotCommitter()
+        self._lock = threading.Lock()
+        self._running = set()
         self.ansible_version = ansible_version
         self.environment = {}
+        self.dependency_cache = dependency_cache
+        self.resources = parse_resources(resources)
+        self.admission = AdmissionController.get(docker.client)
+        self.reporters = reporters or []
+        self.package_cache = package_cache
+        self.history = history
+        self.shard = shard
+        self.shard_durations = shard_durations or {}
+        self.sharded = None
+        self.watchdog = watchdog
+        self.predicted = None
+        self.elapsed = None
+
+        # the receipts callback of the ansible images does not time the tasks,
+        # ours records them next to the receipts of each test
+        plugins_dir = os.path.join(self.work_dir, 'callback_plugins')
+        os.makedirs(plugins_dir)
+        with open(os.path.join(plugins_dir, 'art_timings.py'), 'wb') as fd:
+            fd.write(pkgutil.get_data('ansibleroletest', 'timings.py'))
+        self.environment['ANSIBLE_CALLBACK_PLUGINS'] = ':'.join([
+            '/etc/ansible/plugins/callback_plugins', '/work/callback_plugins'])
 
         # check the role type
         self.role_name = self.role
@@ -57,10 +98,21 @@ class TestFramework(object):
                 'action': None
             }
         }
+        # galaxy roles are installed in the first folders, local roles are
+        # used straight from the roles path, mounted on /roles
+        self.galaxy_dirs = ['/etc/ansible/roles/']
+        if dependency_cache:
+            self.bindings.append(dependency_cache.binding)
+            self.galaxy_dirs.append(dependency_cache.CONTAINER_PATH + '/')
+        self.roles_dirs = list(self.galaxy_dirs)
+
         if ansible_paths:
             self.ansible_paths.update(ansible_paths)
             self.setup_bindings()
 
+        if len(self.roles_dirs) > 1:
+            self.environment['ANSIBLE_ROLES_PATH'] = ':'.join(self.roles_dirs)
+
         if os.path.isdir(role):
             # role is a folder name, use that
             role = os.path.realpath(role)
@@ -76,49 +128,138 @@ class TestFramework(object):
             self.role_path = '/etc/ansible/roles/{0}'.format(self.role_name)
             self.type = TestFramework.TYPE_GIT
 
-    def cleanup(self):
+        # each framework logs in its own file, a suffix is needed as the same
+        # role and version can be tested on several docker hosts
+        self.output = (output or Output()).child(
+            '%s [%s]' % (self.role_name, self.ansible_version),
+            '%s-%s-%s.log' % (self.role_name, self.ansible_version,
+                              os.path.basename(self.work_dir)[:8])
+        )
+
+    def cleanup(self, recap=True):
         """
         Final cleanup, destroy any container created with our ContainerManager
         and delete temporary files before showing the test recap
+        :param recap: whether to display the recap, disabled when the results
+                      are merged with the ones of other frameworks
         :return:
         """
-        self.print_header('CLEANING TESTS')
+        self.wait_snapshots()
+
+        self.output.header('CLEANING TESTS')
         for name, container in six.iteritems(self.docker.containers):
             self.docker.destroy(name)
-            click.secho('ok: [%s]' % container.image, fg='green')
+            self.output.echo('ok: [%s]' % container.image, fg='green')
 
         # remove temp folder
         if os.path.exists(self.work_dir):
             shutil.rmtree(self.work_dir)
 
-        self.print_header('TESTS RECAP')
+        self.output.finish(not self.errored)
+        self.output.close()
+
+        if recap:
+            console = self.output.console
+            self.print_header('TESTS RECAP', console)
+            self.print_recap(self.role_name, self.res, console)
+            self.print_timing(self.predicted, self.elapsed, console)
+            self.print_shard(self.shard, self.sharded, console)
 
+    @staticmethod
+    def print_recap(name, res, console=None):
+        """
+        Display a line of the test recap
+        :param name: the name of the role (or group of tests)
+        :param res: dict containing the success, skip and failed counters
+        :param console: Console to display it on, defaults to the terminal
+        """
         res_color = 'yellow'
-        if self.res['failed'] > 0:
+        if res['failed'] > 0:
             res_color = 'red'
 
-        click.echo(
+        (console or click).echo(
             '%-27s: %s    %s    %s' % (
-                click.style(self.role_name, fg=res_color),
-                click.style('success=%d' % self.res['success'], fg='green'),
-                click.style('skip=%d' % self.res['skip'], fg='blue'),
-                click.style('failed=%d' % self.res['failed'], fg='red'),
+                click.style(name, fg=res_color),
+                click.style('success=%d' % res['success'], fg='green'),
+                click.style('skip=%d' % res['skip'], fg='blue'),
+                click.style('failed=%d' % res['failed'], fg='red'),
             )
         )
 
+    @staticmethod
+    def print_timing(predicted, elapsed, console=None):
+        """
+        Display the predicted and actual wall time of the tests
+        :param predicted: seconds, as predicted by plan
+        :param elapsed: seconds
+        :param console: Console to display it on, defaults to the terminal
+        """
+        if predicted is None or elapsed is None:
+            return
+        (console or click).echo('  %-25s: predicted=%s actual=%s' % (
+            'wall time', format_duration(predicted),
+            format_duration(elapsed)))
+
+    @staticmethod
+    def print_shard(shard, sharded=None, console=None):
+        """
+        Display which shard of the tests ran
+        :param shard: tuple of the shard index and total
+        :param sharded: tuple of the number of tests in the shard and the
+                        number of tests found
+        :param console: Console to display it on, defaults to the terminal
+        """
+        if not shard:
+            return
+        count = sharded and ' (%d of %d tests)' % sharded or ''
+        (console or click).echo('  %-25s: %d/%d%s' % (('shard',) + tuple(shard) +
+                                         (count,)))
+
+    def wait_snapshots(self):
+        """
+        Wait for the background commits queued by the tests and report on them
+        """
+        if not self.committer.active:
+            return
+
+        self.output.header('WAITING FOR SNAPSHOTS')
+        if self.committer.pending:
+            self.output.echo('- %d commits in progress' % self.committer.pending)
+        for result in self.committer.wait():
+            image_name = '%s:%s' % (result['repository'], result['tag'])
+            if result['error']:
+                self.output.echo('failed: [%s] as [%s]\n    %s' % (
+                    result['host'], image_name, result['error']), fg='red')
+            else:
+                self.output.echo(
+                    'ok: saved [%s] as [%s] in %.1fs\n    id: %s' % (
+                        result['host'],
+                        image_name,
+                        result['duration'],
+                        result['id'][:12]
+                    ),
+                    fg='green')
+
     def install_role_deps(self):
         """
-        Check the meta file and install role dependencies recursively
+        Check the meta file and install role dependencies recursively. Local
+        dependencies are not copied, the roles path is mounted on the ansible
+        container and part of its ANSIBLE_ROLES_PATH, their meta file is read
+        from the host.
         """
-        installed = []
-        roles = [self.role_path]
-        for role in roles:
-            meta = self.ansible.content(os.path.join(role, 'meta', 'main.yml'))
+        installed = set()
+        # (path, whether the path is on the host)
+        roles = [(self.role_path, False)]
+        if self.type == TestFramework.TYPE_LOCAL:
+            roles = [(os.path.realpath(self.role), True)]
+
+        for role, local in roles:
+            meta = self._role_meta(role, local)
             if not meta:
                 continue
 
             metadata = yaml.load(meta)
-            if 'dependencies' not in metadata or not metadata['dependencies']:
+            if not metadata or not metadata.get('dependencies'):
                 continue
 
             for dependency in metadata['dependencies']:
@@ -130,16 +271,31 @@ class TestFramework(object):
                     continue
 
                 # try to get a role on galaxy if we do not have it
-                has_role_locally = self.ansible_paths['roles'] and \
-                    os.path.exists(os.path.join(self.ansible_paths['roles'],
-                                                role_name))
+                local_path = self.ansible_paths['roles'] and \
+                    os.path.join(self.ansible_paths['roles'], role_name)
+                has_role_locally = local_path and os.path.exists(local_path)
 
                 if '.' in role_name and not has_role_locally:
-                    self.print_header('DEPENDENCY: [%s]' % role_name)
-                    self.stream('ansible-galaxy', 'install', role_name)
-                # otherwise copy it from the role-path if set
+                    self.output.header('DEPENDENCY: [%s]' % role_name)
+                    if self.dependency_cache:
+                        if not self.dependency_cache.install(self, role_name):
+                            self.output.echo('- using cached %s' % role_name)
+                    else:
+                        self.stream('ansible-galaxy', 'install', role_name)
+
+                    # because ansible-galaxy might have installed sub deps,
+                    # list the folders of the roles paths
+                    installed.update(
+                        os.path.basename(path.strip())
+                        for path in self.ansible.execute(
+                            ['find'] + self.galaxy_dirs +
+                            ['-maxdepth', '1', '-type', 'd']
+                        ).split('\n')
+                        if '.' in os.path.basename(path.strip())
+                    )
+                # otherwise use it from the roles path if set
                 else:
-                    self.print_header('LOCAL DEPENDENCY: [%s]' % role_name)
+                    self.output.header('LOCAL DEPENDENCY: [%s]' % role_name)
                     if not self.ansible_paths['roles']:
                         raise ImportError(
                             'No roles path, please set --roles-path')
@@ -148,36 +304,50 @@ class TestFramework(object):
                             role_name,
                             self.ansible_paths['roles']
                         ))
-                    src_path = os.path.join('/roles', role_name)
-                    target_path = '/etc/ansible/roles/{0}'.format(role_name)
-                    click.echo('- copy from %s' % src_path)
-                    self.ansible.execute(['cp', '-r', src_path, target_path])
-                    roles.append(target_path)
-
-                click.secho('ok: [%s]' % role_name, fg='green')
-
-                # because ansible-galaxy might have installed sub deps, just list
-                # the folders in /etc/ansible/roles
-                installed = [
-                    os.path.basename(file)
-                    for file in self.ansible.execute(
-                        ['find', '/etc/ansible/roles/', '-maxdepth', '1', '-type', 'd']
-                    ).split('\n')
-                    if '.' in os.path.basename(file)
-                ]
+                    self.output.echo('- mounted from %s' % local_path)
+                    roles.append((local_path, True))
+
+                installed.add(role_name)
+                self.output.echo('ok: [%s]' % role_name, fg='green')
+
+    def _role_meta(self, role, local):
+        """
+        Read the meta file of a role, either from the host or the ansible
+        container
+        :return: the content of the file, empty if there is none
+        """
+        meta_file = os.path.join(role, 'meta', 'main.yml')
+        if not local:
+            return self.ansible.content(meta_file)
+        if not os.path.exists(meta_file):
+            return ''
+        with open(meta_file) as fd:
+            return fd.read()
 
     @staticmethod
-    def print_header(text):
+    def print_header(text, console=None):
         """
         Helper method to display an ansible-like header
         :param text:
+        :param console: Console to display it on, defaults to the terminal
         :return:
         """
-        click.echo('\n' + text + ' ' + ((78 - len(text)) * '*'))
+        (console or click).echo('\n' + text + ' ' + ((78 - len(text)) * '*'))
+
+    def print_exception(self):
+        """
+        Display the exception currently being handled
+        """
+        self.errored = True
+        self.output.header('EXCEPTION')
+
+        _, e, tb = sys.exc_info()
+        self.output.echo(''.join(traceback.format_tb(tb)), nl=False, fg='red')
+        self.output.echo('\n  %s' % str(e), fg='red', err=True)
 
     def run(self, extra_vars=None, limit=None, skip_tags=None,
             tags=None, verbosity=None, privileged=False,
-            save=None):
+            save=None, recap=True):
         """
         Run all the tests
         :param extra_vars: extra vars to pass to ansible
@@ -186,17 +356,18 @@ class TestFramework(object):
         :param tags: run only those tags
         :param verbosity: augment verbosity of ansible
         :param privileged: start containers in privileged mode
+        :param recap: display the recap once done
         :return: 0 on success, 1 on error, 2 if no tests are found
         """
         try:
-            self.print_header('TESTS [%s]' % self.role_name)
-            self.setup_ansible()
-            self.install_role_deps()
+            self.setup()
 
+            start = time.time()
             test_count = 0
             for test in self.tests():
                 test_count += 1
-                if test.run(
+                self.run_test(
+                    test,
                     extra_vars=extra_vars,
                     limit=limit,
                     skip_tags=skip_tags,
@@ -204,41 +375,282 @@ class TestFramework(object):
                     verbosity=verbosity,
                     privileged=privileged,
                     save=save
-                ):
-                    self.res['success'] += 1
-                else:
-                    self.res['failed'] += 1
+                )
+
+            self.elapsed = time.time() - start
 
+            if self.res['skip']:
+                # the run timed out before every test could start
+                return 1
+            if not test_count and self.sharded and self.sharded[1]:
+                self.output.header('NO TESTS')
+                self.output.echo('no test in shard %d/%d' % self.shard)
+                return 0
             if not test_count:
                 # no tests
-                self.print_header('NO TESTS')
-                click.secho('warning: no test found', fg='yellow')
+                self.output.header('NO TESTS')
+                self.output.echo('warning: no test found', fg='yellow')
                 return 2
             return 0
+        except KeyboardInterrupt:
+            self.errored = True
+            self.output.echo('\nerror: interrupted', fg='red')
+            self.res['failed'] += 1
+            return 1
         except:
-            self.print_header('EXCEPTION')
-
-            _, e, tb = sys.exc_info()
-            click.secho('', fg='red', reset=False)
-            traceback.print_tb(tb)
-            click.secho('\n  %s' % str(e), fg='red', err=True)
+            self.print_exception()
             self.res['failed'] += 1
             return 1
         finally:
-            self.cleanup()
+            self.cleanup(recap=recap)
+
+    def interrupt(self):
+        """
+        Kill the playbooks of the running tests once the run is interrupted,
+        the tests clean up after themselves in their own threads and the
+        tests that did not start yet are skipped
+        """
+        with self._lock:
+            running = list(self._running)
+        for test in running:
+            thread = threading.Thread(target=test.interrupt)
+            thread.daemon = True
+            thread.start()
+
+    def watch(self, extra_vars=None, limit=None, skip_tags=None, tags=None,
+              verbosity=None, privileged=False, reset=False):
+        """
+        Run all the tests then keep the containers running and run the tests
+        again each time the role, or the roles, library and plugins folders,
+        change. Only the modified test is run again when a change is limited
+        to a test file. Only available for local roles.
+        :param extra_vars: extra vars to pass to ansible
+        :param limit: limit on which targets to run the tests
+        :param skip_tags: skip certain tags
+        :param tags: run only those tags
+        :param verbosity: augment verbosity of ansible
+        :param privileged: start containers in privileged mode
+        :param reset: recreate the test containers from their image before
+                      running a test again
+        :return: 0 once interrupted, 1 on error, 2 if no tests are found
+        """
+        if self.type != TestFramework.TYPE_LOCAL:
+            raise ValueError('watch mode is only available for local roles')
+
+        play_options = dict(extra_vars=extra_vars, limit=limit,
+                            skip_tags=skip_tags, tags=tags,
+                            verbosity=verbosity)
+        tests = {}
+        watcher = None
+        try:
+            self.setup()
+            watcher = FileWatcher(self.watch_paths())
+
+            affected, fresh = self._sync_tests(tests, None, limit, privileged)
+            if not tests and not affected:
+                self.output.header('NO TESTS')
+                self.output.echo('warning: no test found', fg='yellow')
+                return 2
+
+            while True:
+                results = []
+                for test_file in affected:
+                    test = tests.get(test_file)
+                    if test is None:
+                        continue
+                    if reset and test_file not in fresh:
+                        test.reset(limit, privileged)
+                    results.append((test, self._watch_play(test,
+                                                           play_options)))
+
+                console = self.output.console
+                self.print_header('WATCH RECAP', console)
+                for test, success in results:
+                    console.echo('%s: [%s]' % (success and 'ok' or 'failed',
+                                               test.name),
+                                 fg=success and 'green' or 'red')
+                console.echo('\nwaiting for changes, press ctrl+c to stop',
+                             fg='blue')
+
+                changed = watcher.wait()
+                affected, fresh = self._sync_tests(tests, changed, limit,
+                                                   privileged)
+        except KeyboardInterrupt:
+            return 0
+        except:
+            self.print_exception()
+            return 1
+        finally:
+            if watcher:
+                watcher.close()
+            for test in tests.values():
+                test.cleanup()
+                test.output.close()
+            self.cleanup(recap=False)
+
+    def watch_paths(self):
+        """
+        List the local folders that can affect the result of the tests
+        :return: list of paths
+        """
+        paths = [os.path.realpath(self.role),
+                 self.ansible_paths['roles'],
+                 self.ansible_paths['library']]
+        paths += list(self.ansible_paths['plugins'].values())
+        return [path for path in paths if path and os.path.isdir(path)]
+
+    def _sync_tests(self, tests, changed, limit, privileged):
+        """
+        Bring the running tests in line with the test files after a change,
+        tests whose file was removed are cleaned up, new and modified test
+        files are loaded and set up
+        :param tests: dict of test file to running Test, updated in place
+        :param changed: set of local paths that changed, None on the first run
+        :return: tuple of the test files to run and the ones that were just
+                 set up
+        """
+        local_tests = os.path.join(os.path.realpath(self.role), 'tests')
+        test_files = self.test_files()
+
+        for test_file in list(tests):
+            if test_file not in test_files:
+                tests.pop(test_file).cleanup()
+
+        if changed is None:
+            affected = test_files
+        else:
+            # a change outside of the test files can affect every test
+            by_path = dict((os.path.join(local_tests,
+                                         os.path.basename(test_file)),
+                            test_file) for test_file in test_files)
+            others = [path for path in changed if path not in by_path and
+                      not (os.path.dirname(path) == local_tests and
+                           path.endswith('.yml'))]
+            if others:
+                affected = test_files
+            else:
+                affected = sorted(by_path[path] for path in changed
+                                  if path in by_path)
+
+        fresh = set()
+        for test_file in affected:
+            try:
+                data = self.load_test(test_file)
+                test = tests.get(test_file)
+                if test and changed is not None and data != test.test:
+                    playbook = dict(data, playbook=test.test.get('playbook'))
+                    if playbook == test.test:
+                        # only the playbook changed, keep the containers
+                        test.test = data
+                        test.setup_playbook()
+                        continue
+                    tests.pop(test_file).cleanup()
+                    test = None
+                if test is None:
+                    test = Test(self, data, test_file)
+                    test.output.header('TEST [%s]' % test.name)
+                    tests[test_file] = test
+                    fresh.add(test_file)
+                    test.setup(limit, privileged)
+            except (Exception, ExecuteReturnCodeError):
+                self.print_exception()
+                broken = tests.pop(test_file, None)
+                if broken:
+                    broken.cleanup()
+        return affected, fresh
+
+    def _watch_play(self, test, options):
+        """
+        Run the playbook of a test whose containers are already running
+        :return: True if the test succeeded
+        """
+        success = False
+        start = time.time()
+        test.output.header('TEST [%s]' % test.name)
+        try:
+            test.play(**options)
+            success = True
+        except ExecuteReturnCodeError as e:
+            test.output.echo(str(e), fg='red')
+        except Exception:
+            # keep watching, the next change may fix it
+            self.print_exception()
+        test.receipts = test.load_receipts()
+        test.duration = time.time() - start
+        self.report(test, success)
+        return success
+
+    def report(self, test, success):
+        """
+        Send the results of a finished test to the reporters
+        :param test: the Test object
+        :param success: whether the test playbook succeeded
+        """
+        for reporter in self.reporters:
+            try:
+                reporter.add(self, test, success)
+            except Exception as e:
+                self.output.echo('warning: could not write report: %s' % e,
+                                 fg='yellow')
+
+    def run_test(self, test, **options):
+        """
+        Run a single test and record its result, can be called from several
+        threads at once
+        :param test: the Test object to run
+        :param options: options passed to Test.run
+        :return: True if the test succeeded
+        """
+        if self.watchdog and self.watchdog.expired:
+            return self._skip(test, 'run timeout of %s exceeded' %
+                              format_duration(self.watchdog.run_timeout))
+        if interrupted.is_set():
+            return self._skip(test, 'run interrupted')
+
+        with self._lock:
+            self._running.add(test)
+        try:
+            success = test.run(**options)
+        finally:
+            with self._lock:
+                self._running.discard(test)
+        with self._lock:
+            if success:
+                self.res['success'] += 1
+            else:
+                self.res['failed'] += 1
+        return success
+
+    def _skip(self, test, reason):
+        test.output.header('TEST [%s]' % test.name)
+        test.output.echo('skipped: %s' % reason, fg='blue')
+        test.output.finish(False)
+        test.output.close()
+        with self._lock:
+            self.res['skip'] += 1
+        return False
+
+    def setup(self):
+        """
+        Start the ansible container and install the role and its dependencies
+        """
+        self.output.header('TESTS [%s]' % self.role_name)
+        self.setup_ansible()
+        self.install_role_deps()
 
     def setup_ansible(self):
         """
         Setup our ansible container, pulling it from the registry if necessary
         also if the repo is of type GIT or GALAXY, clone/download it
         """
-        self.print_header('STARTING ANSIBLE')
+        self.output.header('STARTING ANSIBLE')
 
-        image_name = 'aeriscloud/ansible:' + self.ansible_version
         self.ansible = self.docker.create('ansible', tty=True,
-                                          image=image_name,
+                                          image=controller_image(
+                                              self.ansible_version),
                                           environment=self.environment,
-                                          progress=pull_image_progress(),
+                                          progress=pull_image_progress(
+                                              self.output.console),
                                           host_config={
                                               'Binds': self.bindings
                                           })
@@ -246,12 +658,12 @@ class TestFramework(object):
         self.ansible.start()
 
         if self.ansible.pulled:
-            click.secho('pulled: [%s]' % self.ansible.image, fg='yellow')
+            self.output.echo('pulled: [%s]' % self.ansible.image, fg='yellow')
         else:
-            click.secho('ok: [%s]' % self.ansible.image, fg='green')
+            self.output.echo('ok: [%s]' % self.ansible.image, fg='green')
 
         if self.type == TestFramework.TYPE_GIT:
-            self.print_header('GIT CLONE [%s]' % self.role)
+            self.output.header('GIT CLONE [%s]' % self.role)
             branch = None
             if '#' in self.role:
                 self.role, branch = self.role.split('#')
@@ -262,7 +674,7 @@ class TestFramework(object):
             self.stream(*git_cmd)
         elif self.type == TestFramework.TYPE_GALAXY:
             # role is an ansible galaxy role
-            self.print_header('GALAXY [%s]' % self.role)
+            self.output.header('GALAXY [%s]' % self.role)
             self.stream('ansible-galaxy', 'install', self.role)
 
     def setup_bindings(self):
@@ -270,7 +682,10 @@ class TestFramework(object):
         Setup ansible bidings based on the configuration passed
         """
         if self.ansible_paths['roles']:
+            self.ansible_paths['roles'] = os.path.realpath(
+                self.ansible_paths['roles'])
             self.bindings.append(':'.join([self.ansible_paths['roles'], '/roles', 'ro']))
+            self.roles_dirs.append('/roles/')
 
         if self.ansible_paths['library']:
             self.bindings.append(':'.join([self.ansible_paths['library'], '/usr/share/ansible/library', 'ro']))
@@ -297,20 +712,23 @@ class TestFramework(object):
                 'ro'
             ]))
 
-    def stream(self, *cmd):
+    def stream(self, *cmd, **kwargs):
         """
         Run a command on the ansible container and stream the result
-        to stdout
+        to the output
+        :param output: Output to send the result to, defaults to the
+                       framework's one
         """
         if not self.ansible:
             raise RuntimeError('ansible container is not running')
+        output = kwargs.get('output') or self.output
         for line in self.ansible.stream(cmd, tty=True):
-            click.echo(line, nl=False)
+            output.echo(line, nl=False)
 
-    def tests(self):
+    def test_files(self):
         """
-        Generator that yields Test objects found in the role
-        :yield: Test
+        List the test files found in the role
+        :return: list of paths on the ansible container
         """
         try:
             # not the most elegent way to do things
@@ -324,9 +742,44 @@ class TestFramework(object):
         except ExecuteReturnCodeError as e:
             if e.code != 2:
                 raise
-            return
+            return []
 
-        for test in tests:
-            test_file = os.path.join(self.role_path, 'tests', test.strip())
-            test = yaml.load(self.ansible.content(test_file))
-            yield Test(self, test)
+        return [os.path.join(self.role_path, 'tests', test)
+                for test in tests]
+
+    def load_test(self, test_file):
+        """
+        Load a test file from the ansible container
+        :param test_file: path of the test file
+        :return: dict
+        """
+        return yaml.load(self.ansible.content(test_file))
+
+    def plan(self, test_files, slots=1):
+        """
+        Select the tests of our shard and order them longest first according
+        to their recorded durations, so that a long test does not start last,
+        and predict the wall time of running them
+        :param test_files: list of test files
+        :param slots: number of tests running concurrently
+        :return: list of test files
+        """
+        durations = expected_durations(self.history, self.role_name,
+                                       test_files, self.ansible_version)
+        if self.shard:
+            selected = shard_tests(
+                test_files, self.shard[0], self.shard[1],
+                self.shard_durations.get(self.role_name))
+            self.sharded = (len(selected), len(test_files))
+            test_files = selected
+        ordered = longest_first(test_files, durations)
+        self.predicted = makespan([durations[f][0] for f in ordered], slots)
+        return ordered
+
+    def tests(self):
+        """
+        Generator that yields Test objects found in the role, longest first
+        :yield: Test
+        """
+        for test_file in self.plan(self.test_files()):
+            yield Test(self, self.load_test(test_file), test_file)
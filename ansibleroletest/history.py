@@ -0,0 +1,322 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import sqlite3
+import time
+
+from .reports import host_results
+from .runs import RUN_ID
+from .utils import cache_dir
+
+
+def test_key(test):
+    """
+    Identifies a test across runs: the name of its file, or its name for
+    tests that were not loaded from a file
+    :param test: the Test object
+    """
+    if test.test_file:
+        return file_key(test.test_file)
+    return test.name
+
+
+def file_key(test_file):
+    """
+    Same as test_key, from the path of the test file
+    """
+    return os.path.splitext(os.path.basename(test_file))[0]
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class RunHistory(object):
+    """
+    Local database of the duration and outcome of every test, host and task
+    run. Used as a reporter, rows are only ever appended and queries go
+    through the (role, test, date) index so they stay fast with a large
+    history.
+    """
+
+    def __init__(self, path=None):
+        if not path:
+            path = os.path.join(cache_dir, 'history.db')
+        self.path = path
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        """
+        Open a new connection to the database, creating the schema if needed.
+        Connections are not shared so that tests finishing in several threads
+        can record their results concurrently.
+        """
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS tests (
+                id INTEGER PRIMARY KEY,
+                run_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                ansible_version TEXT,
+                test TEXT NOT NULL,
+                date INTEGER NOT NULL,
+                duration REAL,
+                success INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS hosts (
+                test_id INTEGER NOT NULL,
+                host TEXT NOT NULL,
+                status TEXT NOT NULL,
+                duration REAL
+            );
+            CREATE TABLE IF NOT EXISTS tasks (
+                test_id INTEGER NOT NULL,
+                host TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                name TEXT,
+                state TEXT,
+                duration REAL
+            );
+            CREATE INDEX IF NOT EXISTS tests_role
+                ON tests (role, test, date);
+            CREATE INDEX IF NOT EXISTS tests_date
+                ON tests (role, date);
+            CREATE INDEX IF NOT EXISTS hosts_test
+                ON hosts (test_id);
+            CREATE INDEX IF NOT EXISTS tasks_test
+                ON tasks (test_id);
+        """)
+        return conn
+
+    def add(self, framework, test, success):
+        """
+        Record the results of a finished test, same interface as the reports
+        """
+        results = host_results(test)
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    'INSERT INTO tests (run_id, role, ansible_version, test, '
+                    'date, duration, success) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (RUN_ID, framework.role_name, framework.ansible_version,
+                     test_key(test), int(time.time()), test.duration,
+                     success and 1 or 0)
+                )
+                test_id = cursor.lastrowid
+                conn.executemany(
+                    'INSERT INTO hosts (test_id, host, status, duration) '
+                    'VALUES (?, ?, ?, ?)',
+                    [(test_id, result['host'], result['status'],
+                      result['duration']) for result in results]
+                )
+                conn.executemany(
+                    'INSERT INTO tasks (test_id, host, position, name, state, '
+                    'duration) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(test_id, result['host'], position, task['name'],
+                      task['state'], task['duration'])
+                     for result in results
+                     for position, task in enumerate(result['tasks'])]
+                )
+        finally:
+            conn.close()
+
+    def close(self):
+        pass
+
+    def roles(self):
+        """
+        List the roles found in the history with their number of test runs
+        and last run date
+        :return: list of dicts
+        """
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(
+                'SELECT role, COUNT(*) AS runs, MAX(date) AS date '
+                'FROM tests GROUP BY role ORDER BY role')]
+        finally:
+            conn.close()
+
+    def trend(self, role, test=None, ansible_version=None, limit=20):
+        """
+        The most recent runs of the tests of a role
+        :param role: role name
+        :param test: only return the runs of that test
+        :param ansible_version: only return the runs using this version
+        :param limit: number of runs to return for each test
+        :return: dict of test to a list of runs (dicts), oldest first
+        """
+        clauses = ['role = ?']
+        params = [role]
+        if ansible_version:
+            clauses.append('ansible_version = ?')
+            params.append(ansible_version)
+
+        conn = self._connect()
+        try:
+            if test:
+                tests = [test]
+            else:
+                tests = [row[0] for row in conn.execute(
+                    'SELECT DISTINCT test FROM tests WHERE role = ? '
+                    'ORDER BY test', (role,))]
+
+            trends = {}
+            for name in tests:
+                rows = conn.execute(
+                    'SELECT * FROM tests WHERE %s AND test = ? '
+                    'ORDER BY date DESC, id DESC LIMIT ?' %
+                    ' AND '.join(clauses), params + [name, limit])
+                runs = [dict(row) for row in rows]
+                if runs:
+                    trends[name] = list(reversed(runs))
+            return trends
+        finally:
+            conn.close()
+
+    def durations(self, role, tests, ansible_version=None, samples=5):
+        """
+        Expected duration of tests: the median of their last runs, runs that
+        errored before the playbook started are ignored
+        :param role: role name
+        :param tests: list of test keys
+        :param ansible_version: prefer the runs using that version
+        :param samples: number of runs the median is computed from
+        :return: dict of test key to seconds, tests never run are missing
+        """
+        if not self.exists:
+            return {}
+
+        conn = self._connect()
+        try:
+            durations = {}
+            for test in tests:
+                values = []
+                for version in (ansible_version, None):
+                    clauses = ['role = ?', 'test = ?', 'duration > 0',
+                               'EXISTS (SELECT 1 FROM hosts '
+                               'WHERE hosts.test_id = tests.id)']
+                    params = [role, test]
+                    if version:
+                        clauses.append('ansible_version = ?')
+                        params.append(version)
+                    values = [row[0] for row in conn.execute(
+                        'SELECT duration FROM tests WHERE %s '
+                        'ORDER BY date DESC, id DESC LIMIT ?' %
+                        ' AND '.join(clauses), params + [samples])]
+                    if values or not ansible_version:
+                        break
+                if values:
+                    durations[test] = _median(values)
+            return durations
+        finally:
+            conn.close()
+
+    def slowest_tasks(self, role, since=None, limit=10):
+        """
+        The tasks of a role taking the most time on average, the query reads
+        every run since the given date
+        :param role: role name
+        :param since: only consider runs after this timestamp, defaults to
+                      every run of the role
+        :param limit: number of tasks to return
+        :return: list of dicts with the test, name, runs, average and max
+                 duration keys
+        """
+        clauses = ['tests.role = ?', 'tasks.duration IS NOT NULL']
+        params = [role]
+        if since is not None:
+            clauses.append('tests.date >= ?')
+            params.append(int(since))
+
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(
+                'SELECT tests.test AS test, tasks.name AS name, '
+                'COUNT(*) AS runs, AVG(tasks.duration) AS average, '
+                'MAX(tasks.duration) AS max '
+                'FROM tests JOIN tasks ON tasks.test_id = tests.id '
+                'WHERE %s GROUP BY tests.test, tasks.name '
+                'ORDER BY average DESC LIMIT ?' % ' AND '.join(clauses),
+                params + [limit])]
+        finally:
+            conn.close()
+
+    def regressions(self, role, window=10, threshold=1.5, min_delta=1.0):
+        """
+        Compare the last run of each test of a role against the median of the
+        previous runs (the baseline), at the test and task level
+        :param role: role name
+        :param window: number of previous runs the baseline is computed from
+        :param threshold: ratio to the baseline above which a duration is
+                          considered a regression
+        :param min_delta: ignore regressions of less than that many seconds
+        :return: list of dicts with the test, host, task (None for the test
+                 itself), baseline and duration keys, worst first
+        """
+        regressions = []
+        for test, runs in self.trend(role, limit=window + 1).items():
+            if len(runs) < 2:
+                continue
+            last, previous = runs[-1], runs[:-1]
+
+            def _check(host, task, duration, baseline):
+                if duration is None or baseline is None:
+                    return
+                if duration > baseline * threshold and \
+                        duration - baseline >= min_delta:
+                    regressions.append({
+                        'test': test, 'host': host, 'task': task,
+                        'baseline': baseline, 'duration': duration,
+                        'date': last['date']
+                    })
+
+            _check(None, None, last['duration'], _median(
+                [run['duration'] for run in previous
+                 if run['duration'] is not None]))
+
+            durations = self._task_durations([run['id'] for run in runs])
+            for key, duration in durations.get(last['id'], {}).items():
+                _check(key[0], key[1], duration, _median(
+                    [durations[run['id']][key] for run in previous
+                     if key in durations.get(run['id'], {})]))
+
+        return sorted(regressions,
+                      key=lambda r: r['duration'] - r['baseline'],
+                      reverse=True)
+
+    def _task_durations(self, test_ids):
+        """
+        Load the duration of the tasks of several test runs
+        :return: dict of test id to a dict of (host, task name) to duration
+        """
+        conn = self._connect()
+        try:
+            durations = {}
+            rows = conn.execute(
+                'SELECT test_id, host, name, SUM(duration) AS duration '
+                'FROM tasks WHERE test_id IN (%s) AND duration IS NOT NULL '
+                'GROUP BY test_id, host, name' %
+                ', '.join('?' * len(test_ids)), test_ids)
+            for row in rows:
+                durations.setdefault(row['test_id'], {})[
+                    (row['host'], row['name'])] = row['duration']
+            return durations
+        finally:
+            conn.close()
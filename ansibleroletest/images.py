@@ -0,0 +1,186 @@
+from __future__ import unicode_literals, absolute_import
+
+import glob
+import os
+import yaml
+
+from .prepare import PREPARED_REPOSITORY
+
+BOX_REPOSITORY = 'aeriscloud/ansible-'
+CONTROLLER_REPOSITORY = 'aeriscloud/ansible'
+ANSIBLE_VERSIONS = ('1.8', '1.9', '2.1', 'latest')
+
+
+def box_image(image):
+    """
+    Returns the full name of a test container image, images outside of a
+    namespace are taken from the aeriscloud boxes
+    :param image: image name as written in a test file, eg. centos:7
+    :return: eg. aeriscloud/ansible-centos:7
+    """
+    if '/' not in image:
+        return BOX_REPOSITORY + image
+    return image
+
+
+def controller_image(ansible_version):
+    """
+    Returns the name of the ansible container image for an ansible version
+    """
+    return '%s:%s' % (CONTROLLER_REPOSITORY, ansible_version)
+
+
+def repository(image):
+    """
+    Strip the tag or digest from an image name
+    """
+    if '@' in image:
+        return image.split('@', 1)[0]
+    name, _, tag = image.rpartition(':')
+    if name and '/' not in tag:
+        return name
+    return image
+
+
+def tagged(image):
+    """
+    Add the implicit latest tag to an image name
+    """
+    if '@' in image or ':' in image.rsplit('/', 1)[-1]:
+        return image
+    return image + ':latest'
+
+
+def is_managed(image):
+    """
+    Whether an image is one of the boxes or controllers used by the tests
+    """
+    repo = repository(image)
+    return repo == CONTROLLER_REPOSITORY or repo.startswith(BOX_REPOSITORY)
+
+
+def role_images(role_path):
+    """
+    List the images used by the test files of a local role
+    :param role_path: path to the role
+    :return: set of image names
+    """
+    # imported here to avoid a circular import, test uses box_image
+    from .test import DEFAULT_CONTAINERS
+
+    images = set()
+    for test_file in glob.glob(os.path.join(role_path, 'tests', '*.yml')):
+        with open(test_file) as fd:
+            test = yaml.load(fd) or {}
+        if not isinstance(test, dict):
+            continue
+        containers = test.get('containers') or DEFAULT_CONTAINERS
+        for info in containers.values():
+            if isinstance(info, dict):
+                info = info.get('image')
+            if info:
+                images.add(box_image(info))
+    return images
+
+
+def referenced_images(roles=None, ansible_versions=ANSIBLE_VERSIONS):
+    """
+    List every image the tests may need: the default boxes, the ansible
+    controllers and the images named in the test files of the given roles
+    :param roles: list of paths to local roles
+    :param ansible_versions: controller versions to include
+    :return: sorted list of image names
+    """
+    from .test import DEFAULT_CONTAINERS
+
+    images = set(box_image(image) for image in DEFAULT_CONTAINERS.values())
+    images.update(controller_image(version) for version in ansible_versions)
+    for role in roles or []:
+        images.update(role_images(role))
+    return sorted(images)
+
+
+def image_status(client, images):
+    """
+    Check which images are available on a docker host
+    :param client: docker client
+    :param images: list of image names
+    :return: list of dicts with the name, id, digest, size and creation date
+             of each image, id is None when the image is missing
+    """
+    by_tag = {}
+    for image in client.images():
+        for tag in image.get('RepoTags') or []:
+            by_tag[tag] = image
+
+    status = []
+    for name in images:
+        tag = tagged(name)
+        image = by_tag.get(tag) or {}
+        digests = [digest for digest in image.get('RepoDigests') or []
+                   if repository(digest) == repository(tag)]
+        status.append({
+            'name': name,
+            'id': image.get('Id'),
+            'digest': digests and digests[0].split('@', 1)[1] or None,
+            'size': image.get('Size'),
+            'created': image.get('Created')
+        })
+    return status
+
+
+def superseded_images(client, all_versions=False, keep=None):
+    """
+    Find the box and controller images that were replaced by a newer pull of
+    the same tag (left untagged by docker), the prepared images built from a
+    base image that was since updated and, when all_versions is set, the
+    tagged images that are not in keep
+    :param client: docker client
+    :param all_versions: also select tagged images not listed in keep
+    :param keep: list of image names to keep
+    :return: list of dicts with the id, name and size of the images
+    """
+    keep = set(tagged(image) for image in keep or [])
+    images = client.images()
+    ids = dict((tag, image['Id'])
+               for image in images
+               for tag in image.get('RepoTags') or [])
+
+    superseded = []
+    for image in images:
+        tags = [tag for tag in image.get('RepoTags') or []
+                if tag != '<none>:<none>']
+        if not tags:
+            digests = [digest for digest in image.get('RepoDigests') or []
+                       if is_managed(digest)]
+            if digests:
+                superseded.append({
+                    'id': image['Id'],
+                    'name': digests[0],
+                    'size': image.get('Size') or 0
+                })
+            continue
+
+        # prepared images whose base image was updated since they were built
+        labels = image.get('Labels') or {}
+        prepared = [tag for tag in tags
+                    if tag.startswith(PREPARED_REPOSITORY)]
+        if prepared and labels.get('art.prepared.base_id') != \
+                ids.get(tagged(labels.get('art.prepared.base', ''))):
+            superseded.append({
+                'id': image['Id'],
+                'name': prepared[0],
+                'size': image.get('Size') or 0
+            })
+            continue
+
+        if all_versions:
+            managed = [tag for tag in tags if is_managed(tag)]
+            if managed and len(managed) == len(tags) and \
+                    not keep.intersection(managed):
+                superseded.append({
+                    'id': image['Id'],
+                    'name': managed[0],
+                    'size': image.get('Size') or 0
+                })
+    return superseded
@@ -0,0 +1,202 @@
+from __future__ import unicode_literals, absolute_import
+
+import click
+import collections
+import io
+import os
+import re
+import sys
+import threading
+
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+
+
+class Console(object):
+    """
+    The terminal shared by every framework and test of the process. In
+    status mode, it keeps one line per running test at the bottom of the
+    screen, regular messages being printed above them.
+    """
+
+    def __init__(self, status=False):
+        self.status = status
+        self.tty = sys.stdout.isatty()
+        self._lock = threading.RLock()
+        self._lines = collections.OrderedDict()
+        self._drawn = 0
+
+    def echo(self, message='', nl=True, err=False, source=None, **styles):
+        """
+        Same as click.secho
+        :param source: name of the output the message comes from
+        """
+        with self._lock:
+            self._clear()
+            if styles:
+                message = click.style(message, **styles)
+            click.echo(message, nl=nl, err=err)
+            self._draw()
+
+    def update(self, key, text):
+        """
+        Set the status line of a running test
+        """
+        if not self.status:
+            return
+        with self._lock:
+            self._clear()
+            self._lines[key] = text
+            self._draw()
+
+    def remove(self, key):
+        """
+        Remove the status line of a test
+        """
+        with self._lock:
+            self._clear()
+            self._lines.pop(key, None)
+            self._draw()
+
+    def _clear(self):
+        if self._drawn:
+            click.echo('\033[%dA\033[J' % self._drawn, nl=False)
+            self._drawn = 0
+
+    def _draw(self):
+        if not self.status or not self.tty or not self._lines:
+            return
+        width = click.get_terminal_size()[0]
+        for text in self._lines.values():
+            click.echo(text[:width - 1])
+        self._drawn = len(self._lines)
+
+
+class EventConsole(Console):
+    """
+    Sends the messages to a callback instead of the terminal, for programs
+    embedding the framework. The callback is called with one dict per
+    message and never concurrently.
+    """
+
+    def __init__(self, sink):
+        super(EventConsole, self).__init__(status=False)
+        self.sink = sink
+        self.tty = False
+
+    def echo(self, message='', nl=True, err=False, source=None, **styles):
+        with self._lock:
+            self.sink({
+                'event': 'output',
+                'source': source,
+                'message': click.unstyle(message),
+                'nl': nl,
+                'err': err,
+                'styles': styles
+            })
+
+
+class Output(object):
+    """
+    Receives the messages of a framework or a test. Messages are written to
+    a log file in the run directory (if any) and either echoed on the
+    console or, in status mode, kept in a ring buffer that is only displayed
+    if the test fails.
+    """
+
+    def __init__(self, console=None, run_dir=None, name=None, filename=None,
+                 buffer_size=200):
+        self.console = console or Console()
+        self.run_dir = run_dir
+        self.name = name
+        self.path = None
+        self._fd = None
+        self._partial = ''
+        self._buffer = collections.deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+
+        if run_dir and filename:
+            if not os.path.exists(run_dir):
+                os.makedirs(run_dir)
+            self.path = os.path.join(run_dir, filename)
+            self._fd = io.open(self.path, 'a', encoding='utf-8')
+
+    @property
+    def quiet(self):
+        """
+        Whether messages are kept off the console
+        """
+        return self.console.status and self.name is not None
+
+    def child(self, name, filename):
+        """
+        Create the output of a test (or framework) belonging to this one
+        :param name: name displayed in the status line
+        :param filename: name of the log file in the run directory
+        """
+        return Output(self.console, self.run_dir, name, filename,
+                      self._buffer.maxlen)
+
+    def echo(self, message='', nl=True, err=False, **styles):
+        """
+        Same as click.secho
+        """
+        text = nl and message + '\n' or message
+
+        with self._lock:
+            if self._fd:
+                self._fd.write(ANSI_ESCAPE.sub('', text))
+                self._fd.flush()
+
+            lines = (self._partial + text).split('\n')
+            self._partial = lines.pop()
+            for line in lines:
+                line = line.rstrip('\r')
+                self._buffer.append(styles and click.style(line, **styles)
+                                    or line)
+                if self.quiet and line.startswith(('PLAY', 'TASK')):
+                    self.status(line.rstrip(' *'))
+
+        if not self.quiet:
+            self.console.echo(message, nl=nl, err=err, source=self.name,
+                              **styles)
+
+    def header(self, text):
+        """
+        Display an ansible-like header
+        """
+        self.echo('\n' + text + ' ' + ((78 - len(text)) * '*'))
+        if self.quiet:
+            self.status(text)
+
+    def status(self, text):
+        """
+        Update the status line of this output
+        """
+        if self.name is not None:
+            self.console.update(self, '%s: %s' % (self.name, text))
+
+    def finish(self, success):
+        """
+        Remove the status line, and if the test failed while in status mode,
+        display the last lines of its output
+        :param success: whether the test succeeded
+        """
+        if not self.quiet:
+            return
+
+        self.console.remove(self)
+        log = self.path and ' (log: %s)' % self.path or ''
+        if success:
+            self.console.echo('ok: [%s]%s' % (self.name, log), fg='green')
+            return
+
+        with self._lock:
+            lines = list(self._buffer)
+        self.console.echo('failed: [%s]%s' % (self.name, log), fg='red')
+        for line in lines:
+            self.console.echo('    %s' % line)
+
+    def close(self):
+        if self._fd:
+            self._fd.close()
+            self._fd = None
@@ -0,0 +1,143 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import slugify
+import threading
+
+from .container import ExecuteReturnCodeError
+from .utils import cache_dir
+
+# configure the package manager of the box to keep the packages it
+# downloads and link the packages of the shared cache into its own cache
+# folder, package managers lock their cache so it cannot be shared directly
+# between concurrent containers
+SEED_SCRIPT = """
+umask 0
+SHARED={shared}
+if [ -d /etc/apt ]; then
+    rm -f /etc/apt/apt.conf.d/docker-clean
+    echo 'APT::Keep-Downloaded-Packages "true";' \
+        > /etc/apt/apt.conf.d/99art-keep-packages
+    echo 'Binary::apt::APT::Keep-Downloaded-Packages "true";' \
+        >> /etc/apt/apt.conf.d/99art-keep-packages
+    DEST=/var/cache/apt/archives
+elif [ -f /etc/dnf/dnf.conf ]; then
+    sed -i '/^keepcache/d; /^\\[main\\]/a keepcache=1' /etc/dnf/dnf.conf
+    DEST=/var/cache/dnf
+elif [ -f /etc/yum.conf ]; then
+    sed -i '/^keepcache/d; /^\\[main\\]/a keepcache=1' /etc/yum.conf
+    DEST=/var/cache/yum
+else
+    exit 0
+fi
+cd $SHARED && find . -type f \\( -name '*.deb' -o -name '*.rpm' \\) |
+while read f; do
+    mkdir -p "$DEST/$(dirname "$f")"
+    [ -e "$DEST/$f" ] || ln -s "$SHARED/$f" "$DEST/$f"
+done
+"""
+
+# copy the packages downloaded by the box to the shared cache, through a
+# rename so that other containers never see a partial file. The temporary
+# file comes from mktemp as concurrent containers often share the same pids.
+# The links made by SEED_SCRIPT are removed, they would dangle in the images
+# committed from the container.
+COLLECT_SCRIPT = """
+umask 0
+SHARED={shared}
+for DEST in /var/cache/apt/archives /var/cache/dnf /var/cache/yum; do
+    [ -d $DEST ] || continue
+    cd $DEST && find . -type f \\( -name '*.deb' -o -name '*.rpm' \\) \
+        ! -path './partial/*' |
+    while read f; do
+        [ -e "$SHARED/$f" ] && continue
+        mkdir -p "$SHARED/$(dirname "$f")"
+        TMP=$(mktemp "$SHARED/$(dirname "$f")/.$(basename "$f").XXXXXX") &&
+            cp "$f" "$TMP" && chmod 644 "$TMP" && mv "$TMP" "$SHARED/$f" ||
+            rm -f "$TMP"
+    done
+    find $DEST -type l -lname "$SHARED/*" -delete
+done
+"""
+
+
+class PackageCache(object):
+    """
+    Packages downloaded by apt and yum in the box containers, kept in a
+    folder per box image on the docker host and shared by every test. The
+    least recently used packages are removed once the cache grows over
+    max_size.
+    """
+    CONTAINER_PATH = '/var/cache/art-packages'
+
+    def __init__(self, path=None, max_size=None):
+        self.path = path or os.path.join(cache_dir, 'packages')
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+    def binding(self, image):
+        """
+        Returns the binding of the cache folder of an image, creating it
+        :param image: full name of the box image
+        """
+        path = os.path.join(self.path, slugify.slugify(image))
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(path)
+                os.chmod(path, 0o777)
+        return ':'.join([path, PackageCache.CONTAINER_PATH])
+
+    def seed(self, container, output):
+        """
+        Make the cached packages available to a started box container
+        """
+        self._execute(container, SEED_SCRIPT, output)
+
+    def collect(self, container, output):
+        """
+        Add the packages downloaded by a box container to the cache
+        """
+        self._execute(container, COLLECT_SCRIPT, output)
+
+    def _execute(self, container, script, output):
+        try:
+            container.execute([
+                'sh', '-c', script.format(shared=PackageCache.CONTAINER_PATH)
+            ], user='root')
+        except ExecuteReturnCodeError as e:
+            output.echo('warning: package cache: %s' % e, fg='yellow')
+
+    def evict(self):
+        """
+        Remove the least recently used packages until the cache fits in
+        max_size, a package is used when it is downloaded or installed
+        (as far as the access times of the filesystem allow)
+        :return: number of bytes reclaimed
+        """
+        if not self.max_size or not os.path.exists(self.path):
+            return 0
+
+        with self._lock:
+            files = []
+            total = 0
+            for root, _, filenames in os.walk(self.path):
+                for filename in filenames:
+                    path = os.path.join(root, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((max(stat.st_atime, stat.st_mtime),
+                                  stat.st_size, path))
+                    total += stat.st_size
+
+            reclaimed = 0
+            for _, size, path in sorted(files):
+                if total - reclaimed <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                    reclaimed += size
+                except OSError:
+                    pass
+            return reclaimed
@@ -0,0 +1,118 @@
+from __future__ import unicode_literals, absolute_import
+
+import heapq
+import io
+import json
+
+from .history import file_key
+
+# expected duration of a test when no test of the role was ever recorded
+DEFAULT_DURATION = 120.0
+
+
+def expected_durations(history, role, test_files, ansible_version=None):
+    """
+    Expected duration of each test file from the recorded history, tests
+    never seen are given the duration of the longest known test of the role
+    (or DEFAULT_DURATION), so that they are not left for the end
+    :param history: RunHistory or None
+    :param role: role name
+    :param test_files: list of test files
+    :param ansible_version: ansible version the tests will run with
+    :return: dict of test file to (seconds, whether it was recorded)
+    """
+    known = {}
+    if history is not None:
+        known = history.durations(role, [file_key(f) for f in test_files],
+                                  ansible_version)
+    default = known and max(known.values()) or DEFAULT_DURATION
+    return dict(
+        (test_file, (known.get(file_key(test_file), default),
+                     file_key(test_file) in known))
+        for test_file in test_files
+    )
+
+
+def longest_first(test_files, durations):
+    """
+    Order the tests longest first (LPT), ties keep their discovery order
+    :param durations: as returned by expected_durations
+    :return: list of test files
+    """
+    order = dict((test_file, idx) for idx, test_file in enumerate(test_files))
+    return sorted(test_files,
+                  key=lambda f: (-durations[f][0], order[f]))
+
+
+def shard_tests(test_files, index, total, durations=None):
+    """
+    Split tests over several workers. Workers usually run on different
+    machines with their own history, so the split only relies on what they
+    all agree on: the tests are dealt round-robin in name order or, when
+    durations shared by every worker are given, handed out longest first to
+    the least loaded shard. Workers get disjoint shards covering every test
+    as long as they discover the same tests.
+    :param index: shard to return, from 1 to total
+    :param total: number of shards
+    :param durations: dict of test key to seconds, the same for every worker
+                      (see load_durations), tests missing from it are given
+                      the longest known duration
+    :return: the test files of the shard, in discovery order
+    """
+    by_name = sorted(test_files, key=lambda f: (file_key(f), f))
+    if not durations:
+        selected = set(by_name[index - 1::total])
+    else:
+        default = max(durations.values())
+
+        def _duration(test_file):
+            return durations.get(file_key(test_file), default)
+
+        loads = [0.0] * total
+        selected = set()
+        for test_file in sorted(by_name, key=lambda f: -_duration(f)):
+            target = min(range(total), key=lambda i: (loads[i], i))
+            loads[target] += _duration(test_file)
+            if target == index - 1:
+                selected.add(test_file)
+    return [test_file for test_file in test_files if test_file in selected]
+
+
+def load_durations(paths):
+    """
+    Read the durations of the tests from the NDJSON reports of a previous
+    run, a source every worker of a sharded run can share (eg. as a CI
+    artifact)
+    :param paths: list of report paths
+    :return: dict of role name to a dict of test key to seconds
+    """
+    durations = {}
+    for path in paths:
+        with io.open(path, encoding='utf-8') as fd:
+            for line in fd:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if not record.get('role') or \
+                        record.get('test_duration') is None:
+                    continue
+                key = record.get('test_file') and \
+                    file_key(record['test_file']) or record.get('test')
+                tests = durations.setdefault(record['role'], {})
+                tests[key] = max(tests.get(key, 0),
+                                 float(record['test_duration']))
+    return durations
+
+
+def makespan(durations, slots=1):
+    """
+    Predict the wall time of running tests in the given order on a number of
+    slots, each test starting on the first slot to become free
+    :param durations: list of durations in dispatch order
+    :param slots: number of tests running concurrently
+    :return: seconds
+    """
+    ends = [0.0] * max(1, slots)
+    for duration in durations:
+        heapq.heapreplace(ends, ends[0] + duration)
+    return max(ends)
@@ -0,0 +1,156 @@
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import json
+import os
+import slugify
+import threading
+import uuid
+import yaml
+
+from .admission import DEFAULT_DEMAND
+from .container import Container
+from .utils import pull_image_progress
+
+PREPARED_REPOSITORY = 'art-prepared/'
+
+
+class ImagePreparer(object):
+    """
+    Builds the derived box images declared by the prepare section of test
+    files: the prepare playbook is run once on a container of the base image
+    which is then committed. Images are tagged with a hash of the prepare
+    section and of the base image id, so they are only rebuilt when either
+    changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _image_lock(self, client, image):
+        with self._lock:
+            key = (client.base_url, image)
+            if key not in self._locks:
+                self._locks[key] = threading.Lock()
+            return self._locks[key]
+
+    @staticmethod
+    def image_name(base_image, base_id, prepare):
+        """
+        Returns the name of the derived image
+        :param base_image: full name of the base image
+        :param base_id: id of the base image
+        :param prepare: the prepare playbook, with the role name replaced
+        :return: eg. art-prepared/aeriscloud-ansible-centos-7:3f2a...
+        """
+        digest = hashlib.sha256(json.dumps(
+            {'base': base_id, 'prepare': prepare}, sort_keys=True
+        ).encode('utf-8')).hexdigest()
+        return '%s%s:%s' % (PREPARED_REPOSITORY,
+                            slugify.slugify(base_image), digest[:16])
+
+    def prepare(self, test, base_image):
+        """
+        Returns the derived image of base_image for a test, building it if
+        needed. Tests sharing the same prepare section and base image wait
+        for the first one to build it.
+        :param test: the Test object, its prepare section is used
+        :param base_image: full name of the base image
+        :return: the name of the derived image
+        """
+        client = test.docker.client
+        Container.puller.pull(client, base_image,
+                              pull_image_progress(test.output.console))
+        base_id = client.inspect_image(base_image)['Id']
+
+        prepare = yaml.load(yaml.dump(test.test['prepare'])
+                            .replace('@ROLE_NAME@', test.role_name))
+        image_name = self.image_name(base_image, base_id, prepare)
+
+        with self._image_lock(client, image_name):
+            if image_name in Container.puller.images(client):
+                test.output.echo('ok: [%s] prepared as [%s]' % (
+                    base_image, image_name), fg='green')
+                return image_name
+
+            test.output.header('PREPARING [%s]' % base_image)
+            self._build(test, base_image, base_id, prepare, image_name)
+            Container.puller.refresh(client)
+            test.output.echo('prepared: [%s] as [%s]' % (
+                base_image, image_name), fg='yellow')
+            return image_name
+
+    def _build(self, test, base_image, base_id, prepare, image_name):
+        """
+        Run the prepare playbook on a container of the base image, on a
+        network of its own, and commit the result. The container has no
+        limits and reserves the default demand of a container on the host.
+        """
+        framework = test.framework
+        docker = framework.docker.new()
+        suffix = uuid.uuid4().hex[:12]
+        playbook_file = 'prepare_%s.yml' % suffix
+        inventory_file = 'prepare_%s_inventory' % suffix
+
+        def _waiting():
+            test.output.echo('waiting: not enough resources to prepare [%s]'
+                             % base_image, fg='yellow')
+
+        reservation = framework.admission.acquire(
+            DEFAULT_DEMAND['cpus'], DEFAULT_DEMAND['memory'],
+            waiting=_waiting)
+        try:
+            network = docker.create_network('art-%s' % suffix)
+            network.connect(framework.ansible)
+
+            address = 'prepare.%s' % network.name
+            bindings = ['/sys/fs/cgroup:/sys/fs/cgroup:ro']
+            if framework.package_cache:
+                bindings.append(framework.package_cache.binding(base_image))
+            container = docker.create(
+                'prepare', image=base_image,
+                host_config={
+                    'Binds': bindings,
+                    'NetworkMode': network.name
+                },
+                networking_config=network.networking_config([address])
+            )
+            container.start()
+            if framework.package_cache:
+                framework.package_cache.seed(container, test.output)
+
+            with open(os.path.join(framework.work_dir, playbook_file),
+                      'w') as fd:
+                fd.write(yaml.dump(prepare))
+            with open(os.path.join(framework.work_dir, inventory_file),
+                      'w') as fd:
+                fd.write('prepare ansible_ssh_host=%s ansible_ssh_user=ansible '
+                         'ansible_ssh_pass=ansible\n' % address)
+
+            framework.stream('ansible-playbook',
+                             '-i', os.path.join('/work', inventory_file),
+                             os.path.join('/work', playbook_file),
+                             output=test.output)
+
+            if framework.package_cache:
+                framework.package_cache.collect(container, test.output)
+
+            container.stop()
+            repository, tag = image_name.rsplit(':', 1)
+            container.commit(
+                repository, tag,
+                'ansible-role-test prepared image of %s' % base_image,
+                conf={'Labels': {
+                    'art.prepared.base': base_image,
+                    'art.prepared.base_id': base_id,
+                    'art.role': test.role_name
+                }}
+            )
+        finally:
+            docker.destroy()
+            for filename in (playbook_file, inventory_file):
+                path = os.path.join(framework.work_dir, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            framework.admission.release(reservation)
@@ -0,0 +1,157 @@
+from __future__ import unicode_literals, absolute_import
+
+import gzip
+import json
+import os
+import six
+
+from .catalog import SNAPSHOT_PREFIX
+from .utils import cache_dir
+
+receipts_dir = os.path.join(cache_dir, 'receipts')
+
+
+def receipts_file(image_name):
+    """
+    Returns the name of the receipts file for a given snapshot
+    :param image_name: eg. art/role.centos-7:failed-1433908727-5f0c2e1a
+    """
+    if image_name.startswith(SNAPSHOT_PREFIX):
+        image_name = image_name[len(SNAPSHOT_PREFIX):]
+    return '%s.ndjson.gz' % image_name.replace(':', '-')
+
+
+def remove_receipts(image_name):
+    """
+    Delete the receipts stored for a snapshot, if any
+    """
+    path = os.path.join(receipts_dir, receipts_file(image_name))
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def write_receipts(image_name, receipts):
+    """
+    Store the receipts of a host as compressed json lines, the first line
+    holds the play stats and every following line is a task so that they
+    can be read back without loading the whole play in memory
+    :param image_name: snapshot the receipts belong to
+    :param receipts: the receipts as generated by the receipts callback
+    :return: the name of the file, relative to receipts_dir
+    """
+    if not os.path.exists(receipts_dir):
+        os.makedirs(receipts_dir)
+
+    filename = receipts_file(image_name)
+    path = os.path.join(receipts_dir, filename)
+    with gzip.open(path + '.tmp', 'wb') as fd:
+        fd.write(json.dumps({'stats': receipts['stats']}).encode('utf-8'))
+        fd.write(b'\n')
+        for task in receipts.get('tasks', []):
+            fd.write(json.dumps(task).encode('utf-8'))
+            fd.write(b'\n')
+    os.rename(path + '.tmp', path)
+
+    return filename
+
+
+class Receipts(object):
+    """
+    Lazy reader for the receipts stored by write_receipts
+    """
+
+    def __init__(self, filename):
+        self.path = os.path.join(receipts_dir, filename)
+        self._stats = None
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            with gzip.open(self.path, 'rb') as fd:
+                self._stats = json.loads(fd.readline().decode('utf-8'))['stats']
+        return self._stats
+
+    def tasks(self, failed=False, offset=0, limit=None):
+        """
+        Stream the tasks from the receipts file
+        :param failed: only yield failed tasks
+        :param offset: number of (matching) tasks to skip
+        :param limit: maximum number of tasks to yield
+        :yield: dict
+        """
+        with gzip.open(self.path, 'rb') as fd:
+            fd.readline()
+            tasks = (json.loads(line.decode('utf-8')) for line in fd)
+            for task in filter_tasks(tasks, failed, offset, limit):
+                yield task
+
+
+def filter_tasks(tasks, failed=False, offset=0, limit=None):
+    """
+    Filter and paginate an iterable of tasks without consuming more of it
+    than necessary
+    :param tasks: iterable of tasks
+    :param failed: only yield failed tasks
+    :param offset: number of (matching) tasks to skip
+    :param limit: maximum number of tasks to yield
+    :yield: dict
+    """
+    if limit is not None and limit <= 0:
+        return
+
+    count = 0
+    for task in tasks:
+        if failed and task.get('state') != 'failed':
+            continue
+        count += 1
+        if count <= offset:
+            continue
+        yield task
+        if limit is not None and count - offset >= limit:
+            return
+
+
+def task_duration(task):
+    """
+    Returns the duration of a task in seconds, from the start and end times
+    added by merge_timings
+    :param task: a task from the receipts
+    :return: float or None
+    """
+    if task.get('duration') is not None:
+        return float(task['duration'])
+    try:
+        return float(task['end']) - float(task['start'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def merge_timings(receipts, timings):
+    """
+    Add the start and end times recorded by the timings callback to the
+    tasks of the receipts. Both callbacks see the same events so tasks are
+    matched by position, or by name when a host has a different number of
+    timings and tasks.
+    :param receipts: receipts indexed by host, updated in place
+    :param timings: dict of host to a list of dicts with the name, start and
+                    end keys
+    """
+    for host, result in six.iteritems(receipts):
+        tasks = result.get('tasks', [])
+        host_timings = timings.get(host, [])
+        if len(tasks) == len(host_timings):
+            pairs = zip(tasks, host_timings)
+        else:
+            by_name = {}
+            for timing in host_timings:
+                by_name.setdefault(timing.get('name'), []).append(timing)
+            pairs = [(task, by_name[task.get('name')].pop(0))
+                     for task in tasks if by_name.get(task.get('name'))]
+        for task, timing in pairs:
+            if task.get('duration') is None and 'start' not in task:
+                task['start'] = timing.get('start')
+                task['end'] = timing.get('end')
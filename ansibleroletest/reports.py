@@ -0,0 +1,200 @@
+from __future__ import unicode_literals, absolute_import
+
+import io
+import json
+import os
+import six
+import threading
+import time
+
+from xml.sax.saxutils import escape, quoteattr
+
+from .receipts import task_duration
+
+
+def host_results(test):
+    """
+    Summarize the receipts of a finished test, one entry per host
+    :param test: the Test object
+    :return: list of dicts
+    """
+    results = []
+    for host, receipts in sorted(six.iteritems(test.receipts)):
+        stats = receipts.get('stats', {})
+        tasks = [{
+            'name': task.get('name'),
+            'state': task.get('state'),
+            'duration': task_duration(task)
+        } for task in receipts.get('tasks', [])]
+
+        failure = None
+        failed = [task for task in receipts.get('tasks', [])
+                  if task.get('state') == 'failed']
+        if failed:
+            failure = {'task': failed[-1].get('name'),
+                       'result': failed[-1].get('res')}
+
+        status = 'passed'
+        if stats.get('unreachable'):
+            status = 'unreachable'
+        elif stats.get('failed'):
+            status = 'failed'
+
+        results.append({
+            'host': host,
+            'status': status,
+            'duration': sum(task['duration'] or 0 for task in tasks),
+            'stats': stats,
+            'tasks': tasks,
+            'failure': failure
+        })
+    return results
+
+
+class NDJSONReport(object):
+    """
+    Writes one json document per test and host as soon as a test finishes
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = io.open(path, 'w', encoding='utf-8')
+
+    def add(self, framework, test, success):
+        records = []
+        for result in host_results(test) or [{'host': None,
+                                              'status': 'error'}]:
+            record = {
+                'role': framework.role_name,
+                'ansible_version': framework.ansible_version,
+                'test': test.name,
+                'test_file': test.test_file,
+                'success': success,
+                'test_duration': test.duration,
+                'shard': _shard(framework),
+                'timestamp': int(time.time())
+            }
+            record.update(result)
+            records.append(json.dumps(record, sort_keys=True))
+
+        with self._lock:
+            for record in records:
+                self._fd.write(six.text_type(record) + '\n')
+            self._fd.flush()
+
+    def close(self):
+        self._fd.close()
+
+
+class JUnitReport(object):
+    """
+    Writes a JUnit XML report with a testsuite per test file and a testcase
+    per host. The file is rewritten in place after each test so that it is
+    always a valid document.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd = io.open(path, 'w+', encoding='utf-8')
+        self._fd.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<testsuites>\n')
+        self._pos = self._fd.tell()
+        self._write_footer()
+
+    def _write_footer(self):
+        self._fd.write('</testsuites>\n')
+        self._fd.truncate()
+        self._fd.flush()
+
+    def add(self, framework, test, success):
+        classname = '%s.%s' % (framework.role_name, os.path.splitext(
+            os.path.basename(test.test_file or 'test_%d' % test.id))[0])
+
+        cases = []
+        failures = errors = 0
+        for result in host_results(test):
+            body = ''
+            if result['failure']:
+                failures += 1
+                body += '      <failure message=%s>%s</failure>\n' % (
+                    quoteattr(result['failure']['task'] or ''),
+                    escape(json.dumps(result['failure']['result'], indent=2,
+                                      sort_keys=True))
+                )
+            elif result['status'] == 'unreachable':
+                failures += 1
+                body += '      <failure message="unreachable"/>\n'
+            body += '      <system-out>%s</system-out>\n' % escape('\n'.join(
+                '%8s  %-8s  %s' % (
+                    task['duration'] is not None and
+                    '%.2fs' % task['duration'] or '-',
+                    task['state'], task['name'])
+                for task in result['tasks']
+            ))
+            cases.append(
+                '    <testcase classname=%s name=%s time="%.3f">\n%s'
+                '    </testcase>\n' % (quoteattr(classname),
+                                       quoteattr(result['host']),
+                                       result['duration'], body))
+
+        if not cases:
+            # the playbook never ran, eg. the containers failed to start
+            errors += 1
+            cases.append(
+                '    <testcase classname=%s name="setup" time="%.3f">\n'
+                '      <error message=%s/>\n'
+                '    </testcase>\n' % (quoteattr(classname),
+                                       test.duration or 0,
+                                       quoteattr(test.timed_out and
+                                                 '%s exceeded' % test.timed_out
+                                                 or 'test did not run')))
+
+        properties = ''
+        if _shard(framework):
+            properties = '    <properties>\n' \
+                '      <property name="shard" value=%s/>\n' \
+                '    </properties>\n' % quoteattr(_shard(framework))
+
+        suite = '  <testsuite name=%s tests="%d" failures="%d" ' \
+                'errors="%d" time="%.3f">\n%s%s  </testsuite>\n' % (
+                    quoteattr('%s [%s]' % (test.name,
+                                           framework.ansible_version)),
+                    len(cases), failures, errors, test.duration or 0,
+                    properties, ''.join(cases))
+
+        with self._lock:
+            self._fd.seek(self._pos)
+            self._fd.write(suite)
+            self._pos = self._fd.tell()
+            self._write_footer()
+
+    def close(self):
+        self._fd.close()
+
+
+def _shard(framework):
+    shard = getattr(framework, 'shard', None)
+    return shard and '%d/%d' % tuple(shard) or None
+
+
+REPORTS = {
+    'junit': JUnitReport,
+    'ndjson': NDJSONReport
+}
+
+
+def open_report(spec):
+    """
+    Create a reporter from a FORMAT:PATH specification
+    :param spec: eg. junit:results.xml
+    :return: a reporter
+    """
+    if ':' not in spec:
+        raise ValueError('invalid report %s, expected FORMAT:PATH' % spec)
+    fmt, path = spec.split(':', 1)
+    if fmt not in REPORTS:
+        raise ValueError('unknown report format %s, expected one of %s' % (
+            fmt, ', '.join(sorted(REPORTS))))
+    return REPORTS[fmt](path)
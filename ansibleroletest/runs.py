@@ -0,0 +1,304 @@
+from __future__ import unicode_literals, absolute_import
+
+import errno
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from multiprocessing.pool import ThreadPool
+
+from .utils import cache_dir
+
+# identifies the containers, networks and temporary folders of this process
+RUN_ID = uuid.uuid4().hex[:12]
+HOSTNAME = socket.gethostname()
+STARTED = int(time.time())
+
+LABEL_ID = 'art.run.id'
+LABEL_PID = 'art.run.pid'
+LABEL_HOST = 'art.run.host'
+LABEL_STARTED = 'art.run.started'
+
+OWNER_FILE = '.art-run'
+TMP_DIR = os.path.join(cache_dir, 'tmp')
+
+# set on the first ctrl+c, the frameworks stop starting new tests
+interrupted = threading.Event()
+
+
+def labels():
+    """
+    Labels given to every container and network created by this process
+    :return: dict
+    """
+    return {
+        LABEL_ID: RUN_ID,
+        LABEL_PID: str(os.getpid()),
+        LABEL_HOST: HOSTNAME,
+        LABEL_STARTED: str(STARTED)
+    }
+
+
+def cleared_labels():
+    """
+    Labels overriding the run labels in committed images, containers started
+    from a snapshot do not belong to any run
+    :return: dict
+    """
+    return dict((key, '') for key in labels())
+
+
+def run_info(values):
+    """
+    Extract the run a container or folder belongs to from its labels
+    :param values: dict of labels
+    :return: dict with the id, pid, host and started keys, None if the labels
+             do not belong to a run
+    """
+    values = values or {}
+    if not values.get(LABEL_ID):
+        return None
+    try:
+        return {
+            'id': values[LABEL_ID],
+            'pid': int(values.get(LABEL_PID) or 0),
+            'host': values.get(LABEL_HOST),
+            'started': int(values.get(LABEL_STARTED) or 0)
+        }
+    except ValueError:
+        return None
+
+
+def mark_owner(path):
+    """
+    Record the run a temporary folder belongs to
+    """
+    with open(os.path.join(path, OWNER_FILE), 'w') as fd:
+        json.dump(labels(), fd)
+
+
+def _process_started(pid):
+    """
+    Returns when a local process started, None if unknown (non-linux)
+    """
+    try:
+        with open('/proc/%d/stat' % pid) as fd:
+            # the command can contain spaces, fields start after it
+            fields = fd.read().rsplit(')', 1)[1].split()
+        with open('/proc/stat') as fd:
+            boot = next(int(line.split()[1]) for line in fd
+                        if line.startswith('btime'))
+        return boot + int(fields[19]) / os.sysconf(str('SC_CLK_TCK'))
+    except (IOError, OSError, IndexError, ValueError, StopIteration):
+        return None
+
+
+def is_alive(run):
+    """
+    Whether the process that created a run is still running
+    :param run: dict as returned by run_info
+    :return: True or False, None for runs of other machines
+    """
+    if run['id'] == RUN_ID:
+        return True
+    if run['host'] != HOSTNAME:
+        return None
+    try:
+        os.kill(run['pid'], 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+    # the pid may have been reused by a process started after the run
+    started = _process_started(run['pid'])
+    return started is None or started <= run['started'] + 1
+
+
+def is_orphan(run, max_age=None, now=None):
+    """
+    Whether the resources of a run can be removed: its process is dead or,
+    for runs of other machines, it started more than max_age seconds ago
+    """
+    alive = is_alive(run)
+    if alive is None:
+        now = now or time.time()
+        return max_age is not None and now - run['started'] > max_age
+    return not alive
+
+
+def orphaned_containers(client, max_age=None):
+    """
+    List the containers left behind by dead runs on a docker host
+    :param client: docker client
+    :param max_age: age after which runs of other machines are considered
+                    dead, they are never collected if None
+    :return: list of dicts with the id, name, image and run keys
+    """
+    orphans = []
+    for container in client.containers(all=True,
+                                       filters={'label': LABEL_ID}):
+        run = run_info(container.get('Labels'))
+        if run and is_orphan(run, max_age):
+            orphans.append({
+                'id': container['Id'],
+                'name': (container.get('Names') or [container['Id'][:12]])[0]
+                .lstrip('/'),
+                'image': container.get('Image'),
+                'run': run
+            })
+    return orphans
+
+
+def orphaned_networks(client, max_age=None):
+    """
+    Same as orphaned_containers, for networks
+    """
+    orphans = []
+    for network in client.networks():
+        run = run_info(network.get('Labels'))
+        if run and is_orphan(run, max_age):
+            orphans.append({
+                'id': network['Id'],
+                'name': network['Name'],
+                'run': run
+            })
+    return orphans
+
+
+def stale_dirs(max_age=None):
+    """
+    List the temporary folders left behind by dead runs, folders without an
+    owner are considered stale once older than max_age
+    :return: list of paths
+    """
+    if not os.path.isdir(TMP_DIR):
+        return []
+
+    now = time.time()
+    stale = []
+    for name in os.listdir(TMP_DIR):
+        path = os.path.join(TMP_DIR, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            with open(os.path.join(path, OWNER_FILE)) as fd:
+                run = run_info(json.load(fd))
+        except (IOError, OSError, ValueError):
+            run = None
+        if run is None:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if max_age is not None and now - mtime > max_age:
+                stale.append(path)
+        elif is_orphan(run, max_age, now):
+            stale.append(path)
+    return stale
+
+
+def remove_containers(client, ids, jobs=8):
+    """
+    Force the removal of containers (and their anonymous volumes)
+    concurrently
+    :return: list of (id, error) tuples, error is None on success
+    """
+    def _remove(container_id):
+        try:
+            client.remove_container(container_id, force=True, v=True)
+            return container_id, None
+        except Exception as e:
+            return container_id, e
+
+    if not ids:
+        return []
+    pool = ThreadPool(max(1, min(jobs, len(ids))))
+    try:
+        return pool.map(_remove, ids)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def remove_networks(client, ids):
+    """
+    Remove networks once their containers are gone
+    :return: list of (id, error) tuples, error is None on success
+    """
+    results = []
+    for network_id in ids:
+        try:
+            client.remove_network(network_id)
+            results.append((network_id, None))
+        except Exception as e:
+            results.append((network_id, e))
+    return results
+
+
+def teardown(clients, jobs=8):
+    """
+    Remove every container, network and temporary folder of this run, used
+    when the process is interrupted instead of the regular cleanup
+    :param clients: docker clients the run may have used
+    """
+    for client in clients:
+        try:
+            containers = client.containers(
+                all=True, filters={'label': '%s=%s' % (LABEL_ID, RUN_ID)})
+            remove_containers(client, [c['Id'] for c in containers], jobs)
+            remove_networks(client, [
+                network['Id'] for network in client.networks()
+                if (network.get('Labels') or {}).get(LABEL_ID) == RUN_ID
+            ])
+        except Exception as e:
+            sys.stderr.write('warning: could not clean up %s: %s\n' % (
+                client.base_url, e))
+
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            path = os.path.join(TMP_DIR, name)
+            try:
+                with open(os.path.join(path, OWNER_FILE)) as fd:
+                    owned = json.load(fd).get(LABEL_ID) == RUN_ID
+            except (IOError, OSError, ValueError):
+                continue
+            if owned:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def install_signal_handlers(clients):
+    """
+    The first SIGINT interrupts the run: KeyboardInterrupt is raised in the
+    main thread and the frameworks kill the running playbooks and skip the
+    remaining tests, so that the regular cleanup runs (snapshots, recap,
+    reports). SIGTERM and a second SIGINT tear the run down straight away,
+    the threads running the tests would not get a chance to clean up after
+    themselves.
+    :param clients: callable returning the docker clients in use
+    """
+    def _teardown(signum, _):
+        # another signal must not interrupt the teardown
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.stdout.flush()
+        sys.stderr.write('\ninterrupted, removing the containers of this '
+                         'run\n')
+        teardown(clients())
+        sys.stderr.flush()
+        os._exit(128 + signum)
+
+    def _interrupt(signum, frame):
+        if interrupted.is_set():
+            _teardown(signum, frame)
+        interrupted.set()
+        sys.stderr.write('\ninterrupted, stopping the tests (press ctrl+c '
+                         'again to remove the containers straight away)\n')
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGINT, _interrupt)
+    signal.signal(signal.SIGTERM, _teardown)
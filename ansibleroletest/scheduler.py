@@ -0,0 +1,318 @@
+from __future__ import unicode_literals, absolute_import
+
+import click
+import six
+import sys
+import threading
+import time
+
+from .container import ContainerManager
+from .framework import TestFramework
+from .output import Output
+from .test import Test
+
+
+class Endpoint(object):
+    """
+    A docker host tests can be scheduled on, each endpoint gets its own
+    ansible container
+    """
+
+    def __init__(self, client, capacity=1, name=None):
+        self.client = client
+        self.capacity = max(1, capacity)
+        self.name = name or client.base_url
+        self.framework = None
+        self.running = 0
+        self.scheduled = 0
+
+    @property
+    def load(self):
+        return float(self.running) / self.capacity
+
+
+class Scheduler(object):
+    """
+    Places each test on the least loaded endpoint, blocking when every
+    endpoint is running as many tests as its capacity allows
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError('at least one endpoint is required')
+        self.endpoints = endpoints
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Reserve a slot on the least loaded endpoint, endpoints with the same
+        load are used in turns
+        :return: Endpoint
+        """
+        with self._cond:
+            while True:
+                free = [endpoint for endpoint in self.endpoints
+                        if endpoint.running < endpoint.capacity]
+                if free:
+                    endpoint = min(free, key=lambda e: (e.load, e.scheduled))
+                    endpoint.running += 1
+                    endpoint.scheduled += 1
+                    return endpoint
+                self._cond.wait()
+
+    def release(self, endpoint):
+        """
+        Release a slot reserved with acquire
+        """
+        with self._cond:
+            endpoint.running -= 1
+            self._cond.notify()
+
+
+class DistributedTestFramework(object):
+    """
+    Runs the tests of a role on several docker hosts, the role is installed
+    on an ansible container on each of them and every test (with its
+    containers) is placed on the least loaded host
+    """
+
+    def __init__(self, endpoints, role, ansible_paths=None,
+                 ansible_version='latest', dependency_cache=None,
+                 resources=None, output=None, reporters=None,
+                 package_cache=None, history=None, shard=None,
+                 watchdog=None, shard_durations=None):
+        self.endpoints = endpoints
+        self.scheduler = Scheduler(endpoints)
+        self.output = output or Output()
+        for endpoint in endpoints:
+            endpoint.framework = TestFramework(
+                ContainerManager(endpoint.client), role, ansible_paths,
+                ansible_version, dependency_cache, resources, self.output,
+                reporters, package_cache, history, shard, watchdog,
+                shard_durations)
+        self.role_name = endpoints[0].framework.role_name
+        self.ansible_version = ansible_version
+        self.shard = shard
+        self.predicted = None
+        self.elapsed = None
+
+    @property
+    def res(self):
+        res = {'success': 0, 'skip': 0, 'failed': 0}
+        for endpoint in self.endpoints:
+            for key, value in endpoint.framework.res.items():
+                res[key] += value
+        return res
+
+    def cleanup(self, recap=True):
+        """
+        Cleanup every endpoint and display a single recap
+        """
+        for endpoint in self.endpoints:
+            endpoint.framework.output.header('ENDPOINT [%s]' % endpoint.name)
+            endpoint.framework.cleanup(recap=False)
+
+        if recap:
+            console = self.output.console
+            TestFramework.print_header('TESTS RECAP', console)
+            TestFramework.print_recap(self.role_name, self.res, console)
+            TestFramework.print_timing(self.predicted, self.elapsed, console)
+            TestFramework.print_shard(self.shard,
+                                      self.endpoints[0].framework.sharded,
+                                      console)
+            for endpoint in self.endpoints:
+                console.echo('  %-25s: tests=%d' % (endpoint.name,
+                                                  endpoint.scheduled))
+
+    def run(self, recap=True, **options):
+        """
+        Run all the tests, see TestFramework.run for the options
+        :return: 0 on success, 1 on error, 2 if no tests are found
+        """
+        try:
+            self._parallel([
+                endpoint.framework.setup for endpoint in self.endpoints
+            ])
+
+            # every endpoint has the same role installed, any of them can be
+            # used to discover the tests, slots are handed out in order so
+            # the longest tests start first
+            framework = self.endpoints[0].framework
+            test_files = framework.plan(
+                framework.test_files(),
+                sum(endpoint.capacity for endpoint in self.endpoints))
+            self.predicted = framework.predicted
+            tests = [(framework.load_test(test_file), test_file)
+                     for test_file in test_files]
+
+            if not tests and framework.sharded and framework.sharded[1]:
+                self.output.header('NO TESTS')
+                self.output.echo('no test in shard %d/%d' % self.shard)
+                return 0
+            if not tests:
+                self.output.header('NO TESTS')
+                self.output.echo('warning: no test found', fg='yellow')
+                return 2
+
+            start = time.time()
+            self._parallel([
+                self._scheduled(test, options) for test in tests
+            ], throttle=True)
+            self.elapsed = time.time() - start
+            if self.res['skip']:
+                # the run timed out before every test could start
+                return 1
+            return 0
+        except KeyboardInterrupt:
+            # the interrupted tests were counted by their own threads
+            framework = self.endpoints[0].framework
+            framework.errored = True
+            self.output.echo('\nerror: interrupted', fg='red')
+            return 1
+        except:
+            framework = self.endpoints[0].framework
+            framework.print_exception()
+            framework.res['failed'] += 1
+            return 1
+        finally:
+            self.cleanup(recap=recap)
+
+    def interrupt(self):
+        """
+        See TestFramework.interrupt
+        """
+        for endpoint in self.endpoints:
+            endpoint.framework.interrupt()
+
+    def _scheduled(self, test, options):
+        def _run(endpoint):
+            try:
+                endpoint.framework.run_test(
+                    Test(endpoint.framework, *test), **options)
+            finally:
+                self.scheduler.release(endpoint)
+        return _run
+
+    def _parallel(self, jobs, throttle=False):
+        """
+        Run each job in its own thread, re-raising the first error
+        :param jobs: list of callables
+        :param throttle: whether to wait for a free endpoint before starting
+                         each job, the job is then called with the endpoint
+        """
+        errors = []
+        threads = []
+
+        def _wrap(job, *args):
+            try:
+                job(*args)
+            except BaseException:
+                errors.append(sys.exc_info())
+
+        try:
+            for job in jobs:
+                args = throttle and (self.scheduler.acquire(),) or ()
+                thread = threading.Thread(target=_wrap, args=(job,) + args)
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # let the started jobs finish, their tests are killed
+            self.interrupt()
+            for thread in threads:
+                thread.join()
+            raise
+
+        if errors:
+            six.reraise(*errors[0])
+
+
+class FrameworkGroup(object):
+    """
+    Runs several frameworks concurrently, eg. the same role against several
+    ansible versions or a batch of roles, and displays a combined recap
+    """
+
+    def __init__(self, frameworks, concurrency=None):
+        self.frameworks = frameworks
+        self.concurrency = concurrency or len(frameworks)
+
+    @property
+    def res(self):
+        res = {'success': 0, 'skip': 0, 'failed': 0}
+        for framework in self.frameworks:
+            for key, value in framework.res.items():
+                res[key] += value
+        return res
+
+    def print_recap(self):
+        """
+        Display the results of every framework as a table
+        """
+        rows = [(framework.role_name, framework.ansible_version, framework.res)
+                for framework in self.frameworks]
+        rows.append(('TOTAL', '', self.res))
+
+        console = self.frameworks[0].output.console
+        TestFramework.print_header('TESTS RECAP', console)
+        console.echo('%-32s%-10s%-10s%-10s%s' % ('ROLE NAME', 'ANSIBLE',
+                                               'SUCCESS', 'SKIP', 'FAILED'))
+        for role_name, version, res in rows:
+            console.echo('%s%-10s%s%s%s' % (
+                click.style('%-32s' % role_name,
+                            fg=res['failed'] and 'red' or 'yellow'),
+                version,
+                click.style('%-10d' % res['success'], fg='green'),
+                click.style('%-10d' % res['skip'], fg='blue'),
+                click.style('%d' % res['failed'], fg='red'),
+            ))
+        TestFramework.print_shard(getattr(self.frameworks[0], 'shard', None),
+                                  console=console)
+
+    def run(self, **options):
+        """
+        Run the frameworks in their own threads, at most concurrency of them
+        at once, see TestFramework.run for the options
+        :return: 1 if any framework errored, 2 if none of them found tests,
+                 0 otherwise
+        """
+        codes = [None] * len(self.frameworks)
+        slots = threading.Semaphore(self.concurrency)
+
+        def _run(idx, framework):
+            try:
+                codes[idx] = framework.run(recap=False, **options)
+            finally:
+                slots.release()
+
+        threads = []
+        try:
+            for idx, framework in enumerate(self.frameworks):
+                slots.acquire()
+                thread = threading.Thread(target=_run, args=(idx, framework))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            # the running frameworks kill their tests and skip the other
+            # ones, the ones that did not start only remove their work folder
+            for framework in self.frameworks[:len(threads)]:
+                framework.interrupt()
+            for thread in threads:
+                thread.join()
+            for framework in self.frameworks[len(threads):]:
+                framework.cleanup(recap=False)
+
+        self.print_recap()
+
+        if 1 in codes or None in codes:
+            return 1
+        if 0 in codes:
+            return 0
+        return 2
@@ -1,13 +1,20 @@
-import click
-import datetime
+import humanize
+import itertools
 import json
 import os
 import six
 import slugify
+import time
+import uuid
 import yaml
 
+from .admission import DEFAULT_DEMAND
 from .container import ExecuteReturnCodeError
-from .utils import pull_image_progress, cache_dir
+from .images import box_image
+from .prepare import ImagePreparer
+from .receipts import merge_timings
+from .utils import pull_image_progress, parse_duration, parse_resources, \
+    cache_dir
 
 DEFAULT_CONTAINERS = {
     'centos-6': 'centos:6',
@@ -18,6 +25,22 @@ DEFAULT_CONTAINERS = {
     'ubuntu-15': 'ubuntu:15.04'
 }
 
+# kills a process and its descendants, used when a playbook times out. The
+# descendants are listed first as they would be reparented once killed.
+KILL_SCRIPT = """
+tree() {
+    echo $1
+    for child in $(cat /proc/$1/task/*/children 2>/dev/null); do
+        tree $child
+    done
+}
+pids=$(tree $(cat %s))
+kill -TERM $pids 2>/dev/null
+sleep 5
+kill -KILL $pids 2>/dev/null
+true
+"""
+
 DEFAULT_GROUPS = {
     'centos': ['centos-6', 'centos-7'],
     'debian': ['debian-wheezy', 'debian-jessie'],
@@ -31,22 +54,40 @@ class Test(object):
     """
 
     # internal counter for unnamed tests, just use that counter instead
-    _counter = 0
+    _counter = itertools.count(1)
+
+    # derived images built from the prepare section, shared by every test
+    preparer = ImagePreparer()
 
-    def __init__(self, framework, test):
+    def __init__(self, framework, test, test_file=None):
         self.framework = framework
         self.docker = self.framework.docker.new()
         self.role_name = self.framework.role_name
         self.test = test
-        Test._counter += 1
-        self.id = Test._counter
+        self.test_file = test_file
+        self.id = next(Test._counter)
 
-        self.containers = DEFAULT_CONTAINERS
-        self.groups = DEFAULT_GROUPS
+        # copies, as the containers get updated with their runtime info and
+        # tests can run concurrently
+        self.containers = DEFAULT_CONTAINERS.copy()
+        self.groups = DEFAULT_GROUPS.copy()
 
         self.inventory_file = 'inventory_%d' % self.id
         self.playbook_file = 'test_%d.yml' % self.id
         self.receipts_file = 'receipts_%d.yml' % self.id
+        self.timings_file = 'timings_%d.json' % self.id
+        self.pid_file = 'pid_%d' % self.id
+        self.timed_out = None
+        self.interrupted = False
+        self.network = None
+        self.reservation = None
+        self.receipts = {}
+        self.duration = None
+        self.output = self.framework.output.child(
+            '%s: %s' % (self.framework.output.name, self.name),
+            '%s-%s-test%d.log' % (self.role_name,
+                                  self.framework.ansible_version, self.id)
+        )
 
     @property
     def inventory(self):
@@ -57,7 +98,7 @@ class Test(object):
         for name, info in six.iteritems(self.containers):
             entry = '{0} ansible_ssh_host={1} ansible_ssh_user=ansible ' \
                     'ansible_ssh_pass=ansible' \
-                .format(name, info['container'].internal_ip)
+                .format(name, info['address'])
             for key, val in six.iteritems(info.get('vars', {})):
                 entry += ' {key}={val}'.format(key=key, val=repr(val))
             inventory += '%s\n' % entry
@@ -80,58 +121,126 @@ class Test(object):
             return self.test['name']
         return 'Test #%d' % self.id
 
+    @property
+    def timeout(self):
+        """
+        The timeout of the test playbook in seconds, from the timeout key of
+        the test file (eg. 10m), None to use the default one
+        """
+        if self.test.get('timeout') is None:
+            return None
+        return parse_duration(str(self.test['timeout']))
+
+    def load_receipts(self):
+        """
+        Load the receipts written by ansible during the test
+        :return: dict of receipts indexed by host, empty if the playbook did
+                 not run
+        """
+        receipt_file = os.path.join(self.framework.work_dir,
+                                    self.receipts_file)
+        if not os.path.exists(receipt_file):
+            return {}
+        with open(receipt_file) as fd:
+            receipts = json.load(fd)
+
+        timings_file = os.path.join(self.framework.work_dir,
+                                    self.timings_file)
+        if os.path.exists(timings_file):
+            with open(timings_file) as fd:
+                merge_timings(receipts, json.load(fd))
+        return receipts
+
     def cleanup(self, save=None):
         """
         Destroy all the test containers
         """
 
+        # keep the packages downloaded during the test for the next ones
+        package_cache = self.framework.package_cache
+        if package_cache:
+            for container in self.docker.containers.values():
+                package_cache.collect(container, self.output)
+
         # search for failed hosts in the receipts
         save_containers = []
-        receipt_file = os.path.join(self.framework.work_dir,
-                                    self.receipts_file)
-        if save and os.path.exists(receipt_file):
-            with open(receipt_file) as fd:
-                data = json.load(fd)
-                for hostname, result in six.iteritems(data):
-                    if save == 'all' or \
-                            (save == 'failed' and result['stats']['failed']) or \
-                            (save == 'successful' and not result['stats']['failed']) or \
-                            (save == 'unreachable' and result['stats']['unreachable']):
-                        save_containers.append({
-                            'name': hostname,
-                            'status': result['stats']['failed'] and 'failed' or 'successful',
-                            'task': result['tasks'].pop(),
-                            'metadata': result
-                        })
-
-        # and commit any failed host for inspection
+        self.receipts = self.load_receipts()
+        if self.timed_out and save in ('failed', 'all'):
+            # hosts that were still running the playbook have no receipts
+            for hostname in self.docker.containers:
+                if hostname not in self.receipts:
+                    save_containers.append({
+                        'name': hostname,
+                        'status': 'timeout',
+                        'task': {'name': self.timed_out},
+                        'metadata': {
+                            'stats': {'ok': 0, 'changed': 0,
+                                      'unreachable': 0, 'failed': 1},
+                            'tasks': []
+                        }
+                    })
+        if save:
+            for hostname, result in six.iteritems(self.receipts):
+                if save == 'all' or \
+                        (save == 'failed' and result['stats']['failed']) or \
+                        (save == 'successful' and not result['stats']['failed']) or \
+                        (save == 'unreachable' and result['stats']['unreachable']):
+                    save_containers.append({
+                        'name': hostname,
+                        'status': result['stats']['failed'] and 'failed' or 'successful',
+                        'task': result['tasks'][-1],
+                        'metadata': result
+                    })
+
+        # and hand any failed host to the committer for inspection, it will
+        # take care of removing the container once saved
         if save_containers:
-            self.framework.print_header('SAVING CONTAINERS')
+            self.output.header('SAVING CONTAINERS')
             for details in save_containers:
-                container = self.docker.containers[details['name']]
-                repo = 'art/{role_name}.{container}'.format(
-                    role_name=self.framework.role_name,
-                    container=details['name']
-                )
-                tag = '{status}-{date}'.format(
-                    status=details['status'],
-                    date=datetime.datetime.now().strftime('%s')
-                )
-                res = container.commit(repo, tag, json.dumps(details['metadata']))
-                click.secho(
-                    'ok: saved [%s] as [%s:%s]\n    id: %s   commit: %s' % (
+                container = self.docker.detach(details['name'])
+                self.network.disconnect(container)
+                date = int(time.time())
+                snapshot = {
+                    'repository': 'art/{role_name}.{container}'.format(
+                        role_name=self.framework.role_name,
+                        container=details['name']
+                    ),
+                    # several tests can save the same host in the same
+                    # second (other ansible versions, jobs or roles)
+                    'tag': '{status}-{date}-{uid}'.format(
+                        status=details['status'],
+                        date=date,
+                        uid=uuid.uuid4().hex[:8]
+                    ),
+                    'role': self.framework.role_name,
+                    'host': details['name'],
+                    'status': details['status'],
+                    'date': date,
+                    'task': details['task']['name']
+                }
+                self.framework.committer.submit(
+                    container, snapshot, details['metadata'])
+                self.output.echo(
+                    'queued: [%s] as [%s:%s]\n    commit: %s' % (
                         details['name'],
-                        repo,
-                        tag,
-                        res.get('Id')[:12],
+                        snapshot['repository'],
+                        snapshot['tag'],
                         details['task']['name']
                     ),
                     fg='green')
 
-        self.framework.print_header('CLEANING TEST CONTAINERS')
+        self.output.header('CLEANING TEST CONTAINERS')
         for name, container in six.iteritems(self.docker.containers):
             self.docker.destroy(name)
-            click.secho('ok: [%s]' % container.image, fg='green')
+            self.output.echo('ok: [%s]' % container.image, fg='green')
+        self.docker.destroy_networks()
+
+        if package_cache:
+            package_cache.evict()
+
+        if self.reservation:
+            self.framework.admission.release(self.reservation)
+            self.reservation = None
 
     def run(self, extra_vars=None, limit=None, skip_tags=None,
             tags=None, verbosity=None, privileged=False,
@@ -145,51 +254,145 @@ class Test(object):
         :param verbosity: augment verbosity of ansible
         :param privileged: start containers in privileged mode
         """
+        success = False
+        start = time.time()
         try:
-            self.framework.print_header('TEST [%s]' % self.name)
+            self.output.header('TEST [%s]' % self.name)
             self.setup(limit, privileged)
+            self.play(extra_vars, limit, skip_tags, tags, verbosity)
 
-            self.framework.print_header('RUNNING TESTS')
+            success = True
+            return True
+        except ExecuteReturnCodeError as e:
+            if self.timed_out:
+                self.output.echo('error: %s exceeded' % self.timed_out,
+                                 fg='red')
+            elif self.interrupted:
+                self.output.echo('error: interrupted', fg='red')
+            else:
+                self.output.echo(str(e), fg='red')
 
-            ansible_cmd = [
-                'ansible-playbook',
-                '-i', os.path.join('/work', self.inventory_file)
-            ]
+            return False
+        finally:
+            self.cleanup(save=save)
+            self.duration = time.time() - start
+            self.framework.report(self, success)
+            self.output.finish(success)
+            self.output.close()
 
-            if extra_vars:
-                for extra_var in extra_vars:
-                    ansible_cmd += ['--extra-vars', extra_var]
+    def play(self, extra_vars=None, limit=None, skip_tags=None, tags=None,
+             verbosity=None):
+        """
+        Run the test playbook on the running containers, raises
+        ExecuteReturnCodeError if the playbook fails
+        :param extra_vars: extra vars to pass to ansible
+        :param limit: limit on which targets to run the tests
+        :param skip_tags: skip certain tags
+        :param tags: run only those tags
+        :param verbosity: augment verbosity of ansible
+        """
+        self.output.header('RUNNING TESTS')
 
-            if limit:
-                ansible_cmd += ['--limit', limit]
+        ansible_cmd = [
+            'ansible-playbook',
+            '-i', os.path.join('/work', self.inventory_file)
+        ]
 
-            if skip_tags:
-                ansible_cmd += ['--skip-tags', skip_tags]
+        if extra_vars:
+            for extra_var in extra_vars:
+                ansible_cmd += ['--extra-vars', extra_var]
 
-            if tags:
-                ansible_cmd += ['--tags', tags]
+        if limit:
+            ansible_cmd += ['--limit', limit]
 
-            if verbosity:
-                ansible_cmd.append('-%s' % ('v' * verbosity))
+        if skip_tags:
+            ansible_cmd += ['--skip-tags', skip_tags]
 
-            ansible_cmd.append(os.path.join('/work', self.playbook_file))
+        if tags:
+            ansible_cmd += ['--tags', tags]
 
-            # docker's exec_create call doesn't allow you to set environment
-            # variables, hence the call to sh
-            final_cmd = ['sh', '-c', 'ANSIBLE_RECEIPTS_FILE="%s" %s' % (
-                os.path.join('/work', self.receipts_file),
-                ' '.join(map(six.moves.shlex_quote, ansible_cmd))
-            )]
+        if verbosity:
+            ansible_cmd.append('-%s' % ('v' * verbosity))
 
-            self.framework.stream(*final_cmd)
+        ansible_cmd.append(os.path.join('/work', self.playbook_file))
 
-            return True
-        except ExecuteReturnCodeError as e:
-            click.secho(str(e), fg='red')
+        # docker's exec_create call doesn't allow you to set environment
+        # variables, hence the call to sh, which also records the pid of the
+        # playbook so that it can be killed if it hangs
+        final_cmd = ['sh', '-c', 'echo $$ > "%s"; ANSIBLE_RECEIPTS_FILE="%s" '
+                                 'ART_TIMINGS_FILE="%s" exec %s' % (
+            os.path.join('/work', self.pid_file),
+            os.path.join('/work', self.receipts_file),
+            os.path.join('/work', self.timings_file),
+            ' '.join(map(six.moves.shlex_quote, ansible_cmd))
+        )]
 
-            return False
+        if self.interrupted:
+            raise ExecuteReturnCodeError('ansible-playbook')
+
+        watchdog = self.framework.watchdog
+        if watchdog:
+            watchdog.watch(self, self.timeout)
+        try:
+            self.framework.stream(*final_cmd, output=self.output)
         finally:
-            self.cleanup(save=save)
+            if watchdog:
+                watchdog.done(self)
+
+        if self.timed_out or self.interrupted:
+            raise ExecuteReturnCodeError('ansible-playbook')
+
+    def kill(self, reason):
+        """
+        Kill the playbook of the test and the processes it started, called by
+        the watchdog, the test then fails
+        :param reason: why the playbook was killed
+        """
+        self.timed_out = reason
+        self.output.echo('\nerror: %s exceeded, killing the playbook' % reason,
+                         fg='red')
+        self._kill_playbook()
+
+    def interrupt(self):
+        """
+        Kill the playbook of the test when the run is interrupted, the test
+        then fails
+        """
+        self.interrupted = True
+        self.output.echo('\nerror: interrupted, killing the playbook',
+                         fg='red')
+        self._kill_playbook()
+
+    def _kill_playbook(self):
+        try:
+            self.framework.ansible.execute([
+                'sh', '-c', KILL_SCRIPT % os.path.join('/work', self.pid_file)
+            ])
+        except (Exception, ExecuteReturnCodeError) as e:
+            self.output.echo('warning: could not kill the playbook: %s' % e,
+                             fg='yellow')
+
+    def reset(self, limit=None, privileged=False):
+        """
+        Replace the test containers by fresh ones started from their image,
+        the network of the test is kept
+        :param limit: limit which containers to start
+        :param privileged: start the containers in privileged mode
+        """
+        self.output.header('RESETTING CONTAINERS')
+        package_cache = self.framework.package_cache
+        for name, container in six.iteritems(self.docker.containers):
+            if package_cache:
+                package_cache.collect(container, self.output)
+            self.docker.destroy(name)
+            self.output.echo('ok: [%s]' % container.image, fg='green')
+
+        if self.reservation:
+            self.framework.admission.release(self.reservation)
+            self.reservation = None
+
+        self.start_containers(limit, privileged)
+        self.setup_inventory()
 
     def setup(self, limit=None, privileged=False):
         """
@@ -198,9 +401,20 @@ class Test(object):
         :param privileged:
         """
         self.setup_playbook()
+        self.setup_network()
         self.start_containers(limit, privileged)
         self.setup_inventory()
 
+    def setup_network(self):
+        """
+        Create a network dedicated to this test and attach the ansible
+        container to it, test containers are reachable through their aliases
+        and isolated from the ones of other tests
+        """
+        self.network = self.docker.create_network(
+            'art-%s' % uuid.uuid4().hex[:12])
+        self.network.connect(self.framework.ansible)
+
     def setup_playbook(self):
         """
         Extract the playbook from the test file and write it in our
@@ -226,6 +440,22 @@ class Test(object):
         with open(framework_file, 'w') as fd:
             fd.write(self.inventory)
 
+    def container_resources(self, info):
+        """
+        Returns the cpu and memory limits of a container, in order of
+        precedence: the container declaration, the test's resources key and
+        the resources key of the config file
+        :param info: the container declaration
+        :return: dict
+        """
+        resources = self.framework.resources.copy()
+        for declared in (parse_resources(self.test.get('resources')),
+                         parse_resources(info)):
+            for key, value in six.iteritems(declared):
+                if value is not None:
+                    resources[key] = value
+        return resources
+
     def start_containers(self, limit=None, privileged=False):
         """
         Starts the containers, if not containers are specified in the test
@@ -233,14 +463,14 @@ class Test(object):
         :param limit: limit which containers to start
         :param privileged: start the containers in privileged mode
         """
-        self.framework.print_header('STARTING CONTAINERS')
+        self.output.header('STARTING CONTAINERS')
 
         # TODO: potentially we'd want to scan the roles' meta file and create
         #       containers based on the advertised supported operating systems,
         #       the issue is that the format is kinda rough, like redhat and
         #       centos are merged under EL, and some distros are not available
         if 'containers' in self.test:
-            self.containers = self.test['containers']
+            self.containers = self.test['containers'].copy()
             self.groups = {}
 
         if 'groups' in self.test:
@@ -263,23 +493,74 @@ class Test(object):
                 info = {
                     'image': info
                 }
-                self.containers[name] = info
+            else:
+                info = info.copy()
+            info['resources'] = self.container_resources(info)
+            self.containers[name] = info
+
+        # wait for the docker host to have enough room for our containers,
+        # containers without limits are estimated using DEFAULT_DEMAND
+        demand = {'cpus': 0.0, 'memory': 0}
+        for info in self.containers.values():
+            for key in demand:
+                demand[key] += info['resources'][key] or DEFAULT_DEMAND[key]
+
+        def _waiting():
+            self.output.echo('waiting: not enough resources for %.1f cpus '
+                             'and %s of memory' % (
+                                 demand['cpus'],
+                                 humanize.naturalsize(demand['memory'])),
+                             fg='yellow')
+
+        # derived images are built first, their build container reserves
+        # resources of its own while the test does not hold any
+        images = {}
+        for name, info in six.iteritems(self.containers):
+            base_image = full_image = box_image(info['image'])
+            if self.test.get('prepare'):
+                full_image = Test.preparer.prepare(self, base_image)
+            images[name] = base_image, full_image
+
+        self.reservation = self.framework.admission.acquire(
+            demand['cpus'], demand['memory'], waiting=_waiting)
 
-            full_image = info['image']
-            if '/' not in full_image:
-                full_image = 'aeriscloud/ansible-%s' % info['image']
+        package_cache = self.framework.package_cache
+
+        for name, info in six.iteritems(self.containers):
+            base_image, full_image = images[name]
 
             # this binding allows systemd to properly start in a container
             bindings = [':'.join(['/sys/fs/cgroup', '/sys/fs/cgroup', 'ro'])]
+            if package_cache:
+                bindings.append(package_cache.binding(base_image))
+
+            # the ansible container is attached to the networks of every
+            # running test, aliases need to be unique across them
+            address = '%s.%s' % (name, self.network.name)
+
+            host_config = {
+                'Binds': bindings,
+                'Privileged': privileged,
+                'NetworkMode': self.network.name
+            }
+            if info['resources']['cpus']:
+                host_config['CpuPeriod'] = 100000
+                host_config['CpuQuota'] = int(
+                    info['resources']['cpus'] * 100000)
+            if info['resources']['memory']:
+                host_config['Memory'] = info['resources']['memory']
 
             # we need to create the VM first as images are pulled at that time
-            container = self.docker.create(name, image=full_image,
-                                           progress=pull_image_progress(),
-                                           host_config={
-                                              'Binds': bindings,
-                                              'Privileged': privileged
-                                           })
+            container = self.docker.create(
+                name, image=full_image,
+                progress=pull_image_progress(self.output.console),
+                host_config=host_config,
+                networking_config=self.network.networking_config([address])
+            )
 
             container.start()
+            if package_cache:
+                package_cache.seed(container, self.output)
             info['container'] = container
-            click.secho('ok: [%s]' % full_image, fg='green')
+            info['address'] = address
+            self.output.echo('ok: [%s]' % full_image, fg='green')
@@ -0,0 +1,93 @@
+"""
+Ansible callback plugin recording when each task starts and ends on each
+host. It is not used by ansible-role-test itself: the framework copies it in
+the work folder of the ansible container, the playbook of a test writes the
+timings to $ART_TIMINGS_FILE and they are merged into the receipts of the
+test (see receipts.merge_timings). Works with ansible 1.8 to 2.x.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+try:
+    from ansible.plugins.callback import CallbackBase
+except ImportError:
+    # ansible 1.x, or imported outside of ansible
+    CallbackBase = object
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'art_timings'
+
+    def __init__(self, *args, **kwargs):
+        if CallbackBase is not object:
+            super(CallbackModule, self).__init__(*args, **kwargs)
+        self.path = os.environ.get('ART_TIMINGS_FILE')
+        self.task = None
+        self.started = None
+        self.timings = {}
+
+    def _start(self, name):
+        self.task = name
+        self.started = time.time()
+
+    def _end(self, host):
+        if self.task is None or not self.path:
+            return
+        self.timings.setdefault(host, []).append({
+            'name': self.task,
+            'start': self.started,
+            'end': time.time()
+        })
+
+    def _write(self):
+        if not self.path:
+            return
+        with open(self.path + '.tmp', 'w') as fd:
+            json.dump(self.timings, fd)
+        os.rename(self.path + '.tmp', self.path)
+
+    # ansible 1.x
+    def playbook_on_task_start(self, name, is_conditional):
+        self._start(name)
+
+    def runner_on_ok(self, host, res):
+        self._end(host)
+
+    def runner_on_failed(self, host, res, ignore_errors=False):
+        self._end(host)
+
+    def runner_on_skipped(self, host, item=None):
+        self._end(host)
+
+    def runner_on_unreachable(self, host, res):
+        self._end(host)
+
+    def playbook_on_stats(self, stats):
+        self._write()
+
+    # ansible 2.x
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._start(task.get_name())
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._start(task.get_name())
+
+    def v2_runner_on_ok(self, result):
+        self._end(result._host.get_name())
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._end(result._host.get_name())
+
+    def v2_runner_on_skipped(self, result):
+        self._end(result._host.get_name())
+
+    def v2_runner_on_unreachable(self, result):
+        self._end(result._host.get_name())
+
+    def v2_playbook_on_stats(self, stats):
+        self._write()
@@ -1,18 +1,30 @@
 import appdirs
 import click
+import datetime
 import humanize
 import json
+import time
 
 
-def pull_image_progress():
+def pull_image_progress(console=None):
     """
     Provides a progressbar when pulling images, kinda rough for now
+    :param console: Console to display the progress on, defaults to the
+                    terminal
     """
     ids = {}
+    echo = console and console.echo or click.echo
+    # the bar is redrawn in place on a terminal, elsewhere (logs, event
+    # sinks) only its final state is displayed
+    live = console is None or console.tty
+    last = []
 
     def _internal(progress):
         if progress == 'finished':
-            click.echo('')
+            if live:
+                echo('')
+            elif last:
+                echo(last[-1])
             return
 
         progress = json.loads(progress.decode('utf-8'))
@@ -50,17 +62,126 @@ def pull_image_progress():
         else:
             pbar = '=' * 40
 
-        click.echo(
-            '\r\033[K{0}/{1} layers [{2}] {3}/{4}'.format(
-                done,
-                len(ids.keys()),
-                pbar,
-                humanize.naturalsize(current),
-                humanize.naturalsize(total)
-            ),
-            nl=False
+        line = '{0}/{1} layers [{2}] {3}/{4}'.format(
+            done,
+            len(ids.keys()),
+            pbar,
+            humanize.naturalsize(current),
+            humanize.naturalsize(total)
         )
+        if live:
+            echo('\r\033[K' + line, nl=False)
+        else:
+            last[:] = [line]
 
     return _internal
 
+
+def parse_date(value, end_of_day=False):
+    """
+    Convert an ISO-like date (YYYY-MM-DD, YYYY-MM-DDTHH:MM[:SS]) or a unix
+    timestamp to a unix timestamp
+    :param value:
+    :param end_of_day: a date without a time stands for the last second of
+                       that day instead of midnight, for upper bounds
+    :return: int
+    """
+    if value.isdigit():
+        return int(value)
+
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M:%S',
+                '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            date = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end_of_day and fmt == '%Y-%m-%d':
+            date += datetime.timedelta(days=1)
+            return int(time.mktime(date.timetuple())) - 1
+        return int(time.mktime(date.timetuple()))
+
+    raise ValueError('invalid date: %s' % value)
+
+
+def parse_duration(value):
+    """
+    Convert a duration such as 30m, 12h, 7d or 2w to a number of seconds,
+    plain numbers are considered to be seconds
+    :param value:
+    :return: int
+    """
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+    value = value.strip().lower()
+    try:
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError('invalid duration: %s' % value)
+
+
+def parse_size(value):
+    """
+    Convert a size such as 500M, 20G or 1.5T to a number of bytes, plain
+    numbers are considered to be bytes
+    :param value:
+    :return: int
+    """
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+    value = value.strip().lower().rstrip('b')
+    try:
+        if value[-1:] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise ValueError('invalid size: %s' % value)
+
+
+def format_duration(seconds):
+    """
+    Display a number of seconds as 12.3s or 4m05s
+    :param seconds:
+    :return: str
+    """
+    if seconds is None:
+        return '-'
+    if seconds < 60:
+        return '%.1fs' % seconds
+    return '%dm%02ds' % divmod(int(seconds), 60)
+
+
+def parse_shard(value):
+    """
+    Convert a INDEX/TOTAL shard specification, eg. 2/4, to a tuple
+    :param value:
+    :return: tuple of ints, the index starts at 1
+    """
+    try:
+        index, total = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError('invalid shard %s, expected INDEX/TOTAL' % value)
+    if total < 1 or not 1 <= index <= total:
+        raise ValueError('invalid shard %s, INDEX must be between 1 and '
+                         'TOTAL' % value)
+    return index, total
+
+
+def parse_resources(value):
+    """
+    Normalize a cpus/memory resource declaration, memory can either be a
+    number of bytes or a size such as 512M
+    :param value: dict with optional cpus and memory keys
+    :return: dict with the cpus as a float and the memory in bytes, unset
+             values are None
+    """
+    value = value or {}
+    cpus = value.get('cpus')
+    memory = value.get('memory')
+    if memory is not None and not isinstance(memory, int):
+        memory = parse_size(str(memory))
+    return {
+        'cpus': cpus is not None and float(cpus) or None,
+        'memory': memory
+    }
+
 cache_dir = appdirs.user_cache_dir('ansible_role_test', 'aeriscloud')
@@ -0,0 +1,168 @@
+from __future__ import unicode_literals, absolute_import
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+# inotify(7) events we care about, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def ignored(path):
+    """
+    Whether a change to that file should be ignored, eg. editor swap files
+    """
+    name = os.path.basename(path)
+    return name.startswith(('.', '#')) or name.endswith(('~', '.swp',
+                                                         '.swx', '.pyc')) \
+        or name == '4913'
+
+
+class FileWatcher(object):
+    """
+    Watches folders recursively for changes, using inotify on linux and
+    polling elsewhere
+    """
+
+    def __init__(self, paths, delay=0.3, interval=1.0):
+        """
+        :param paths: folders to watch
+        :param delay: time to wait for more changes once one is detected, so
+                      that saving several files triggers a single run
+        :param interval: polling interval when inotify is not available
+        """
+        self.paths = [os.path.realpath(path) for path in paths if path]
+        self.delay = delay
+        self.interval = interval
+        self._fd = None
+        self._watches = {}
+        self._mtimes = {}
+
+        if sys.platform.startswith('linux'):
+            try:
+                self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                         use_errno=True)
+                fd = self._libc.inotify_init()
+                if fd >= 0:
+                    self._fd = fd
+            except (OSError, AttributeError):
+                self._fd = None
+
+        if self._fd is not None:
+            for path in self.paths:
+                self._add_tree(path)
+        else:
+            self._mtimes = self._scan()
+
+    def _add_tree(self, path):
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            wd = self._libc.inotify_add_watch(
+                self._fd, root.encode(sys.getfilesystemencoding()),
+                WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = root
+
+    def _scan(self):
+        mtimes = {}
+        for path in self.paths:
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in files:
+                    filename = os.path.join(root, name)
+                    try:
+                        stat = os.stat(filename)
+                    except OSError:
+                        continue
+                    mtimes[filename] = (stat.st_mtime, stat.st_size)
+        return mtimes
+
+    def wait(self, timeout=None):
+        """
+        Block until files change
+        :param timeout: maximum time to wait in seconds
+        :return: set of changed paths, empty on timeout
+        """
+        changed = self._changes(timeout)
+        while changed:
+            more = self._changes(self.delay)
+            if not more:
+                break
+            changed |= more
+        return set(path for path in changed if not ignored(path))
+
+    def _changes(self, timeout):
+        if self._fd is None:
+            return self._poll(timeout)
+
+        try:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        if not ready:
+            return set()
+
+        data = os.read(self._fd, 65536)
+        changed = set()
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            root = self._watches.get(wd)
+            if root is None:
+                continue
+            path = root
+            if name:
+                path = os.path.join(
+                    root, name.decode(sys.getfilesystemencoding()))
+
+            if mask & IN_DELETE_SELF:
+                self._watches.pop(wd, None)
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+        return changed
+
+    def _poll(self, timeout):
+        deadline = timeout is not None and time.time() + timeout
+        while True:
+            mtimes = self._scan()
+            changed = set(
+                path for path in set(mtimes) | set(self._mtimes)
+                if mtimes.get(path) != self._mtimes.get(path)
+            )
+            self._mtimes = mtimes
+            if changed:
+                return changed
+            if deadline and time.time() >= deadline:
+                return set()
+            time.sleep(min(self.interval, deadline and
+                           max(0, deadline - time.time()) or self.interval))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,67 @@
+from __future__ import unicode_literals, absolute_import
+
+import threading
+import time
+
+from .utils import format_duration
+
+
+class Watchdog(object):
+    """
+    Kills the playbook of the tests running for longer than their timeout,
+    and of every running test once the deadline of the run has passed. A
+    single watchdog is shared by every framework of a run.
+    """
+
+    def __init__(self, timeout=None, run_timeout=None):
+        """
+        :param timeout: default timeout of a test playbook in seconds
+        :param run_timeout: time in seconds after which the running tests are
+                            killed and the remaining ones skipped
+        """
+        self.timeout = timeout
+        self.run_timeout = run_timeout
+        self.deadline = run_timeout and time.time() + run_timeout or None
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline of the run has passed
+        """
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def watch(self, test, timeout=None):
+        """
+        Start watching a test whose playbook is about to start
+        :param test: the Test object
+        :param timeout: timeout of that test, overrides the default one
+        """
+        limits = []
+        timeout = timeout or self.timeout
+        if timeout:
+            limits.append((timeout, 'test timeout of %s' %
+                           format_duration(timeout)))
+        if self.deadline is not None:
+            limits.append((max(0, self.deadline - time.time()),
+                           'run timeout of %s' %
+                           format_duration(self.run_timeout)))
+        if not limits:
+            return
+
+        delay, reason = min(limits)
+        timer = threading.Timer(delay, test.kill, (reason,))
+        timer.daemon = True
+        with self._lock:
+            self._timers[id(test)] = timer
+        timer.start()
+
+    def done(self, test):
+        """
+        Stop watching a test once its playbook is over
+        """
+        with self._lock:
+            timer = self._timers.pop(id(test), None)
+        if timer:
+            timer.cancel()
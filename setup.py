@@ -1,12 +1,29 @@
 from __future__ import absolute_import
 
+import sys
+
 from setuptools import setup, find_packages
+from setuptools.command.build_py import build_py as _build_py
 from ansibleroletest import __version__, __author__, __email__, __license__, __url__
 
+# modules using python 3.6 syntax, left out of older builds so that
+# byte-compiling the package does not fail
+PY36_MODULES = [('ansibleroletest', 'aio')]
+
+
+class build_py(_build_py):
+    def find_package_modules(self, package, package_dir):
+        modules = _build_py.find_package_modules(self, package, package_dir)
+        if sys.version_info >= (3, 6):
+            return modules
+        return [module for module in modules
+                if (module[0], module[1]) not in PY36_MODULES]
+
+
 install_requires = [
     'appdirs >= 1.4.0, < 2.0',
     'click >= 4.0, < 5.0',
-    'docker-py >= 1.10.0, < 1.11',
+    'docker-py >= 1.10.6, < 1.11',
     'giturlparse.py == 0.0.5',
     'humanize >= 0.5, < 0.6',
     'python-slugify >= 1.0.2, < 2.0',
@@ -24,6 +41,7 @@ setup(
     license=__license__,
     packages=find_packages(exclude=['tests.*', 'tests']),
     install_requires=install_requires,
+    cmdclass={'build_py': build_py},
     zip_safe=True,
     classifiers=[
         'Development Status :: 3 - Alpha',
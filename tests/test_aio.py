@@ -0,0 +1,97 @@
+from __future__ import unicode_literals, absolute_import
+
+import struct
+import sys
+
+import pytest
+
+if sys.version_info < (3, 6):
+    pytest.skip('the asyncio backend requires python 3.6+',
+                allow_module_level=True)
+
+import asyncio  # noqa: E402
+
+from ansibleroletest import aio  # noqa: E402
+from ansibleroletest.runs import RUN_ID, LABEL_ID  # noqa: E402
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def _frame(stream, data):
+    return struct.pack('>BxxxL', stream, len(data)) + data
+
+
+def _demultiplex(chunks):
+    async def _chunks():
+        for chunk in chunks:
+            yield chunk
+
+    async def _collect():
+        return [data async for data in aio._demultiplex(_chunks())]
+
+    return _run(_collect())
+
+
+def test_container_config_defaults():
+    config = aio._container_config({'image': 'centos:7', 'detach': True})
+    assert config['Image'] == 'centos:7'
+    assert config['Env'] == []
+    assert config['Tty'] is False
+    assert config['AttachStdout'] is False
+    assert config['AttachStderr'] is False
+    assert config['HostConfig'] == {}
+    assert config['Labels'][LABEL_ID] == RUN_ID
+    assert 'NetworkingConfig' not in config
+    assert 'Hostname' not in config
+
+
+def test_container_config_options():
+    config = aio._container_config({
+        'image': 'centos:7',
+        'detach': False,
+        'tty': True,
+        'command': ['sleep', '60'],
+        'environment': {'ANSIBLE_LIBRARY': '/usr/share/ansible/library'},
+        'labels': {'art.role': 'nginx'},
+        'host_config': {'Binds': ['/tmp:/work']},
+        'networking_config': {'EndpointsConfig': {'net': {}}},
+        'hostname': 'centos-7'
+    })
+    assert config['Cmd'] == ['sleep', '60']
+    assert config['Env'] == ['ANSIBLE_LIBRARY=/usr/share/ansible/library']
+    assert config['Tty'] is True
+    assert config['AttachStdout'] is True
+    assert config['Labels']['art.role'] == 'nginx'
+    assert config['Labels'][LABEL_ID] == RUN_ID
+    assert config['HostConfig'] == {'Binds': ['/tmp:/work']}
+    assert config['NetworkingConfig'] == {'EndpointsConfig': {'net': {}}}
+    assert config['Hostname'] == 'centos-7'
+
+
+def test_container_config_environment_list():
+    config = aio._container_config({'image': 'centos:7',
+                                    'environment': ['A=1', 'B=2']})
+    assert config['Env'] == ['A=1', 'B=2']
+
+
+def test_demultiplex_frames():
+    stream = _frame(1, b'stdout\n') + _frame(2, b'stderr\n')
+    assert _demultiplex([stream]) == [b'stdout\n', b'stderr\n']
+
+
+def test_demultiplex_split_frames():
+    # headers and payloads split over several reads
+    stream = _frame(1, b'hello ') + _frame(1, b'world\n') + _frame(2, b'')
+    chunks = [stream[i:i + 3] for i in range(0, len(stream), 3)]
+    assert _demultiplex(chunks) == [b'hello ', b'world\n', b'']
+
+
+def test_demultiplex_incomplete_frame():
+    stream = _frame(1, b'done') + _frame(1, b'truncated')[:10]
+    assert _demultiplex([stream]) == [b'done']
@@ -0,0 +1,68 @@
+from __future__ import unicode_literals, absolute_import
+
+import os
+import stat
+
+from ansibleroletest.packages import PackageCache
+
+
+def _package(cache, name, size, used):
+    path = os.path.join(cache.path, 'centos-7', name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as fd:
+        fd.write(b'x' * size)
+    os.utime(path, (used, used))
+    return path
+
+
+def test_binding_creates_the_image_folder(tmpdir):
+    cache = PackageCache(str(tmpdir.join('packages')))
+    binding = cache.binding('centos:7')
+
+    path = str(tmpdir.join('packages', 'centos-7'))
+    assert binding == path + ':' + PackageCache.CONTAINER_PATH
+    assert os.path.isdir(path)
+    # the box containers do not run as the owner of the folder
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o777
+
+    # an existing folder is reused
+    assert cache.binding('centos:7') == binding
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = PackageCache(str(tmpdir), max_size=250)
+    oldest = _package(cache, 'oldest.rpm', 100, 1000)
+    old = _package(cache, 'old.rpm', 100, 2000)
+    recent = _package(cache, 'recent.rpm', 100, 3000)
+    newest = _package(cache, 'newest.rpm', 100, 4000)
+
+    assert cache.evict() == 200
+    assert not os.path.exists(oldest)
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+    assert os.path.exists(newest)
+
+    # the cache already fits
+    assert cache.evict() == 0
+
+
+def test_evict_uses_access_time(tmpdir):
+    cache = PackageCache(str(tmpdir), max_size=100)
+    installed = _package(cache, 'installed.rpm', 100, 1000)
+    unused = _package(cache, 'unused.rpm', 100, 1000)
+    # installed by a later test, only its access time changes
+    os.utime(installed, (5000, 1000))
+
+    assert cache.evict() == 100
+    assert os.path.exists(installed)
+    assert not os.path.exists(unused)
+
+
+def test_evict_without_max_size(tmpdir):
+    cache = PackageCache(str(tmpdir))
+    package = _package(cache, 'package.rpm', 100, 1000)
+    assert cache.evict() == 0
+    assert os.path.exists(package)
+
+    assert PackageCache(str(tmpdir.join('missing')), max_size=1).evict() == 0
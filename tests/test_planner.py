@@ -0,0 +1,80 @@
+from __future__ import unicode_literals, absolute_import
+
+import io
+import json
+
+from ansibleroletest.planner import load_durations, makespan, shard_tests
+
+TEST_FILES = ['/role/tests/t%d.yml' % i for i in range(1, 11)]
+
+
+def _shards(total, durations=None, test_files=TEST_FILES):
+    return [shard_tests(test_files, index, total, durations)
+            for index in range(1, total + 1)]
+
+
+def _assert_partition(shards, test_files=TEST_FILES):
+    assigned = [test_file for shard in shards for test_file in shard]
+    assert sorted(assigned) == sorted(test_files)
+
+
+def test_shards_partition_the_tests():
+    for total in (1, 2, 3, 4, 11):
+        _assert_partition(_shards(total))
+
+
+def test_shards_do_not_depend_on_discovery_order():
+    assert _shards(3) == [
+        sorted(shard, key=TEST_FILES.index)
+        for shard in _shards(3, test_files=list(reversed(TEST_FILES)))
+    ]
+
+
+def test_shards_keep_discovery_order():
+    for shard in _shards(3):
+        assert shard == sorted(shard, key=TEST_FILES.index)
+
+
+def test_shards_balanced_by_shared_durations():
+    durations = {'t1': 100, 't2': 60, 't3': 50, 't4': 10}
+    shards = _shards(2, durations, TEST_FILES[:4])
+    _assert_partition(shards, TEST_FILES[:4])
+    assert shards == [['/role/tests/t1.yml', '/role/tests/t4.yml'],
+                      ['/role/tests/t2.yml', '/role/tests/t3.yml']]
+
+
+def test_shards_unknown_tests_count_as_the_longest():
+    durations = {'t1': 30, 't2': 10}
+    shards = _shards(3, durations, TEST_FILES[:4])
+    _assert_partition(shards, TEST_FILES[:4])
+    # t3 and t4 are new, they are expected to last 30s like t1
+    assert shards == [['/role/tests/t1.yml', '/role/tests/t2.yml'],
+                      ['/role/tests/t3.yml'], ['/role/tests/t4.yml']]
+
+
+def test_load_durations(tmpdir):
+    path = str(tmpdir.join('report.ndjson'))
+    records = [
+        {'role': 'nginx', 'test_file': '/role/tests/t1.yml',
+         'test': 'default', 'host': 'centos-7', 'test_duration': 12.5},
+        {'role': 'nginx', 'test_file': '/role/tests/t1.yml',
+         'test': 'default', 'host': 'debian', 'test_duration': 12.5},
+        {'role': 'nginx', 'test_file': '/other/tests/t1.yml',
+         'test': 'default', 'host': 'centos-7', 'test_duration': 20},
+        {'role': 'nginx', 'test_file': None, 'test': 'inline',
+         'host': None, 'test_duration': 3},
+        {'role': 'nginx', 'test_file': '/role/tests/t2.yml',
+         'test': 'error', 'host': None, 'test_duration': None},
+    ]
+    with io.open(path, 'w', encoding='utf-8') as fd:
+        for record in records:
+            fd.write(json.dumps(record) + '\n')
+        fd.write('\n')
+
+    assert load_durations([path]) == {'nginx': {'t1': 20.0, 'inline': 3.0}}
+
+
+def test_makespan():
+    assert makespan([]) == 0
+    assert makespan([10, 5, 5], slots=2) == 10
+    assert makespan([10, 5, 5], slots=1) == 20
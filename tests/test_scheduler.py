@@ -0,0 +1,105 @@
+from __future__ import unicode_literals, absolute_import
+
+import threading
+
+import pytest
+
+from ansibleroletest import framework
+from ansibleroletest.admission import AdmissionController
+from ansibleroletest.scheduler import DistributedTestFramework, Endpoint, \
+    Scheduler
+
+
+class FakeClient(object):
+    """
+    Stands for a docker client, the scheduler only needs its url
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+
+def _endpoints(*capacities):
+    return [Endpoint(FakeClient('tcp://host%d:2375' % idx), capacity)
+            for idx, capacity in enumerate(capacities)]
+
+
+def test_scheduler_requires_endpoints():
+    with pytest.raises(ValueError):
+        Scheduler([])
+
+
+def test_scheduler_least_loaded_first():
+    small, big = _endpoints(1, 4)
+    scheduler = Scheduler([small, big])
+
+    # both are idle, then big is the least loaded one until it is 1/4 full
+    assert scheduler.acquire() is small
+    assert scheduler.acquire() is big
+    assert scheduler.acquire() is big
+    assert (small.running, big.running) == (1, 2)
+
+    scheduler.release(small)
+    assert scheduler.acquire() is small
+
+
+def test_scheduler_ties_used_in_turns():
+    endpoints = _endpoints(2, 2, 2)
+    scheduler = Scheduler(endpoints)
+
+    placed = []
+    for _ in range(6):
+        endpoint = scheduler.acquire()
+        placed.append(endpoint)
+        scheduler.release(endpoint)
+
+    assert placed == endpoints * 2
+    assert [endpoint.scheduled for endpoint in endpoints] == [2, 2, 2]
+    assert [endpoint.running for endpoint in endpoints] == [0, 0, 0]
+
+
+def test_scheduler_blocks_when_full():
+    first, second = _endpoints(1, 1)
+    scheduler = Scheduler([first, second])
+    scheduler.acquire()
+    scheduler.acquire()
+
+    acquired = []
+    started = threading.Event()
+
+    def _acquire():
+        started.set()
+        acquired.append(scheduler.acquire())
+
+    thread = threading.Thread(target=_acquire)
+    thread.daemon = True
+    thread.start()
+    started.wait(1)
+
+    # every endpoint is at capacity
+    thread.join(0.2)
+    assert thread.is_alive()
+    assert acquired == []
+
+    scheduler.release(second)
+    thread.join(1)
+    assert not thread.is_alive()
+    assert acquired == [second]
+    assert (first.running, second.running) == (1, 1)
+
+
+def test_distributed_res_sums_endpoints(tmpdir, monkeypatch):
+    monkeypatch.setattr(framework, 'cache_dir', str(tmpdir))
+    endpoints = _endpoints(1, 2)
+    for endpoint in endpoints:
+        # configured capacity, the fake daemons are never queried
+        monkeypatch.setitem(
+            AdmissionController._controllers, endpoint.client.base_url,
+            AdmissionController(endpoint.client, cpus=1, memory=0))
+
+    distributed = DistributedTestFramework(endpoints, 'acme.nginx')
+    assert distributed.res == {'success': 0, 'skip': 0, 'failed': 0}
+
+    endpoints[0].framework.res.update(success=2, failed=1)
+    endpoints[1].framework.res.update(success=3, skip=1)
+    assert distributed.res == {'success': 5, 'skip': 1, 'failed': 1}